@@ -0,0 +1,253 @@
+"""
+Replays a mixed REST API workload against a generated dataset and reports
+per endpoint latency percentiles, throughput and queries per request.
+
+    python -m benchmarks.bench_api --users 20 --bucketlists 50 --items 20
+    python -m benchmarks.bench_api --output after.json --compare before.json
+    python -m benchmarks.bench_api --database-url postgresql:///bench
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+
+from bucketlist import create_app, db
+from bucketlist.models import User, Bucketlist, Items
+from bucketlist.seed import Seeder, WORDS
+
+
+PASSWORD = 'password'
+
+# Relative weight of each operation in the replayed traffic
+MIX = [
+    ('register', 2),
+    ('login', 5),
+    ('list', 20),
+    ('detail', 20),
+    ('items', 10),
+    ('item_create', 10),
+    ('item_update', 8),
+    ('item_delete', 5),
+    ('search', 12),
+    ('stats', 8),
+]
+
+
+def seed(users, bucketlists, items, rng):
+    '''
+    Generates a realistic dataset, returning for each user email the
+    {bucketlist id: [item ids]} it owns
+    '''
+    Seeder(bucketlists, items, password=PASSWORD,
+           seed=rng.random()).run(users)
+
+    owned = {}
+    for email, bucketlist_id in db.session.query(
+            Bucketlist.users_email, Bucketlist.id):
+        owned.setdefault(email, {})[bucketlist_id] = []
+    for bucketlist_id, item_id, email in db.session.query(
+            Items.bucketlist_id, Items.id, Bucketlist.users_email).join(
+            Bucketlist, Items.bucketlist_id == Bucketlist.id):
+        owned[email][bucketlist_id].append(item_id)
+    return owned
+
+
+class Workload(object):
+    '''
+    Turns a randomly chosen operation into a request for a random user
+    '''
+
+    def __init__(self, owned, tokens, rng):
+        self.owned = owned
+        self.tokens = tokens
+        self.rng = rng
+        self.created = 0
+
+    def request(self, operation):
+        email = self.rng.choice(sorted(self.owned))
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': self.tokens[email]}
+        bucketlists = self.owned[email]
+        bucketlist_id = self.rng.choice(sorted(bucketlists))
+        item_ids = bucketlists[bucketlist_id]
+        self.created += 1
+
+        if operation == 'register':
+            return 'POST', '/v1/auth/register/', {
+                'email': 'new{}@bench.com'.format(self.created),
+                'username': 'new{}'.format(self.created),
+                'first_name': 'New', 'last_name': 'User',
+                'password': PASSWORD}, {'Content-Type': 'application/json'}
+        if operation == 'login':
+            return 'POST', '/v1/auth/login/', {
+                'email': email, 'password': PASSWORD}, \
+                {'Content-Type': 'application/json'}
+        if operation == 'list':
+            return 'GET', '/v1/bucketlist/?cursor=&limit=20', None, headers
+        if operation == 'detail':
+            return 'GET', '/v1/bucketlist/{}'.format(bucketlist_id), None, \
+                headers
+        if operation == 'items':
+            return 'GET', '/v1/bucketlist/{}/items/?limit=20'.format(
+                bucketlist_id), None, headers
+        if operation == 'item_create':
+            return 'POST', '/v1/bucketlist/{}/items/'.format(bucketlist_id), \
+                {'name': 'new item {}'.format(self.created)}, headers
+        if operation == 'search':
+            return 'GET', '/v1/search?q={}'.format(
+                self.rng.choice(WORDS)[:4]), None, headers
+        if operation == 'stats':
+            return 'GET', '/v1/stats', None, headers
+        if not item_ids:
+            return self.request('item_create')
+        if operation == 'item_update':
+            return 'PUT', '/v1/bucketlist/{}/items/{}/'.format(
+                bucketlist_id, self.rng.choice(item_ids)), \
+                {'name': 'renamed {}'.format(self.created)}, headers
+        item_id = item_ids.pop(self.rng.randrange(len(item_ids)))
+        return 'DELETE', '/v1/bucketlist/{}/items/{}/'.format(
+            bucketlist_id, item_id), None, headers
+
+
+def percentile(values, fraction):
+    '''
+    Nearest rank percentile of sorted values
+    '''
+    index = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def query_count(response):
+    for timing in response.headers.getlist('Server-Timing'):
+        match = re.match(r'db;.*desc="(\d+) quer', timing)
+        if match:
+            return int(match.group(1))
+    return 0
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for operation in sorted(samples):
+        latencies = sorted(latency for latency, _, _ in samples[operation])
+        queries = [count for _, count, _ in samples[operation]]
+        endpoints[operation] = {
+            'requests': len(latencies),
+            'errors': sum(1 for _, _, status in samples[operation]
+                          if status >= 500),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'queries_per_request': round(
+                float(sum(queries)) / len(queries), 2)
+        }
+    total = sum(len(values) for values in samples.values())
+    return endpoints, {
+        'requests': total,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1) if elapsed else None
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, baseline=None):
+    print('{:>12} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+        'endpoint', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+    for operation, stats in results['endpoints'].items():
+        line = '{:>12} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            operation, stats['requests'], stats['p50_ms'], stats['p95_ms'],
+            stats['p99_ms'], stats['queries_per_request'])
+        before = (baseline or {}).get('endpoints', {}).get(operation)
+        if before and before['p95_ms']:
+            line += ' {:>+7.0%} p95'.format(
+                stats['p95_ms'] / before['p95_ms'] - 1)
+        print(line)
+    total = results['total']
+    print('{} requests in {}s, {} requests/s'.format(
+        total['requests'], total['seconds'], total['throughput_rps']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--bucketlists', type=float, default=20,
+                        help='mean bucketlists per user')
+    parser.add_argument('--items', type=float, default=10,
+                        help='mean items per bucketlist')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='disable the response cache')
+    parser.add_argument('--database-url')
+    parser.add_argument('--output', default='bench_api.json')
+    parser.add_argument('--compare', help='results of an earlier run')
+    options = parser.parse_args()
+
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = options.database_url or \
+        'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app.config['QUERY_BUDGET'] = None
+    # Every simulated user logs in from one address
+    app.extensions['login_throttle'] = None
+    if options.no_cache:
+        app.extensions['response_cache'] = None
+    app.app_context().push()
+    db.drop_all()
+    db.create_all()
+
+    rng = random.Random(options.seed)
+    owned = seed(options.users, options.bucketlists, options.items, rng)
+    tokens = {user.email: user.encode_auth_token(user.email)
+              for user in User.query.filter(User.email.in_(owned))}
+    workload = Workload(owned, tokens, rng)
+    operations = [operation for operation, _ in MIX]
+    weights = [weight for _, weight in MIX]
+
+    client = app.test_client()
+    samples = {}
+    started = time.perf_counter()
+    for _ in range(options.requests):
+        operation = rng.choices(operations, weights)[0]
+        method, url, body, headers = workload.request(operation)
+        before = time.perf_counter()
+        response = client.open(url, method=method, headers=headers,
+                               data=json.dumps(body) if body else None)
+        latency = time.perf_counter() - before
+        samples.setdefault(operation, []).append(
+            (latency, query_count(response), response.status_code))
+    endpoints, total = summarize(samples, time.perf_counter() - started)
+
+    results = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(),
+        'database': db.engine.dialect.name,
+        'options': {name: value for name, value in vars(options).items()
+                    if name not in ('output', 'compare', 'database_url')},
+        'endpoints': endpoints,
+        'total': total
+    }
+    baseline = None
+    if options.compare:
+        with open(options.compare) as stream:
+            baseline = json.load(stream)
+    report(results, baseline)
+    with open(options.output, 'w') as stream:
+        json.dump(results, stream, indent=2)
+    print('Saved results to {}'.format(options.output))
+
+
+if __name__ == '__main__':
+    main()
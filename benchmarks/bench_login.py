@@ -0,0 +1,67 @@
+"""
+Compares the cost of a throttled login attempt with one that reaches the
+password check.
+
+    python -m benchmarks.bench_login --attempts 200
+"""
+import argparse
+import json
+import os
+import tempfile
+import timeit
+
+from bucketlist import create_app, db
+from bucketlist.models import User
+from bucketlist.throttle import ThrottlePolicy, MemoryThrottleBackend
+
+
+EMAIL = 'bench@bucket.com'
+
+
+def login(client, password):
+    return client.post('/v1/auth/login/', data=json.dumps(
+        {'email': EMAIL, 'password': password}),
+        content_type='application/json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--attempts', type=int, default=200)
+    options = parser.parse_args()
+
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'bench.sqlite')
+    app.config['QUERY_BUDGET'] = None
+    app.app_context().push()
+    db.create_all()
+    db.session.add(User(email=EMAIL, username='bench', first_name='bench',
+                        last_name='user', password='password'))
+    db.session.commit()
+    client = app.test_client()
+
+    app.extensions['login_throttle'] = None
+    checked = timeit.timeit(lambda: login(client, 'wrong'),
+                            number=options.attempts) / options.attempts
+
+    # One attempt a day, so every attempt after the first is refused
+    policy = ThrottlePolicy(MemoryThrottleBackend(), (1, 86400), (1, 86400))
+    app.extensions['login_throttle'] = policy
+    assert login(client, 'wrong').status_code == 400
+    assert login(client, 'wrong').status_code == 429
+    refused = timeit.timeit(lambda: login(client, 'wrong'),
+                            number=options.attempts) / options.attempts
+    decision = timeit.timeit(lambda: policy.check(EMAIL, '127.0.0.1'),
+                             number=options.attempts * 100) / \
+        (options.attempts * 100)
+
+    print('{:>28} {:>12}'.format('', 'per attempt'))
+    print('{:>28} {:>9.3f} ms'.format('password checked', checked * 1000))
+    print('{:>28} {:>9.3f} ms'.format('refused, whole request',
+                                      refused * 1000))
+    print('{:>28} {:>9.2f} us'.format('refused, throttle decision',
+                                      decision * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Compares page (OFFSET + COUNT) and cursor (keyset) listing latency
+from the first page to the last.
+
+    python -m benchmarks.bench_pagination --pages 10000 --limit 10
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import timeit
+
+from bucketlist import create_app, db
+from bucketlist.models import User, Bucketlist
+from bucketlist.pagination import encode_cursor
+
+
+def seed(email, rows):
+    user = User(email=email, username='bench', first_name='bench',
+                last_name='user', password='password')
+    db.session.add(user)
+    db.session.commit()
+
+    start = datetime.datetime(2015, 1, 1)
+    batch = []
+    for number in range(rows):
+        created = start + datetime.timedelta(minutes=number)
+        batch.append({
+            'title': 'list {}'.format(number)[:25],
+            'date_created': created,
+            'date_modified': created,
+            'users_email': email
+        })
+        if len(batch) == 10000:
+            db.session.bulk_insert_mappings(Bucketlist, batch)
+            batch = []
+    if batch:
+        db.session.bulk_insert_mappings(Bucketlist, batch)
+    db.session.commit()
+    return user
+
+
+def cursor_for_page(email, page, limit):
+    '''
+    Cursor pointing just before the first row of page
+    '''
+    if page == 1:
+        return ''
+    row = Bucketlist.query.filter_by(users_email=email).order_by(
+        Bucketlist.date_created, Bucketlist.id).offset(
+        (page - 1) * limit - 1).first()
+    return encode_cursor(row.date_created, row.id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=10000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    options = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.app_context().push()
+    db.create_all()
+
+    email = 'bench@bucket.com'
+    user = seed(email, options.pages * options.limit)
+    headers = {'Authorization': user.encode_auth_token(email)}
+    client = app.test_client()
+
+    checkpoints = [1, 10, 100, 1000, 10000, options.pages]
+    checkpoints = sorted(set(p for p in checkpoints if p <= options.pages))
+
+    print('{:>8} {:>12} {:>12}'.format('page', 'page ms', 'cursor ms'))
+    for page in checkpoints:
+        cursor = cursor_for_page(email, page, options.limit)
+        page_url = '/v1/bucketlist/?page={}&limit={}'.format(
+            page, options.limit)
+        cursor_url = '/v1/bucketlist/?cursor={}&limit={}'.format(
+            cursor, options.limit)
+
+        by_page = min(timeit.repeat(
+            lambda: client.get(page_url, headers=headers),
+            number=1, repeat=options.repeat))
+        by_cursor = min(timeit.repeat(
+            lambda: client.get(cursor_url, headers=headers),
+            number=1, repeat=options.repeat))
+        print('{:>8} {:>12.2f} {:>12.2f}'.format(
+            page, by_page * 1000, by_cursor * 1000))
+
+
+if __name__ == '__main__':
+    main()
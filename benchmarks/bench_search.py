@@ -0,0 +1,124 @@
+"""
+Compares substring (ILIKE '%q%') matching with full-text search over
+bucketlist titles and item names.
+
+    python -m benchmarks.bench_search --rows 1000000
+    python -m benchmarks.bench_search --database-url postgresql:///bench
+"""
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import timeit
+
+from bucketlist import create_app, db
+from bucketlist.models import User, Bucketlist, Items
+from bucketlist.search import search
+
+
+WORDS = [
+    'visit', 'travel', 'climb', 'learn', 'read', 'write', 'cook', 'swim',
+    'run', 'build', 'paint', 'sing', 'dance', 'ride', 'sail', 'fly',
+    'lagos', 'accra', 'nairobi', 'kigali', 'cairo', 'paris', 'tokyo',
+    'lima', 'mountain', 'ocean', 'desert', 'river', 'forest', 'island',
+    'guitar', 'piano', 'marathon', 'novel', 'garden', 'bridge', 'castle',
+]
+
+QUERIES = ['travel', 'kilimanjaro', 'visit lagos', 'mara']
+
+
+def phrase(rng, words, length):
+    return ' '.join(rng.choice(words) for _ in range(length))
+
+
+def seed(email, rows, items_per_list):
+    '''
+    Creates rows items spread over rows / items_per_list bucketlists
+    '''
+    rng = random.Random(1)
+    db.session.add(User(email=email, username='bench', first_name='bench',
+                        last_name='user', password='password'))
+    db.session.commit()
+
+    now = datetime.datetime.now()
+    bucketlists = max(rows // items_per_list, 1)
+    batch = []
+    for number in range(bucketlists):
+        batch.append({
+            'title': '{} {}'.format(phrase(rng, WORDS, 2), number)[:25],
+            'date_created': now,
+            'date_modified': now,
+            'users_email': email
+        })
+        if len(batch) == 10000:
+            db.session.bulk_insert_mappings(Bucketlist, batch)
+            batch = []
+    if batch:
+        db.session.bulk_insert_mappings(Bucketlist, batch)
+    db.session.commit()
+
+    first = db.session.query(db.func.min(Bucketlist.id)).scalar()
+    batch = []
+    for number in range(rows):
+        # A rare word now and then so selective queries have hits too
+        words = WORDS + ['kilimanjaro'] if number % 1000 == 0 else WORDS
+        batch.append({
+            'name': '{} {}'.format(phrase(rng, words, 4), number),
+            'bucketlist_id': first + number % bucketlists,
+            'date_created': now,
+            'date_modified': now,
+            'done': False
+        })
+        if len(batch) == 10000:
+            db.session.bulk_insert_mappings(Items, batch)
+            batch = []
+    if batch:
+        db.session.bulk_insert_mappings(Items, batch)
+    db.session.commit()
+
+
+def substring(email, query, limit):
+    pattern = '%{}%'.format(query)
+    bucketlists = Bucketlist.query.filter(
+        Bucketlist.users_email == email,
+        Bucketlist.title.ilike(pattern)).limit(limit).all()
+    items = Items.query.join(Items.bucketlist).filter(
+        Bucketlist.users_email == email,
+        Items.name.ilike(pattern)).limit(limit).all()
+    return bucketlists, items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--items-per-list', type=int, default=10)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--database-url')
+    options = parser.parse_args()
+
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = options.database_url or \
+        'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app.app_context().push()
+    db.drop_all()
+    db.create_all()
+
+    email = 'bench@bucket.com'
+    seed(email, options.rows, options.items_per_list)
+
+    print('{:>14} {:>14} {:>12}'.format('query', 'substring ms', 'search ms'))
+    for query in QUERIES:
+        by_substring = min(timeit.repeat(
+            lambda: substring(email, query, options.limit),
+            number=1, repeat=options.repeat))
+        by_search = min(timeit.repeat(
+            lambda: search(email, query, options.limit),
+            number=1, repeat=options.repeat))
+        print('{:>14} {:>14.2f} {:>12.2f}'.format(
+            query, by_substring * 1000, by_search * 1000))
+
+
+if __name__ == '__main__':
+    main()
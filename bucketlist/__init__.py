@@ -1,4 +1,5 @@
 import os
+import sqlite3
 
 from flask import Flask
 from flask_jwt import JWT
@@ -6,6 +7,8 @@ from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from flask_restful import Api
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 
 from bucketlist.config import app_config
@@ -16,24 +19,79 @@ api = Api()
 jwt = JWT()
 
 
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    '''
+    SQLite ignores foreign keys, and so ON DELETE CASCADE, unless asked
+    '''
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def trust_proxies(wsgi_app, hops):
+    '''
+    Takes the client address and scheme from the X-Forwarded-For and
+    X-Forwarded-Proto headers, trusting only the last hops proxies to
+    have set them
+    '''
+    try:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+    except ImportError:
+        # Werkzeug before 0.15
+        from werkzeug.contrib.fixers import ProxyFix
+        return ProxyFix(wsgi_app, num_proxies=hops)
+    return ProxyFix(wsgi_app, x_for=hops, x_proto=hops)
+
+
 def create_app(config_name):
     if os.getenv('FLASK_CONFIG') == "production":
         app = Flask(__name__)
         app.config.update(
             SECRET_KEY=os.environ['SECRET_KEY'],
-            SQLALCHEMY_DATABASE_URI=os.environ['DATABASE_URL']
+            SQLALCHEMY_DATABASE_URI=os.environ['DATABASE_URL'],
+            PROXY_FIX_HOPS=int(os.getenv('PROXY_FIX_HOPS', 1))
         )
     else:
         app = Flask(__name__, instance_relative_config=True)
         app.config.from_object(app_config[config_name])
         app.config.from_pyfile('config.py')
 
+    # Behind a router, remote_addr is the router's address, which would
+    # make the per address login limit a limit on the whole site
+    if app.config.get('PROXY_FIX_HOPS'):
+        app.wsgi_app = trust_proxies(app.wsgi_app,
+                                     app.config['PROXY_FIX_HOPS'])
+
     api.init_app(app)
     db.init_app(app)
 
+    from bucketlist.cache import ResponseCache
+    app.extensions['response_cache'] = ResponseCache.from_config(app.config)
+
+    from bucketlist import instrumentation
+    instrumentation.init_app(app)
+
+    from bucketlist import metrics
+    metrics.init_app(app)
+
+    from bucketlist import passwords
+    passwords.init_app(app)
+
+    from bucketlist import throttle
+    throttle.init_app(app)
+
     from bucketlist.models import User
     global jwt
     jwt = JWT(app, User.authenticate, User.identity)
+
+    from bucketlist import tokens
+    tokens.init_app(app, jwt)
+
+    from bucketlist import revocation
+    revocation.init_app(app)
+
     login_manager.init_app(app)
     login_manager.login_message = "You must be logged in to have access"
     login_manager.login_view = "auth.login_api"
@@ -45,4 +103,9 @@ def create_app(config_name):
     from .home import home as home_blueprint
     app.register_blueprint(home_blueprint)
 
+    from bucketlist.commands import prune_tokens, repair_counts, seed
+    app.cli.add_command(prune_tokens)
+    app.cli.add_command(repair_counts)
+    app.cli.add_command(seed)
+
     return app
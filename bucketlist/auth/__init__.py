@@ -31,3 +31,15 @@ auth.add_url_rule(
     view_func=views.LoginAPI.as_view('login_api'),
     methods=['POST']
 )
+
+auth.add_url_rule(
+    '/v1/auth/refresh/',
+    view_func=views.RefreshAPI.as_view('refresh_api'),
+    methods=['POST']
+)
+
+auth.add_url_rule(
+    '/v1/auth/logout/',
+    view_func=views.LogoutAPI.as_view('logout_api'),
+    methods=['POST']
+)
@@ -1,11 +1,16 @@
 import datetime
 
-from flask import request, make_response, jsonify
+import jwt
+from flask import current_app, g, request, make_response, jsonify
 from flask.views import MethodView
+from flask_jwt import jwt_required
+from sqlalchemy.exc import IntegrityError
 
 from bucketlist import db
 from bucketlist.models import User
-from ..decorators import validate_user_credentials
+from bucketlist.revocation import revoke, verify_refresh_token
+from ..decorators import throttle_login, validate_login_credentials, \
+    validate_user_credentials
 
 
 class RegisterAPI(MethodView):
@@ -15,7 +20,7 @@ class RegisterAPI(MethodView):
     """
     @validate_user_credentials
     def post(self):
-        data = request.get_json()
+        data = g.payload
 
         user = User.query.filter_by(email=data.get('email')).first()
         if not user:
@@ -49,8 +54,10 @@ class LoginAPI(MethodView):
     """
     now = datetime.datetime.now()
 
+    @validate_login_credentials
+    @throttle_login
     def post(self):
-        data = request.get_json()
+        data = g.payload
         user = User.query.filter_by(email=data.get('email')).first()
         if not user:
             response = {
@@ -60,12 +67,12 @@ class LoginAPI(MethodView):
             return make_response(jsonify(response), 400)
         password = data.get('password')
         if user.verify_password(password):
-            auth_token = user.encode_auth_token(user.email)
-            response = {
+            # Saves the password hash if it was upgraded
+            db.session.commit()
+            response = dict(token_pair(user), **{
                 'status': "Success",
-                'message': "Successfully logged in",
-                "auth_token": auth_token
-            }
+                'message': "Successfully logged in"
+            })
             return make_response(jsonify(response)), 200
         else:
             response = {
@@ -73,3 +80,71 @@ class LoginAPI(MethodView):
                 'message': "User password combination failed to match"
             }
             return make_response(jsonify(response)), 400
+
+
+def token_pair(user):
+    return {
+        'auth_token': user.encode_auth_token(user.email),
+        'refresh_token': user.encode_refresh_token(user.email),
+        'expires_in': current_app.config.get('ACCESS_TOKEN_SECONDS', 900)
+    }
+
+
+class RefreshAPI(MethodView):
+    """
+        Exchanges a refresh token for a new access and refresh token
+    """
+
+    def post(self):
+        data = request.get_json(silent=True) or {}
+        response = {
+            'status': "Failed",
+            'message': "Invalid refresh token. Log in to continue."
+        }
+        try:
+            claims = verify_refresh_token(str(data.get('refresh_token', '')))
+        except jwt.InvalidTokenError:
+            return make_response(jsonify(response)), 401
+        user = User.query.get(claims['id'])
+        if not user or user.email != claims['email']:
+            return make_response(jsonify(response)), 401
+
+        # The unique jti lets only one exchange of a token succeed
+        revoke(claims)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return make_response(jsonify(response)), 401
+        response = dict(token_pair(user), status="Success")
+        return make_response(jsonify(response)), 200
+
+
+class LogoutAPI(MethodView):
+    """
+        Revokes the request's access token and the refresh token sent
+        with it
+    """
+
+    @jwt_required()
+    def post(self):
+        token, claims = g.verified_token
+        if claims.get('jti'):
+            revoke(claims)
+        data = request.get_json(silent=True) or {}
+        if data.get('refresh_token'):
+            try:
+                refresh = verify_refresh_token(str(data['refresh_token']))
+            except jwt.InvalidTokenError:
+                refresh = None
+            if refresh and refresh['id'] == claims.get('id'):
+                revoke(refresh)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        response = {
+            'status': "Success",
+            'message': "Successfully logged out"
+        }
+        return make_response(jsonify(response)), 200
@@ -0,0 +1,193 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheBackend(object):
+    '''
+    Storage used by ResponseCache. Values are strings and entries may
+    disappear at any time, so a backend only needs to be a best effort
+    key/value store.
+    '''
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+
+class LRUCacheBackend(CacheBackend):
+    '''
+    In-process cache holding at most max_entries values for ttl seconds,
+    evicting the least recently used entry first
+    '''
+
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value, expires = self._entries.get(key, ('0', None))
+            value = str(int(value) + 1)
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            return int(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedCacheBackend(CacheBackend):
+    '''
+    Adapts a shared store client exposing the redis style
+    get/set(ex=)/delete/incr calls, so every worker sees one cache
+    '''
+
+    def __init__(self, client, ttl=30):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(key)
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(key, value, ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return int(self.client.incr(key))
+
+
+class LocalSharedClient(object):
+    '''
+    Stand-in for a shared store client, for development and tests
+    '''
+
+    def __init__(self):
+        self.backend = LRUCacheBackend(max_entries=float('inf'), ttl=None)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, ex=None):
+        self.backend.set(key, value, ttl=ex)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def incr(self, key):
+        return self.backend.incr(key)
+
+
+class ResponseCache(object):
+    '''
+    Caches serialized read responses per user. Writes bump the user's
+    generation number, which makes every key built before it unreachable,
+    so invalidation costs one increment whatever the backend is.
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        kind = config.get('RESPONSE_CACHE')
+        ttl = config.get('RESPONSE_CACHE_TTL', 30)
+        if not kind:
+            return None
+        if kind == 'lru':
+            if config.get('WEB_CONCURRENCY', 1) > 1:
+                # Other workers would keep serving what a write replaced
+                raise ValueError(
+                    "RESPONSE_CACHE 'lru' is per process; use 'shared' "
+                    'with more than one worker')
+            backend = LRUCacheBackend(
+                max_entries=config.get('RESPONSE_CACHE_MAX_ENTRIES', 1024),
+                ttl=ttl)
+        elif kind == 'shared':
+            client = config.get('RESPONSE_CACHE_CLIENT') or \
+                LocalSharedClient()
+            backend = SharedCacheBackend(client, ttl=ttl)
+        else:
+            raise ValueError('Unknown RESPONSE_CACHE: {}'.format(kind))
+        return cls(backend)
+
+    def generation(self, user_id):
+        return self.backend.get('gen:{}'.format(user_id)) or '0'
+
+    def key(self, user_id, endpoint, path, args):
+        query = '&'.join('{}={}'.format(name, value)
+                         for name, value in sorted(args.items(multi=True)))
+        return 'resp:{}:{}:{}:{}?{}'.format(
+            user_id, self.generation(user_id), endpoint, path, query)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is not None:
+            return json.loads(value)
+
+    def set(self, key, body, status, headers=None):
+        self.backend.set(key, json.dumps([body, status, headers or {}]))
+
+    def invalidate(self, user_id):
+        self.backend.incr('gen:{}'.format(user_id))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+        }
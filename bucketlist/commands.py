@@ -0,0 +1,58 @@
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from bucketlist.models import Bucketlist, RevokedToken
+from bucketlist.seed import Seeder
+
+
+@click.command('repair-counts')
+@with_appcontext
+def repair_counts():
+    '''
+    Recomputes every bucketlist's item_count and done_count from its items
+    '''
+    repaired = Bucketlist.recount()
+    click.echo('Repaired {} bucketlists'.format(repaired))
+
+
+@click.command('prune-tokens')
+@with_appcontext
+def prune_tokens():
+    '''
+    Deletes revoked token rows for tokens that have expired
+    '''
+    pruned = RevokedToken.prune()
+    click.echo('Pruned {} revoked tokens'.format(pruned))
+
+
+@click.command('seed')
+@click.option('--users', default=1000, show_default=True,
+              help='Users to create.')
+@click.option('--bucketlists', default=5.0, show_default=True,
+              help='Mean bucketlists per user.')
+@click.option('--items', default=10.0, show_default=True,
+              help='Mean items per bucketlist.')
+@click.option('--years', default=3, show_default=True,
+              help='Years of history to spread timestamps over.')
+@click.option('--password', default='password', show_default=True,
+              help='Password every generated user logs in with.')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Rows written per insert.')
+@click.option('--seed', type=int, help='Random seed, for repeatable data.')
+@with_appcontext
+def seed(users, bucketlists, items, years, password, batch_size, seed):
+    '''
+    Bulk generates users, bucketlists and items for scale testing
+    '''
+    seeder = Seeder(bucketlists, items, years, password, batch_size, seed)
+    started = time.monotonic()
+
+    def progress(counts):
+        click.echo('{users} users, {bucketlists} bucketlists, '
+                   '{items} items'.format(**counts))
+
+    counts = seeder.run(users, progress)
+    click.echo('Seeded {} items in {:.1f}s'.format(
+        counts['items'], time.monotonic() - started))
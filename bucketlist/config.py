@@ -9,6 +9,78 @@ class Config(object):
     """
     CSRF_ENABLED = True
     SECRET_KEY = os.getenv('SECRET_KEY', 'the-secret-secret-k3y')
+    # Seconds between database checks that a token's user still exists
+    # with the same email. None trusts the token claims until they expire.
+    # Each worker remembers the last check of at most MAX_ENTRIES users.
+    IDENTITY_REVALIDATE_SECONDS = None
+    IDENTITY_REVALIDATE_MAX_ENTRIES = 4096
+    # Verified tokens remembered per process so their signatures are only
+    # checked once. 0 or None checks every request.
+    TOKEN_CACHE_MAX_ENTRIES = 4096
+    # Lifetimes of access tokens and of the refresh tokens that replace
+    # them through /v1/auth/refresh/
+    ACCESS_TOKEN_SECONDS = 15 * 60
+    REFRESH_TOKEN_SECONDS = 30 * 24 * 3600
+    # Each worker checks access tokens against a Bloom filter of revoked
+    # token ids, rebuilt from the database this often by a background
+    # thread. None never rebuilds it.
+    REVOCATION_SYNC_SECONDS = 30
+    REVOCATION_BLOOM_BITS = 1 << 20
+    REVOCATION_BLOOM_HASHES = 7
+    # werkzeug method for new password hashes. Hashes made with another
+    # method are replaced on the user's next login, so changing it, say
+    # to 'pbkdf2:sha256:150000', rehashes every user as they log in.
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256'
+    # Threads per worker hashing passwords, and how many more hashes may
+    # wait for one before requests get a 503. The pool only helps workers
+    # serving several requests at once (gunicorn --threads); 0 hashes
+    # inline, which suits single threaded sync workers.
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE = 8
+    # Login attempts allowed per email and per client address, as
+    # (attempts, seconds) token buckets. LOGIN_THROTTLE is 'memory' (per
+    # process), 'shared' (LOGIN_THROTTLE_CLIENT, a redis style client) or
+    # None to disable.
+    LOGIN_THROTTLE = 'memory'
+    LOGIN_THROTTLE_EMAIL = (5, 60)
+    LOGIN_THROTTLE_ADDRESS = (30, 60)
+    LOGIN_THROTTLE_MAX_KEYS = 100000
+    # Proxies in front of the app whose X-Forwarded-For and
+    # X-Forwarded-Proto headers are trusted. Heroku's router is one. Only
+    # the client address appended by the last of them is used, so clients
+    # cannot pick the address they are throttled under.
+    PROXY_FIX_HOPS = int(os.getenv('PROXY_FIX_HOPS', 0))
+    # Response cache for bucketlist reads: 'lru' (per process), 'shared'
+    # (RESPONSE_CACHE_CLIENT, a redis style client) or None to disable.
+    # A write only clears the cache of the worker serving it, so 'lru' is
+    # refused when gunicorn runs more than one worker (WEB_CONCURRENCY).
+    RESPONSE_CACHE = None
+    RESPONSE_CACHE_TTL = 30
+    RESPONSE_CACHE_MAX_ENTRIES = 1024
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+    # Most operations accepted by one items batch request
+    ITEMS_BATCH_LIMIT = 1000
+    # Rows fetched per round trip while streaming an export
+    EXPORT_BATCH_SIZE = 1000
+    # Largest JSON body accepted by validated endpoints, checked before
+    # the body is read
+    MAX_JSON_BODY_BYTES = 64 * 1024
+    # Rows written per transaction while loading an import
+    IMPORT_BATCH_SIZE = 1000
+    # Add Server-Timing headers with each request's database time
+    SERVER_TIMING = True
+    # Most queries one request may run, or None for no limit. Going over
+    # logs a warning, or fails the request when QUERY_BUDGET_ACTION is
+    # 'raise'.
+    QUERY_BUDGET = None
+    QUERY_BUDGET_ACTION = 'warn'
+    # Directory where each worker process writes its /metrics values so
+    # any worker can report them all. None keeps them in process.
+    METRICS_DIR = os.getenv('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 1.0
+    # Bearer token a scrape of /metrics must send. None serves it to
+    # anyone, so set it wherever the app is public.
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
 
 
 class TestingConfig(Config):
@@ -18,6 +90,12 @@ class TestingConfig(Config):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + \
         os.path.join(basedir, 'bucketlist_test.sqlite')
+    QUERY_BUDGET = 8
+    QUERY_BUDGET_ACTION = 'raise'
+    # One process, so the per process cache is never stale
+    RESPONSE_CACHE = 'lru'
+    # No background thread outliving each test's database
+    REVOCATION_SYNC_SECONDS = None
     SECRET_KEY = os.getenv('SECRET_KEY', 'the-secret-secret-k3y')
 
 
@@ -33,6 +111,7 @@ class DevelopmentConfig(Config):
 class ProductionConfig(Config):
     DEBUG = True
     SQLALCHEMY_ECHO = False
+    PROXY_FIX_HOPS = int(os.getenv('PROXY_FIX_HOPS', 1))
     BASE_URL = "https://cp2-bucketlist.herokuapp.com"
     FRONTEND_URL = "https://cp2-frontend.herokuapp.com"
 
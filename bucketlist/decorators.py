@@ -1,72 +1,191 @@
+import hashlib
+import math
 from functools import wraps
-from flask import request, jsonify, make_response
+from flask import g, request, jsonify, make_response, current_app
+from flask_jwt import current_identity
+from werkzeug.http import generate_etag
 
+from bucketlist.schemas import BUCKETLIST, ITEM, LOGIN, USER, \
+    BodyTooLarge, ValidationError, read_json
 
-def validate_user_credentials(func):
+
+def validates(schema, status, message):
     '''
-    Validate data posted by the user
+    Parses the request's JSON body once and checks it against schema,
+    keeping the payload on g.payload for the view. status and message
+    describe a missing or empty required field.
+    '''
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                g.payload = schema.validate(read_json())
+            except BodyTooLarge as error:
+                response = {'status': status, 'message': error.message}
+                return make_response(jsonify(response)), 413
+            except ValidationError as error:
+                response = {
+                    'status': error.status or status,
+                    'message': error.message or message
+                }
+                return make_response(jsonify(response)), 400
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Validate data posted by the user
+validate_user_credentials = validates(USER, "Failed", "Bad request")
+validate_login_credentials = validates(LOGIN, "Failed", "Bad request")
+
+
+def throttle_login(func):
+    '''
+    Refuses login attempts over the configured rate before any user
+    lookup or password check. Applied under validate_login_credentials,
+    so the email comes from the payload it has already parsed.
     '''
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        data = request.get_json()
-        response = {
-            "status": "Failed",
-            "message": "Bad request"
-        }
-        if not data:
-            return make_response(jsonify(response)), 400
-        elif "first_name" not in data or "last_name" not in data or\
-                "email" not in data or "password" not in data:
-            return make_response(jsonify(response)), 400
-        elif data["first_name"] == "" or data["last_name"] == "" \
-                or data["email"] == "" or data["password"] == "":
-            return make_response(jsonify(response)), 400
-        elif "@" not in data["email"] or ".com" not in data["email"]:
-            error = {
-                "status": "Fail",
-                "message": "Invalid email address"
-            }
-            return make_response(jsonify(error)), 400
+        policy = current_app.extensions.get('login_throttle')
+        if policy is not None:
+            email = g.get('payload', {}).get('email')
+            wait = policy.check(email, request.remote_addr)
+            if wait:
+                response = make_response(jsonify({
+                    'status': 'Failed',
+                    'message': 'Too many login attempts. Try again later.'
+                }), 429)
+                response.headers['Retry-After'] = str(int(math.ceil(wait)))
+                return response
         return func(*args, **kwargs)
     return wrapper
 
 
-def validate_bucketlist_data(func):
+# Validate data posted to bucketlists and their items
+validate_bucketlist_data = validates(
+    BUCKETLIST, "Bad request", "Required fields are empty.")
+validate_bucketlist_data_items = validates(
+    ITEM, "Bad request", "Required fields are empty.")
+
+
+def valid_bucketlist_item(data):
+    '''
+    Checks a single bucketlist item payload against the item schema
+    '''
+    return ITEM.is_valid(data)
+
+
+def cached_response(func):
     '''
-    Validates data posted to bucketlists
+    Serves repeated reads from the response cache, keyed on the user,
+    endpoint and query arguments
     '''
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        data = request.get_json()
-        response = {
-            'status': "Bad request",
-            'message': "Required fields are empty."
-        }
-        if not data:
-            return make_response(jsonify(response)), 400
-        elif "title" not in data or data["title"] == "":
-            return make_response(jsonify(response)), 400
-        return func(*args, **kwargs)
+        cache = current_app.extensions.get('response_cache')
+        if cache is None:
+            return func(*args, **kwargs)
+
+        key = cache.key(current_identity.id, request.endpoint,
+                        request.path, request.args)
+        cached = cache.get(key)
+        if cached is not None:
+            body, status, headers = cached
+            response = current_app.response_class(
+                body, status=status, headers=headers,
+                mimetype='application/json')
+            response.headers['X-Cache'] = 'HIT'
+            return response.make_conditional(request)
+
+        response = current_app.make_response(func(*args, **kwargs))
+        if response.status_code == 200:
+            headers = {name: response.headers[name]
+                       for name in ('ETag', 'Last-Modified')
+                       if name in response.headers}
+            cache.set(key, response.get_data(as_text=True),
+                      response.status_code, headers)
+        response.headers['X-Cache'] = 'MISS'
+        return response
     return wrapper
 
 
-def validate_bucketlist_data_items(func):
+def invalidates_cache(func):
     '''
-    Validates data posted to bucketlist items
+    Drops the user's cached responses after a successful write
     '''
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        data = request.get_json()
-        response = {
-            'status': "Bad request",
-            'message': "Required fields are empty."
-        }
-        if not data:
-            return make_response(jsonify(response)), 400
-        elif "name" not in data or data["name"] == "":
-            return make_response(jsonify(response)), 400
-        return func(*args, **kwargs)
+        response = current_app.make_response(func(*args, **kwargs))
+        cache = current_app.extensions.get('response_cache')
+        if cache is not None and response.status_code < 400:
+            cache.invalidate(current_identity.id)
+        return response
     return wrapper
+
+
+def conditional_get(validators):
+    '''
+    Answers GETs whose If-None-Match or If-Modified-Since still match with
+    304 Not Modified. validators takes the view arguments and returns
+    (state, last_modified), cheaply computed from row aggregates, or None
+    when there is nothing to validate against.
+
+    Only conditional GETs pay for the aggregates. Others are tagged with
+    a digest of their body, and revalidating with that tag is answered
+    by comparing bodies, along with the aggregate validators the client
+    can send next time to skip loading the rows.
+    '''
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not request.if_none_match and \
+                    request.if_modified_since is None:
+                response = current_app.make_response(func(*args, **kwargs))
+                if response.status_code == 200:
+                    response.add_etag(weak=True)
+                return response
+
+            state = validators(*args, **kwargs)
+            if state is None:
+                return func(*args, **kwargs)
+
+            seed, last_modified = state
+            etag = hashlib.md5(repr((
+                current_identity.id, request.path,
+                sorted(request.args.items(multi=True)), seed
+            )).encode()).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0)
+
+            since = request.if_modified_since
+            if since is not None and since.tzinfo is not None:
+                since = since.replace(tzinfo=None)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = None not in (since, last_modified) and \
+                    last_modified <= since
+
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if request.if_none_match.contains_weak(
+                        generate_etag(response.get_data())):
+                    response = current_app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
@@ -21,6 +21,13 @@ home.after_request(add_cors_headers)
 bucketlist_view = views.BucketlistAPI.as_view('bucketlist_api')
 bucketlist_items_view = views.BucketListItemsAPI.as_view(
     'bucketlist_items_api')
+bucketlist_items_batch_view = views.BucketListItemsBatchAPI.as_view(
+    'bucketlist_items_batch_api')
+sync_view = views.SyncAPI.as_view('sync_api')
+export_view = views.ExportAPI.as_view('export_api')
+import_view = views.ImportAPI.as_view('import_api')
+search_view = views.SearchAPI.as_view('search_api')
+stats_view = views.StatsAPI.as_view('stats_api')
 
 home.add_url_rule(
     '/v1/bucketlist/',
@@ -47,3 +54,33 @@ home.add_url_rule(
     view_func=bucketlist_items_view,
     methods=['GET']
 )
+home.add_url_rule(
+    '/v1/bucketlist/<int:id>/items/batch',
+    view_func=bucketlist_items_batch_view,
+    methods=['POST']
+)
+home.add_url_rule(
+    '/v1/sync',
+    view_func=sync_view,
+    methods=['GET']
+)
+home.add_url_rule(
+    '/v1/export',
+    view_func=export_view,
+    methods=['GET']
+)
+home.add_url_rule(
+    '/v1/import',
+    view_func=import_view,
+    methods=['POST']
+)
+home.add_url_rule(
+    '/v1/search',
+    view_func=search_view,
+    methods=['GET']
+)
+home.add_url_rule(
+    '/v1/stats',
+    view_func=stats_view,
+    methods=['GET']
+)
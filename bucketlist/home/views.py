@@ -1,17 +1,222 @@
 import datetime
+import json
+import sys
 from urllib.parse import urljoin
 
-from flask import request, make_response, jsonify, url_for
+from flask import g, request, make_response, jsonify, url_for
 from flask import current_app as app
 from flask.views import MethodView
-from flask_jwt import jwt_required
-from flask_restful import reqparse
+from flask_jwt import jwt_required, current_identity
+from flask_restful import reqparse, inputs
+from sqlalchemy import and_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 
 
 from bucketlist import db
-from bucketlist.models import User, Bucketlist, Items
+from bucketlist.importer import Importer
+from bucketlist.schemas import BodyTooLarge, ValidationError, read_json
+from bucketlist.search import search
+from bucketlist.stats import user_stats
+from bucketlist.models import Bucketlist, Items, Tombstone
+from bucketlist.pagination import keyset_paginate, InvalidCursor, seek,\
+    encode_sync_cursor, decode_sync_cursor, encode_key_cursor,\
+    decode_key_cursor
 from ..decorators import\
-    validate_bucketlist_data, validate_bucketlist_data_items
+    validate_bucketlist_data, validate_bucketlist_data_items,\
+    cached_response, invalidates_cache, conditional_get,\
+    valid_bucketlist_item
+
+
+# Item listing sort options: name -> (sort column, descending)
+ITEM_SORTS = {
+    'id': (Items.id, False),
+    '-id': (Items.id, True),
+    'name': (Items.name, False),
+    '-name': (Items.name, True),
+}
+
+
+def name_starts_with(prefix):
+    '''
+    Filters items whose name starts with prefix through an index. Postgres
+    orders names by the database collation, under which the names between
+    two strings need not share a prefix, so it uses LIKE, which the
+    text_pattern_ops index answers. SQLite orders names by code point,
+    and its LIKE ignores case, so there a range over the (bucketlist_id,
+    name) index is exact.
+    '''
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return Items.name.startswith(prefix, autoescape=True)
+    # The range ends at the next string of the prefix's length. The last
+    # code point has no successor, so trailing ones are left out of it,
+    # and a prefix made only of them has no upper bound.
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return Items.name >= prefix
+    return and_(Items.name >= prefix,
+                Items.name < stem[:-1] + chr(ord(stem[-1]) + 1))
+
+
+def page_url(**params):
+    '''
+    Builds an absolute url to the current endpoint with params
+    '''
+    return urljoin(
+        (app.config.get('BASE_URL') or '') + "/v1/bucketlists/",
+        url_for(request.endpoint, **params))
+
+
+def item_response(item):
+    '''
+    Serializes a bucketlist item
+    '''
+    return {
+        'id': item.id,
+        'name': item.name,
+        'date_created': item.date_created,
+        'date_modified': item.date_modified,
+        'done': item.done
+    }
+
+
+def bucketlist_response(bucketlist, items=False):
+    '''
+    Serializes a bucketlist, with its items when items is True
+    '''
+    response = {
+        'id': bucketlist.id,
+        'title': bucketlist.title,
+        'date_created': bucketlist.date_created,
+        'date_modified': bucketlist.date_modified,
+        'item_count': bucketlist.item_count,
+        'done_count': bucketlist.done_count
+    }
+    if items:
+        response['items'] = [item_response(item)
+                             for item in bucketlist.items]
+    return response
+
+
+def sync_response(row):
+    '''
+    Serializes a changed bucketlist, item or tombstone for sync clients
+    '''
+    if isinstance(row, Bucketlist):
+        return bucketlist_response(row)
+    if isinstance(row, Items):
+        response = item_response(row)
+        response['bucketlist_id'] = row.bucketlist_id
+        return response
+    return {
+        'kind': row.kind,
+        'id': row.object_id,
+        'bucketlist_id': row.bucketlist_id,
+        'date_deleted': row.date_deleted
+    }
+
+
+def batch_result(operation, status, message=None):
+    '''
+    Describes the outcome of one operation in an item batch
+    '''
+    result = {'status': status}
+    if isinstance(operation, dict):
+        for field in ('op', 'id', 'name'):
+            if field in operation:
+                result[field] = operation[field]
+    if message:
+        result['message'] = message
+    return result
+
+
+def ndjson_line(record):
+    '''
+    Serializes one export record as a line of newline delimited JSON
+    '''
+    return json.dumps(record, default=lambda value: value.isoformat()) + '\n'
+
+
+def latest(*dates):
+    '''
+    Returns the most recent of dates, ignoring missing ones
+    '''
+    dates = [date for date in dates if date is not None]
+    return max(dates) if dates else None
+
+
+def last_deleted(*criteria):
+    '''
+    Subquery for when the user last deleted something matching criteria.
+    Deleted rows drop out of the max(date_modified) of those left, so
+    without it a read would still look unmodified after a delete.
+    '''
+    return db.session.query(func.max(Tombstone.date_deleted)).filter(
+        Tombstone.users_email == current_identity.email,
+        *criteria).as_scalar()
+
+
+def bucketlist_validators(view, id=None):
+    '''
+    Aggregates the rows a bucketlist read returns into (state,
+    last_modified) without loading them
+    '''
+    email = current_identity.email
+    if id:
+        row = db.session.query(
+            Bucketlist.date_modified,
+            func.max(Items.date_modified),
+            func.count(Items.id),
+            last_deleted(Tombstone.bucketlist_id == id)).outerjoin(
+            Bucketlist.items).filter(
+            Bucketlist.id == id,
+            Bucketlist.users_email == email).group_by(
+            Bucketlist.id).first()
+        if row is None:
+            return None
+        modified, items_modified, count, deleted = row
+        return (modified, items_modified, count), \
+            latest(modified, items_modified, deleted)
+
+    query = request.args.get('q')
+    bucketlists = db.session.query(
+        func.max(Bucketlist.date_modified),
+        func.count(Bucketlist.id),
+        last_deleted(Tombstone.kind == 'bucketlist')).filter(
+        Bucketlist.users_email == email)
+    if query:
+        bucketlists = bucketlists.filter(
+            Bucketlist.title.ilike('%{}%'.format(query)))
+    modified, count, deleted = bucketlists.one()
+    if not count:
+        return None
+    if request.args.get('include') != 'items':
+        return (modified, count), latest(modified, deleted)
+
+    items_modified, items_count, deleted = db.session.query(
+        func.max(Items.date_modified), func.count(Items.id),
+        last_deleted()).join(Items.bucketlist).filter(
+        Bucketlist.users_email == email).one()
+    return (modified, count, items_modified, items_count), \
+        latest(modified, items_modified, deleted)
+
+
+def items_validators(view, id, item_id=None):
+    '''
+    Aggregates the rows an item read returns into (state, last_modified)
+    '''
+    items = db.session.query(
+        func.max(Items.date_modified), func.count(Items.id),
+        last_deleted(Tombstone.bucketlist_id == id)).join(
+        Items.bucketlist).filter(
+        Items.bucketlist_id == id,
+        Bucketlist.users_email == current_identity.email)
+    if item_id:
+        items = items.filter(Items.id == item_id)
+    modified, count, deleted = items.one()
+    if not count or modified is None:
+        return None
+    return (modified, count), latest(modified, deleted)
 
 
 class BucketlistAPI(MethodView):
@@ -21,56 +226,61 @@ class BucketlistAPI(MethodView):
     """
 
     @jwt_required()
+    @invalidates_cache
     @validate_bucketlist_data
     def post(self):
-        data = request.get_json()
-        token = request.headers.get('Authorization')
-        bucketlist = Bucketlist.query.filter_by(
-            title=data.get('title')).first()
+        data = g.payload
+        user = current_identity
+        create = Bucketlist(
+            title=data.get('title'),
+            date_created=datetime.datetime.now(),
+            date_modified=datetime.datetime.now(),
+            users_email=user.email)
 
-        if not bucketlist:
-            email = User.decode_auth_token(token)
-            user = User.query.filter_by(email=email).first()
-            create = Bucketlist(
-                title=data.get('title'),
-                date_created=datetime.datetime.now(),
-                date_modified=datetime.datetime.now(),
-                users_email=user.email)
-
-            db.session.add(create)
+        # (users_email, title) is unique, so the insert itself detects
+        # duplicates without a lookup beforehand
+        db.session.add(create)
+        try:
             db.session.commit()
-
-            response = {
-                'status': 'Success',
-                'message': 'Bucketlist has been created'
-            }
-
-            return make_response(jsonify(response)), 201
-        else:
+        except IntegrityError:
+            db.session.rollback()
             response = {
                 'status': 'Fail',
                 'message': 'Bucketlist already exists.'
             }
             return make_response(jsonify(response)), 409
 
+        response = {
+            'status': 'Success',
+            'message': 'Bucketlist has been created'
+        }
+
+        return make_response(jsonify(response)), 201
+
     @jwt_required()
+    @cached_response
+    @conditional_get(bucketlist_validators)
     def get(self, id=None):
 
-        token = request.headers.get('Authorization')
         # Search and Query params
         parser = reqparse.RequestParser()
         parser.add_argument('limit', type=int, required=False, location='args')
         parser.add_argument('q', type=str, required=False, location='args')
         parser.add_argument(
             'page', type=int, required=False, location='args')
+        parser.add_argument(
+            'cursor', type=str, required=False, location='args')
+        parser.add_argument(
+            'include', type=str, required=False, location='args')
         args = parser.parse_args()
 
-        email = User.decode_auth_token(token)
-        user = User.query.filter_by(email=email).first()
+        user = current_identity
 
         if id:
 
-            bucketlist = Bucketlist.query.filter_by(id=id).first()
+            # Load the bucketlist and its items with a single joined query
+            bucketlist = Bucketlist.query.options(
+                joinedload(Bucketlist.items)).filter_by(id=id).first()
             if not bucketlist:
                 response = {
                     'status': 'Fail',
@@ -78,41 +288,30 @@ class BucketlistAPI(MethodView):
                 }
                 return make_response(jsonify(response)), 404
             if user.email == bucketlist.users_email:
-                all_items = []
-                for item in bucketlist.items:
-                    item_response = {
-                        'id': item.id,
-                        'name': item.name,
-                        'date_created': item.date_created,
-                        'date_modified': item.date_modified,
-                        'done': item.done
-                    }
-                    all_items.append(item_response)
-                response = {
-                    'id': bucketlist.id,
-                    'title': bucketlist.title,
-                    'items': all_items,
-                    'date_created': bucketlist.date_created,
-                    'date_modified': bucketlist.date_modified
-                }
+                response = bucketlist_response(bucketlist, items=True)
                 return make_response(jsonify(response)), 200
 
+        elif args["cursor"] is not None:
+            return self.get_by_cursor(user, args)
+
         else:
             all_bucketlists = []
 
             page = args["page"] or 1
             limit = args["limit"] or 1
             query = args["q"] or None
+            include_items = args["include"] == 'items'
 
+            bucketlists = Bucketlist.query.filter_by(users_email=user.email)
             if query:
-                bucketlists = Bucketlist.query.filter(
-                    Bucketlist.title.ilike('%{}%'.format(query))).filter_by(
-                    users_email=user.email).paginate(
-                    page=page, per_page=limit, error_out=True)
-            else:
-                bucketlists = Bucketlist.query.filter_by(
-                    users_email=user.email).paginate(
-                    page=page, per_page=limit, error_out=True)
+                bucketlists = bucketlists.filter(
+                    Bucketlist.title.ilike('%{}%'.format(query)))
+            if include_items:
+                # One extra query loads the items of every row on the page
+                bucketlists = bucketlists.options(
+                    selectinload(Bucketlist.items))
+            bucketlists = bucketlists.paginate(
+                page=page, per_page=limit, error_out=True)
 
             if not bucketlists.items:
                 response = {
@@ -121,29 +320,20 @@ class BucketlistAPI(MethodView):
                 }
                 return make_response(jsonify(response)), 404
             for bucketlist in bucketlists.items:
-                response = {
-                    'id': bucketlist.id,
-                    'title': bucketlist.title,
-                    'date_created': bucketlist.date_created,
-                    'date_modified': bucketlist.date_modified
-                }
-                all_bucketlists.append(response)
+                all_bucketlists.append(
+                    bucketlist_response(bucketlist, items=include_items))
 
             if bucketlists.has_next:
-                next_url = (urljoin(
-                    app.config.get('BASE_URL') + "/v1/bucketlists/",
-                    url_for(request.endpoint,
-                            q=query,
-                            page=bucketlists.next_num,
-                            limit=bucketlists.per_page)))
+                next_url = page_url(q=query,
+                                    include=args["include"],
+                                    page=bucketlists.next_num,
+                                    limit=bucketlists.per_page)
             else:
                 next_url = None
             if bucketlists.has_prev:
-                prev_url = (urljoin(
-                    app.config.get('BASE_URL') + "/v1/bucketlists/",
-                    url_for(request.endpoint,
-                            page=bucketlists.prev_num,
-                            limit=bucketlists.per_page)))
+                prev_url = page_url(include=args["include"],
+                                    page=bucketlists.prev_num,
+                                    limit=bucketlists.per_page)
             else:
                 prev_url = None
 
@@ -158,18 +348,76 @@ class BucketlistAPI(MethodView):
 
             return make_response(jsonify(response)), 200
 
+    def get_by_cursor(self, user, args):
+        '''
+        Lists bucketlists by seeking past an opaque cursor.
+        No OFFSET or COUNT query is run so deep pages stay cheap.
+        '''
+        limit = args["limit"] or 20
+        query = args["q"] or None
+        include_items = args["include"] == 'items'
+
+        bucketlists = Bucketlist.query.filter_by(users_email=user.email)
+        if query:
+            bucketlists = bucketlists.filter(
+                Bucketlist.title.ilike('%{}%'.format(query)))
+        if include_items:
+            bucketlists = bucketlists.options(
+                selectinload(Bucketlist.items))
+        try:
+            page = keyset_paginate(bucketlists, Bucketlist,
+                                   cursor=args["cursor"], limit=limit)
+        except InvalidCursor:
+            response = {
+                'status': 'Fail',
+                'message': 'Invalid cursor'
+            }
+            return make_response(jsonify(response)), 400
+
+        if not page.items:
+            response = {
+                'status': 'Fail',
+                'message': 'You do not have bucketlists'
+            }
+            return make_response(jsonify(response)), 404
+
+        all_bucketlists = [
+            bucketlist_response(bucketlist, items=include_items)
+            for bucketlist in page.items]
+
+        next_url = prev_url = None
+        if page.next_cursor:
+            next_url = page_url(q=query, include=args["include"],
+                                cursor=page.next_cursor, limit=limit)
+        if page.prev_cursor:
+            prev_url = page_url(q=query, include=args["include"],
+                                cursor=page.prev_cursor, limit=limit)
+
+        response = {
+            "limit": limit,
+            "next_url": next_url,
+            "prev_url": prev_url,
+            "bucketlists": all_bucketlists
+        }
+        return make_response(jsonify(response)), 200
+
     @jwt_required()
+    @invalidates_cache
     def delete(self, id):
         token = request.headers.get('Authorization')
         if token:
-            email = User.decode_auth_token(token)
-            user = User.query.filter_by(email=email).first()
-            bucketlists = Bucketlist.query.filter_by(
-                users_email=user.email).all()
-            for bucketlist in bucketlists:
-                if id == bucketlist.id:
-                    db.session.delete(bucketlist)
-                    db.session.commit()
+            user = current_identity
+            # A single DELETE; the database cascades to the items
+            deleted = Bucketlist.query.filter_by(
+                id=id, users_email=user.email).delete(
+                synchronize_session=False)
+            if deleted:
+                db.session.add(Tombstone(
+                    users_email=user.email,
+                    kind='bucketlist',
+                    object_id=id,
+                    date_deleted=datetime.datetime.now()))
+            db.session.commit()
             response = {
                 'status': "Success",
                 'message': 'Deleted'
@@ -183,12 +431,12 @@ class BucketlistAPI(MethodView):
             return make_response(jsonify(response)), 401
 
     @jwt_required()
+    @invalidates_cache
     @validate_bucketlist_data
     def put(self, id):
-        data = request.get_json()
+        data = g.payload
         token = request.headers.get('Authorization')
-        email = User.decode_auth_token(token)
-        user = User.query.filter_by(email=email).first()
+        user = current_identity
         bucketlist = Bucketlist.query.filter_by(
             id=id).first()
 
@@ -196,7 +444,15 @@ class BucketlistAPI(MethodView):
             bucketlist.title = data.get('title')
             bucketlist.date_modified = datetime.datetime.now()
 
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                response = {
+                    'status': 'Fail',
+                    'message': 'Bucketlist already exists.'
+                }
+                return make_response(jsonify(response)), 409
 
             response = {
                 'status': "Success",
@@ -218,46 +474,44 @@ class BucketListItemsAPI(MethodView):
     """
 
     @jwt_required()
+    @invalidates_cache
     @validate_bucketlist_data_items
     def post(self, id):
-        data = request.get_json()
-        token = request.headers.get('Authorization')
-        items = Items.query.filter_by(
-            name=data.get('name')).first()
+        data = g.payload
         bucketlist = Bucketlist.query.filter_by(id=id).first()
+        now = datetime.datetime.now()
+        create = Items(
+            name=data.get('name'),
+            date_created=now,
+            date_modified=now,
+            done=False,
+            bucketlist_id=bucketlist.id)
 
-        if not items:
-            email = User.decode_auth_token(token)
-            user = User.query.filter_by(email=email).first()
-            if User.decode_auth_token(user.email):
-                create = Items(
-                    name=data.get('name'),
-                    date_created=datetime.datetime.now(),
-                    date_modified=datetime.datetime.now(),
-                    done=False,
-                    bucketlist_id=bucketlist.id)
-                db.session.add(create)
-                db.session.commit()
-
-            response = {
-                'status': 'Success',
-                'message': 'Bucketlist item has been created'
-            }
-
-            return make_response(jsonify(response)), 201
-
-        else:
+        # (bucketlist_id, name) is unique, so the insert itself detects
+        # duplicates without a lookup beforehand
+        db.session.add(create)
+        Bucketlist.adjust_counts({bucketlist.id: (1, 0)}, now)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
             response = {
                 'status': 'Fail',
                 'message': 'Bucketlist already exists.'
             }
             return make_response(jsonify(response)), 409
 
+        response = {
+            'status': 'Success',
+            'message': 'Bucketlist item has been created'
+        }
+
+        return make_response(jsonify(response)), 201
+
     @jwt_required()
+    @conditional_get(items_validators)
     def get(self, id, item_id=None):
-        token = request.headers.get('Authorization')
-        email = User.decode_auth_token(token)
-        user = User.query.filter_by(email=email).first()
+        user = current_identity
         if item_id:
             item = Items.query.filter_by(
                 id=item_id).first()
@@ -277,26 +531,7 @@ class BucketListItemsAPI(MethodView):
                 }
                 return make_response(jsonify(response)), 200
         if id:
-            all_items = []
-            items = Items.query.filter_by(
-                bucketlist_id=id).all()
-            if not items:
-                response = {
-                    "status": "Fail",
-                    "message": "You do not have any bucketlist items"
-                }
-                return make_response(jsonify(response)), 404
-            for item in items:
-                response = {
-                    "name": item.name,
-                    "date_created": item.date_created,
-                    "date_modified": item.date_modified,
-                    "done": item.done,
-                    "bucketlist_id": item.bucketlist_id,
-                    "item_id": item.id
-                }
-                all_items.append(response)
-            return make_response(jsonify(all_items)), 200
+            return self.get_page(id)
         else:
             response = {
                 'status': 'Fail',
@@ -304,16 +539,109 @@ class BucketListItemsAPI(MethodView):
             }
             return make_response(jsonify(response)), 401
 
+    def get_page(self, id):
+        '''
+        Lists a bucketlist's items a page at a time, optionally filtered
+        on done and a name prefix, seeking past a cursor on the sort key
+        '''
+        parser = reqparse.RequestParser()
+        parser.add_argument('limit', type=int, required=False, location='args')
+        parser.add_argument(
+            'cursor', type=str, required=False, location='args')
+        parser.add_argument(
+            'done', type=inputs.boolean, required=False, location='args')
+        parser.add_argument(
+            'prefix', type=str, required=False, location='args')
+        parser.add_argument(
+            'sort', type=str, required=False, location='args',
+            choices=list(ITEM_SORTS), default='id')
+        args = parser.parse_args()
+
+        limit = args["limit"] or 20
+        key_col, descending = ITEM_SORTS[args["sort"]]
+        items = Items.query.filter_by(bucketlist_id=id)
+        if args["done"] is not None:
+            items = items.filter_by(done=args["done"])
+        if args["prefix"]:
+            items = items.filter(name_starts_with(args["prefix"]))
+
+        if args["cursor"]:
+            try:
+                key, item_id = decode_key_cursor(args["cursor"])
+            except InvalidCursor:
+                response = {
+                    'status': 'Fail',
+                    'message': 'Invalid cursor'
+                }
+                return make_response(jsonify(response)), 400
+            if key_col is Items.id:
+                items = items.filter(Items.id < item_id if descending
+                                     else Items.id > item_id)
+            else:
+                items = seek(items, key_col, Items.id, key, item_id,
+                             reverse=descending)
+
+        if descending:
+            items = items.order_by(key_col.desc(), Items.id.desc())
+        else:
+            items = items.order_by(key_col.asc(), Items.id.asc())
+        items = items.limit(limit + 1).all()
+
+        if not items:
+            response = {
+                "status": "Fail",
+                "message": "You do not have any bucketlist items"
+            }
+            return make_response(jsonify(response)), 404
+
+        next_url = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            key = None if key_col is Items.id else getattr(last, key_col.key)
+            next_url = page_url(
+                id=id, limit=limit, done=request.args.get('done'),
+                prefix=args["prefix"], sort=args["sort"],
+                cursor=encode_key_cursor(key, last.id))
+
+        all_items = []
+        for item in items:
+            response = {
+                "name": item.name,
+                "date_created": item.date_created,
+                "date_modified": item.date_modified,
+                "done": item.done,
+                "bucketlist_id": item.bucketlist_id,
+                "item_id": item.id
+            }
+            all_items.append(response)
+
+        response = {
+            "limit": limit,
+            "next_url": next_url,
+            "items": all_items
+        }
+        return make_response(jsonify(response)), 200
+
     @jwt_required()
+    @invalidates_cache
     @validate_bucketlist_data_items
     def put(self, id=None, item_id=None):
-        data = request.get_json()
+        data = g.payload
         item = Items.query.filter_by(
             id=item_id).first()
         if item:
             item.name = data.get('name')
             item.date_modified = datetime.datetime.now()
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                response = {
+                    'status': 'Fail',
+                    'message': 'Bucketlist already exists.'
+                }
+                return make_response(jsonify(response)), 409
             response = {
                 'status': "Success",
                 'message': "Bucketlist has been updated"
@@ -329,11 +657,21 @@ class BucketListItemsAPI(MethodView):
             return make_response(jsonify(response)), 400
 
     @jwt_required()
+    @invalidates_cache
     def delete(self, id=None, item_id=None):
         item = Items.query.filter_by(
             id=item_id).first()
         if item.bucketlist_id == id:
+            now = datetime.datetime.now()
+            db.session.add(Tombstone(
+                users_email=item.bucketlist.users_email,
+                kind='item',
+                object_id=item.id,
+                bucketlist_id=item.bucketlist_id,
+                date_deleted=now))
             db.session.delete(item)
+            Bucketlist.adjust_counts(
+                {item.bucketlist_id: (-1, -int(item.done))}, now)
             db.session.commit()
             response = {
                 'status': "Success",
@@ -346,3 +684,382 @@ class BucketListItemsAPI(MethodView):
                 'message': 'You are not authorized to delete these resources'
             }
             return make_response(jsonify(response)), 401
+
+
+class BucketListItemsBatchAPI(MethodView):
+    """
+    Create, Update, Toggle and Delete many BucketListItems in one request
+    """
+
+    @jwt_required()
+    @invalidates_cache
+    def post(self, id):
+        try:
+            operations = read_json()
+        except ValidationError as error:
+            response = {
+                'status': "Bad request",
+                'message': error.message
+            }
+            status = 413 if isinstance(error, BodyTooLarge) else 400
+            return make_response(jsonify(response)), status
+        if not isinstance(operations, list) or not operations:
+            response = {
+                'status': "Bad request",
+                'message': "Expected a list of operations."
+            }
+            return make_response(jsonify(response)), 400
+        if len(operations) > app.config.get('ITEMS_BATCH_LIMIT', 1000):
+            response = {
+                'status': "Bad request",
+                'message': "Too many operations."
+            }
+            return make_response(jsonify(response)), 413
+
+        bucketlist = Bucketlist.query.filter_by(
+            id=id, users_email=current_identity.email).first()
+        if not bucketlist:
+            response = {
+                'status': 'Fail',
+                'message': 'The bucketlist does not exist'
+            }
+            return make_response(jsonify(response)), 404
+
+        # Everything the batch touches is read with two queries up front
+        ids = set()
+        names = set()
+        for operation in operations:
+            if isinstance(operation, dict):
+                if isinstance(operation.get('id'), int):
+                    ids.add(operation['id'])
+                if isinstance(operation.get('name'), str):
+                    names.add(operation['name'])
+        items = {}
+        if ids:
+            items = {item.id: item for item in Items.query.filter(
+                Items.bucketlist_id == id, Items.id.in_(ids))}
+        taken = {item.name for item in items.values()}
+        if names:
+            taken.update(name for name, in db.session.query(
+                Items.name).filter(Items.bucketlist_id == id,
+                                   Items.name.in_(names)))
+
+        now = datetime.datetime.now()
+        results = []
+        creates = []
+        changes = {}
+        deletes = set()
+        for operation in operations:
+            op = item = None
+            if isinstance(operation, dict):
+                op = operation.get('op')
+                if isinstance(operation.get('id'), int):
+                    item = items.get(operation['id'])
+            if item is not None and item.id in deletes:
+                item = None
+            if item is not None:
+                state = changes.setdefault(item.id, {
+                    'id': item.id, 'name': item.name, 'done': item.done,
+                    'date_modified': now})
+
+            if op not in ('create', 'update', 'toggle', 'delete'):
+                results.append(batch_result(operation, 400,
+                                            "Unknown operation."))
+            elif op in ('create', 'update') and \
+                    not valid_bucketlist_item(operation):
+                results.append(batch_result(operation, 400,
+                                            "Required fields are empty."))
+            elif op != 'create' and item is None:
+                results.append(batch_result(
+                    operation, 404, "The bucketlist item does not exist"))
+            elif op in ('create', 'update') and \
+                    operation['name'] in taken and \
+                    (op == 'create' or operation['name'] != state['name']):
+                results.append(batch_result(
+                    operation, 409, "Bucketlist already exists."))
+            elif op == 'create':
+                taken.add(operation['name'])
+                creates.append({
+                    'name': operation['name'],
+                    'date_created': now,
+                    'date_modified': now,
+                    'done': bool(operation.get('done', False)),
+                    'bucketlist_id': id
+                })
+                results.append(batch_result(operation, 201))
+            elif op == 'update':
+                taken.discard(state['name'])
+                taken.add(operation['name'])
+                state['name'] = operation['name']
+                if 'done' in operation:
+                    state['done'] = bool(operation['done'])
+                results.append(batch_result(operation, 200))
+            elif op == 'toggle':
+                state['done'] = not state['done']
+                results.append(batch_result(operation, 200))
+            else:
+                taken.discard(state['name'])
+                deletes.add(item.id)
+                results.append(batch_result(operation, 204))
+
+        updates = [state for item_id, state in changes.items()
+                   if item_id not in deletes and
+                   (state['name'], state['done']) !=
+                   (items[item_id].name, items[item_id].done)]
+        item_delta = len(creates) - len(deletes)
+        done_delta = sum(create['done'] for create in creates) - \
+            sum(items[item_id].done for item_id in deletes) + \
+            sum(state['done'] - items[state['id']].done
+                for state in updates)
+        try:
+            if deletes:
+                Items.query.filter(Items.id.in_(deletes)).delete(
+                    synchronize_session=False)
+                db.session.bulk_insert_mappings(Tombstone, [{
+                    'users_email': current_identity.email,
+                    'kind': 'item',
+                    'object_id': item_id,
+                    'bucketlist_id': id,
+                    'date_deleted': now} for item_id in deletes])
+            if updates:
+                db.session.bulk_update_mappings(Items, updates)
+            if creates:
+                db.session.bulk_insert_mappings(Items, creates)
+            Bucketlist.adjust_counts({id: (item_delta, done_delta)}, now)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            response = {
+                'status': 'Fail',
+                'message': 'Bucketlist already exists.'
+            }
+            return make_response(jsonify(response)), 409
+
+        if creates:
+            created = dict(db.session.query(Items.name, Items.id).filter(
+                Items.bucketlist_id == id,
+                Items.name.in_([create['name'] for create in creates])))
+            for result in results:
+                if result['status'] == 201:
+                    result['id'] = created.get(result['name'])
+
+        response = {
+            'status': 'Success',
+            'results': results
+        }
+        return make_response(jsonify(response)), 200
+
+
+class SyncAPI(MethodView):
+    """
+        Changes to a user's bucketlists and items since a cursor
+    """
+
+    @jwt_required()
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('since', type=str, required=False,
+                            location='args')
+        parser.add_argument('limit', type=int, required=False, location='args')
+        args = parser.parse_args()
+
+        user = current_identity
+        limit = args["limit"] or 500
+        positions = {}
+        if args["since"]:
+            try:
+                positions = decode_sync_cursor(args["since"])
+            except InvalidCursor:
+                response = {
+                    'status': 'Fail',
+                    'message': 'Invalid cursor'
+                }
+                return make_response(jsonify(response)), 400
+
+        changes = [
+            ('bucketlists', Bucketlist.date_modified, Bucketlist.id,
+             Bucketlist.query.filter_by(users_email=user.email)),
+            ('items', Items.date_modified, Items.id,
+             Items.query.join(Items.bucketlist).filter(
+                 Bucketlist.users_email == user.email)),
+            ('deleted', Tombstone.date_deleted, Tombstone.id,
+             Tombstone.query.filter_by(users_email=user.email)),
+        ]
+
+        # Each kind of row is walked on its own (date, id) keyset, so
+        # rows sharing a timestamp are neither skipped nor repeated
+        response = {'has_more': False}
+        for name, date_col, id_col, query in changes:
+            date, id = positions.get(name, (None, None))
+            if date is not None:
+                query = seek(query, date_col, id_col, date, id)
+            rows = query.order_by(date_col, id_col).limit(limit + 1).all()
+            if len(rows) > limit:
+                response['has_more'] = True
+                rows = rows[:limit]
+            if rows:
+                last = rows[-1]
+                positions[name] = (getattr(last, date_col.key), last.id)
+            response[name] = [sync_response(row) for row in rows]
+
+        response['cursor'] = encode_sync_cursor({
+            name: positions.get(name, (None, None))
+            for name, _, _, _ in changes})
+        return make_response(jsonify(response)), 200
+
+
+class SearchAPI(MethodView):
+    """
+        Ranked full-text search over a user's bucketlists and items
+    """
+
+    @jwt_required()
+    @cached_response
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('q', type=str, required=False, location='args')
+        parser.add_argument('limit', type=int, required=False, location='args')
+        args = parser.parse_args()
+
+        if not (args["q"] or '').strip():
+            response = {
+                'status': 'Fail',
+                'message': 'Search query is required'
+            }
+            return make_response(jsonify(response)), 400
+
+        limit = min(args["limit"] or 20, 100)
+        bucketlists, items = search(current_identity.email, args["q"], limit)
+        response = {
+            'q': args["q"],
+            'bucketlists': bucketlists,
+            'items': items
+        }
+        return make_response(jsonify(response)), 200
+
+
+class StatsAPI(MethodView):
+    """
+        Dashboard totals and weekly completions for a user
+    """
+
+    @jwt_required()
+    @cached_response
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('weeks', type=int, required=False,
+                            location='args')
+        args = parser.parse_args()
+
+        weeks = min(max(args["weeks"] or 12, 1), 104)
+        response = user_stats(current_identity.email, weeks)
+        return make_response(jsonify(response)), 200
+
+
+class ExportAPI(MethodView):
+    """
+        Streams all of a user's bucketlists and items as NDJSON
+    """
+
+    @jwt_required()
+    def get(self):
+        email = current_identity.email
+        batch_size = app.config.get('EXPORT_BATCH_SIZE', 1000)
+        flask_app = app._get_current_object()
+
+        def generate():
+            # The response is read after the request has ended, so the
+            # generator holds its own app context. Closing the response,
+            # even part way, pops it and releases the session and cursor.
+            with flask_app.app_context():
+                for line in export_lines(email, batch_size):
+                    yield line
+
+        return app.response_class(generate(),
+                                  mimetype='application/x-ndjson')
+
+
+def export_lines(email, batch_size):
+    # One ordered outer join, read through a server side cursor, so
+    # memory stays flat however large the account is
+    rows = db.session.query(
+        Bucketlist.id, Bucketlist.title, Bucketlist.date_created,
+        Bucketlist.date_modified, Items.id, Items.name,
+        Items.date_created, Items.date_modified, Items.done).outerjoin(
+        Items, Items.bucketlist_id == Bucketlist.id).filter(
+        Bucketlist.users_email == email).order_by(
+        Bucketlist.id, Items.id).yield_per(batch_size)
+
+    bucketlist_id = None
+    for row in rows:
+        if row[0] != bucketlist_id:
+            bucketlist_id = row[0]
+            yield ndjson_line({
+                'type': 'bucketlist',
+                'id': row[0],
+                'title': row[1],
+                'date_created': row[2],
+                'date_modified': row[3]
+            })
+        if row[4] is not None:
+            yield ndjson_line({
+                'type': 'item',
+                'id': row[4],
+                'bucketlist_id': row[0],
+                'name': row[5],
+                'date_created': row[6],
+                'date_modified': row[7],
+                'done': row[8]
+            })
+
+
+class ImportAPI(MethodView):
+    """
+        Loads bucketlists and items from an NDJSON body, streaming back
+        progress after each batch and per line errors as NDJSON
+    """
+
+    @jwt_required()
+    def post(self):
+        importer = Importer(current_identity.email,
+                            app.config.get('IMPORT_BATCH_SIZE', 1000))
+        user_id = current_identity.id
+        cache = app.extensions.get('response_cache')
+        stream = request.stream
+        flask_app = app._get_current_object()
+
+        def generate():
+            # Like the export, the generator runs after the request has
+            # ended, so it holds its own app context. The body stays
+            # readable until the response is closed.
+            with flask_app.app_context():
+                try:
+                    for event in import_events(importer, stream):
+                        yield ndjson_line(event)
+                except Exception:
+                    # The status is already sent, so a failure can only
+                    # be reported in the stream. Committed batches stay.
+                    db.session.rollback()
+                    flask_app.logger.exception('Import failed')
+                    yield ndjson_line(dict(importer.counts, type='failed'))
+                finally:
+                    # Batches commit as they go, so cached reads are
+                    # stale even when the import stops part way
+                    if cache is not None:
+                        cache.invalidate(user_id)
+
+        return app.response_class(generate(),
+                                  mimetype='application/x-ndjson')
+
+
+def import_events(importer, stream):
+    '''
+    Feeds the body to importer a line at a time, yielding each line's
+    errors and the progress after each batch as soon as it is committed
+    '''
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            for event in importer.feed(number, line):
+                yield event
+    for event in importer.finish():
+        yield event
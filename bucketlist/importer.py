@@ -0,0 +1,284 @@
+import csv
+import datetime
+import io
+import json
+
+from sqlalchemy.exc import IntegrityError
+
+from bucketlist import db
+from bucketlist.models import Bucketlist, Items
+from bucketlist.schemas import BUCKETLIST, ITEM, ValidationError
+
+
+DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+class ImportLineError(ValueError):
+    '''
+    Raised for an import line that cannot be loaded
+    '''
+
+
+def parse_date(value, default):
+    '''
+    Reads an ISO timestamp as written by the export
+    '''
+    if not value:
+        return default
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except (TypeError, ValueError):
+            pass
+    raise ImportLineError('Invalid date: {}'.format(value))
+
+
+def validated(schema, record):
+    try:
+        return schema.validate(record)
+    except ValidationError as error:
+        raise ImportLineError(error.message or 'Required fields are empty.')
+
+
+def source_key(record, field):
+    '''
+    The key an export id is tracked under. Ids are used as dict keys, so
+    anything but an integer or a string is refused.
+    '''
+    value = record.get(field)
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ImportLineError('{} must be an integer or a string.'.format(
+            field))
+    return ('id', value)
+
+
+def copy_rows(table, rows):
+    '''
+    Loads rows with Postgres COPY, the fastest path into a table
+    '''
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    buffer.seek(0)
+    # Quoted, since user is a reserved word on Postgres
+    preparer = db.session.get_bind().dialect.identifier_preparer
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH CSV'.format(
+            preparer.format_table(table),
+            ', '.join(preparer.quote(column) for column in columns)), buffer)
+    finally:
+        cursor.close()
+
+
+def insert_rows(table, rows):
+    '''
+    Inserts rows in one round trip: COPY on Postgres, executemany elsewhere
+    '''
+    if db.session.get_bind().dialect.name == 'postgresql':
+        copy_rows(table, rows)
+    else:
+        db.session.execute(table.insert(), rows)
+
+
+class Importer(object):
+    '''
+    Loads an NDJSON stream of bucketlists and items for one user.
+
+    Lines are either export records ({"type": "bucketlist", "id": ...}
+    followed by {"type": "item", "bucketlist_id": ...}) or bucketlists with
+    their items nested under "items". Rows are buffered and written
+    batch_size at a time, each batch in its own transaction. A batch the
+    database rejects is retried row by row so only the offending lines
+    are reported. Rows are stamped with the time their batch is written,
+    so sync cursors never skip rows a long import commits late.
+    '''
+
+    def __init__(self, email, batch_size=1000):
+        self.email = email
+        self.batch_size = batch_size
+        self.bucketlists = []
+        self.items = []
+        # source key of a bucketlist -> id it was imported as
+        self.ids = {}
+        # source key of a rejected bucketlist -> its line number
+        self.rejected = {}
+        self.counts = {'lines': 0, 'bucketlists': 0, 'items': 0,
+                       'errors': 0}
+
+    def feed(self, number, line):
+        '''
+        Parses one line, returning the events it produced
+        '''
+        self.counts['lines'] += 1
+        events = []
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ImportLineError('Expected a JSON object')
+            if record.get('type') == 'item':
+                self.add_item(number, source_key(record, 'bucketlist_id'),
+                              record)
+            else:
+                self.add_bucketlist(number, record)
+        except ValueError as error:
+            events.append(self.error(number, str(error)))
+
+        if len(self.items) >= self.batch_size:
+            events.extend(self.flush_items())
+        elif len(self.bucketlists) >= self.batch_size:
+            events.extend(self.flush_bucketlists())
+        return events
+
+    def finish(self):
+        '''
+        Writes whatever is still buffered and returns the final events
+        '''
+        events = self.flush_items()
+        events.append(dict(self.counts, type='summary'))
+        return events
+
+    def error(self, number, message):
+        self.counts['errors'] += 1
+        return {'type': 'error', 'line': number, 'message': message}
+
+    def progress(self):
+        return dict(self.counts, type='progress')
+
+    def add_bucketlist(self, number, record):
+        title = validated(BUCKETLIST, record)['title']
+        items = record.get('items') or []
+        if not isinstance(items, list):
+            raise ImportLineError('Expected a list of items')
+        for item in items:
+            validated(ITEM, item)
+
+        key = source_key(record, 'id') if 'id' in record \
+            else ('line', number)
+        self.bucketlists.append((number, key, {
+            'title': title,
+            'date_created': parse_date(record.get('date_created'), None),
+            'users_email': self.email
+        }))
+        for item in items:
+            self.add_item(number, key, item)
+
+    def add_item(self, number, key, record):
+        validated(ITEM, record)
+        self.items.append((number, key, {
+            'name': record['name'],
+            'date_created': parse_date(record.get('date_created'), None),
+            'done': bool(record.get('done', False))
+        }))
+
+    @staticmethod
+    def stamp(batch, now):
+        for _, _, row in batch:
+            row['date_modified'] = now
+            if row['date_created'] is None:
+                row['date_created'] = now
+
+    def write(self, table, batch, before_commit=None):
+        '''
+        Inserts a batch of (line, key, row), returning the entries that
+        were written and the events for those that were not.
+        before_commit is called with the rows of each transaction.
+        '''
+        before_commit = before_commit or (lambda rows: None)
+        integrity_errors = (IntegrityError,
+                            db.session.get_bind().dialect.dbapi.IntegrityError)
+        try:
+            rows = [row for _, _, row in batch]
+            insert_rows(table, rows)
+            before_commit(rows)
+            db.session.commit()
+            return batch, []
+        except integrity_errors:
+            db.session.rollback()
+
+        written, events = [], []
+        for number, key, row in batch:
+            try:
+                db.session.execute(table.insert(), row)
+                before_commit([row])
+                db.session.commit()
+                written.append((number, key, row))
+            except IntegrityError:
+                db.session.rollback()
+                events.append(self.error(number, 'Already exists.'))
+        return written, events
+
+    def count_items(self, rows):
+        deltas = {}
+        for row in rows:
+            items, done = deltas.get(row['bucketlist_id'], (0, 0))
+            deltas[row['bucketlist_id']] = (items + 1, done + row['done'])
+        Bucketlist.adjust_counts(deltas, rows[0]['date_modified'])
+
+    def flush_bucketlists(self):
+        if not self.bucketlists:
+            return []
+        batch, self.bucketlists = self.bucketlists, []
+        events = []
+
+        titles = [row['title'] for _, _, row in batch]
+        taken = {title for title, in db.session.query(
+            Bucketlist.title).filter(Bucketlist.users_email == self.email,
+                                     Bucketlist.title.in_(titles))}
+        fresh = []
+        for number, key, row in batch:
+            if row['title'] in taken:
+                self.rejected[key] = number
+                events.append(self.error(number, 'Bucketlist already exists.'))
+            else:
+                taken.add(row['title'])
+                fresh.append((number, key, row))
+        if not fresh:
+            return events
+        self.stamp(fresh, datetime.datetime.now())
+        written, errors = self.write(Bucketlist.__table__, fresh)
+        events.extend(errors)
+        imported = {key for _, key, _ in written}
+        for number, key, _ in fresh:
+            if key not in imported:
+                self.rejected[key] = number
+
+        # executemany and COPY return no ids, but titles are unique per
+        # user so one query maps every new bucketlist back to its id
+        titles = [row['title'] for _, _, row in written]
+        ids = dict(db.session.query(Bucketlist.title, Bucketlist.id).filter(
+            Bucketlist.users_email == self.email,
+            Bucketlist.title.in_(titles))) if titles else {}
+        for _, key, row in written:
+            self.ids[key] = ids[row['title']]
+        self.counts['bucketlists'] += len(written)
+        events.append(self.progress())
+        return events
+
+    def flush_items(self):
+        events = self.flush_bucketlists()
+        if not self.items:
+            return events
+        batch, self.items = self.items, []
+
+        rows = []
+        for number, key, row in batch:
+            if key not in self.ids:
+                # Items nested in a rejected bucketlist share its error
+                if self.rejected.get(key) != number:
+                    events.append(self.error(number, 'Unknown bucketlist.'))
+                continue
+            row['bucketlist_id'] = self.ids[key]
+            rows.append((number, key, row))
+        if rows:
+            self.stamp(rows, datetime.datetime.now())
+            written, errors = self.write(Items.__table__, rows,
+                                         self.count_items)
+            events.extend(errors)
+            self.counts['items'] += len(written)
+        events.append(self.progress())
+        return events
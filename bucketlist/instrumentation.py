@@ -0,0 +1,115 @@
+import json
+import logging
+import time
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(RuntimeError):
+    '''
+    Raised when a request runs more queries than QUERY_BUDGET allows and
+    QUERY_BUDGET_ACTION is 'raise'
+    '''
+
+
+class QueryStats(object):
+    '''
+    The statements one request sent to the database and how long they took
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        if duration >= self.slowest:
+            self.slowest = duration
+            self.slowest_statement = statement
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context,
+                      executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context,
+                     executemany):
+    started = conn.info['query_started'].pop()
+    # Only statements run while a request is being served are counted
+    stats = g.get('query_stats') if has_app_context() else None
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+def start_request():
+    g.query_stats = QueryStats()
+
+
+def report_request(response):
+    '''
+    Adds Server-Timing to the response, logs a line describing the
+    request's queries and applies the query budget
+    '''
+    stats = g.pop('query_stats', None)
+    if stats is None:
+        return response
+    config = current_app.config
+
+    if config.get('SERVER_TIMING', True):
+        response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} {}"'
+                             .format(stats.duration * 1000, stats.count,
+                                     'query' if stats.count == 1
+                                     else 'queries'))
+        response.headers.add('Server-Timing', 'db-slowest;dur={:.2f}'.format(
+            stats.slowest * 1000))
+
+    record = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'queries': stats.count,
+        'db_ms': round(stats.duration * 1000, 2),
+        'slowest_ms': round(stats.slowest * 1000, 2),
+        'slowest': (stats.slowest_statement or '')[:200] or None
+    }
+    budget = config.get('QUERY_BUDGET')
+    if budget is not None and stats.count > budget:
+        record['budget'] = budget
+        message = 'Query budget exceeded: ' + json.dumps(record)
+        if config.get('QUERY_BUDGET_ACTION') == 'raise':
+            raise QueryBudgetExceeded(message)
+        query_logger(current_app).warning(message)
+    else:
+        query_logger(current_app).info(json.dumps(record))
+    return response
+
+
+def query_logger(app):
+    '''
+    The logger of app's per request query lines. It is a child of the app
+    logger, so its lines go to the same handlers. That logger is
+    'flask.app' on Flask 1.0 and named after the app from Flask 1.1.
+    '''
+    return logging.getLogger(app.logger.name + '.queries')
+
+
+def init_app(app):
+    '''
+    Installs per request query counting and timing on app
+    '''
+    # The app logger has no level of its own outside debug mode, so the
+    # root logger's WARNING would drop the INFO lines
+    logger = query_logger(app)
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    app.before_request(start_request)
+    app.after_request(report_request)
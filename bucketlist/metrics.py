@@ -0,0 +1,415 @@
+import atexit
+import fcntl
+import glob
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import current_app, g, request
+
+from bucketlist import db
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+                    5.0)
+
+METRICS = {
+    'bucketlist_http_requests_total': (
+        'counter', 'Requests handled, by endpoint, method and status.'),
+    'bucketlist_http_request_duration_seconds': (
+        'histogram', 'Time spent handling requests, by endpoint.'),
+    'bucketlist_http_requests_in_flight': (
+        'gauge', 'Requests being handled right now.'),
+    'bucketlist_db_pool_checkout_wait_seconds': (
+        'histogram', 'Time spent waiting for a pooled database connection.'),
+    'bucketlist_response_cache_hits_total': (
+        'counter', 'Reads answered from the response cache.'),
+    'bucketlist_response_cache_misses_total': (
+        'counter', 'Reads the response cache could not answer.'),
+    'bucketlist_response_cache_hit_ratio': (
+        'gauge', 'Share of cacheable reads answered from the cache.'),
+}
+
+
+class Metrics(object):
+    '''
+    Request, database pool and cache metrics for one process.
+
+    With a directory, each process also writes its values to a file of
+    its own there, and collect() adds up every process's file. That lets
+    any gunicorn worker answer a scrape for all of them without shared
+    memory or an external service. A file is rewritten at most every
+    flush_interval seconds, at the end of a request or, for a worker that
+    has gone idle, from a background thread, and once more as the process
+    exits. Before its first write, a process folds the files of exited
+    workers into one, so they neither pile up nor get overwritten by a
+    worker reusing their pid.
+    '''
+
+    def __init__(self, directory=None, flush_interval=1.0, cache=None):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.cache = cache
+        self.counters = {}
+        self.histograms = {}
+        self.in_flight = 0
+        self.flushed = 0.0
+        self.folded_pid = None
+        self.flusher_pid = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, cache=None):
+        # The production config is read from the environment alone
+        directory = config.get('METRICS_DIR', os.getenv('METRICS_DIR'))
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return cls(directory, config.get('METRICS_FLUSH_INTERVAL', 1.0),
+                   cache)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(sorted(labels)))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets, labels=()):
+        key = (name, tuple(sorted(labels)))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': list(buckets),
+                    'counts': [0] * len(buckets),
+                    'sum': 0.0,
+                    'count': 0
+                }
+            for index, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def track(self, change):
+        with self._lock:
+            self.in_flight += change
+
+    def snapshot(self):
+        '''
+        This process's values in a JSON serializable form
+        '''
+        with self._lock:
+            counters = [[name, labels, value] for (name, labels), value
+                        in self.counters.items()]
+            histograms = [
+                [name, labels, dict(histogram,
+                                    counts=list(histogram['counts']))]
+                for (name, labels), histogram in self.histograms.items()]
+            in_flight = self.in_flight
+        if self.cache is not None:
+            stats = self.cache.stats()
+            counters.append(['bucketlist_response_cache_hits_total', [],
+                             stats['hits']])
+            counters.append(['bucketlist_response_cache_misses_total', [],
+                             stats['misses']])
+        return {'pid': os.getpid(), 'counters': counters,
+                'histograms': histograms, 'in_flight': in_flight}
+
+    def path(self, pid):
+        return os.path.join(self.directory, 'metrics_{}.json'.format(pid))
+
+    def write(self, path, snapshot):
+        # Write then rename, so readers never see half a file
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as stream:
+            json.dump(snapshot, stream)
+        os.replace(temporary, path)
+
+    def flush(self, force=False):
+        '''
+        Writes this process's values for the other workers to read
+        '''
+        if not self.directory:
+            return
+        if self.flusher_pid != os.getpid():
+            self.start()
+        now = time.monotonic()
+        if not force and now - self.flushed < self.flush_interval:
+            return
+        self.flushed = now
+        # Forked workers share the object, so the pid tells if this
+        # process has folded yet
+        if self.folded_pid != os.getpid():
+            self.fold_exited()
+            self.folded_pid = os.getpid()
+        self.write(self.path(os.getpid()), self.snapshot())
+
+    def start(self):
+        '''
+        Starts the thread writing this process's values every
+        flush_interval seconds, so the last requests before a worker goes
+        idle still reach the other workers, and writes them once more at
+        exit. Once per process, since a forked worker does not inherit its
+        parent's threads.
+        '''
+        with self._lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        atexit.register(self.flush, True)
+        threading.Thread(target=self.run, daemon=True,
+                         name='metrics-flush').start()
+
+    def run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush(force=True)
+            except Exception:
+                logger.exception('Writing metrics failed')
+
+    def stop(self):
+        self._stopped.set()
+
+    def fold_exited(self):
+        '''
+        Adds the values of exited workers, and of an earlier process with
+        this one's pid, into the exited file and removes their own files
+        '''
+        pid = os.getpid()
+        exited = self.path('exited')
+        with open(os.path.join(self.directory, 'metrics.lock'), 'w') as lock:
+            # One process folds at a time, so no file is counted twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            folded, snapshots = [], []
+            for path in glob.glob(os.path.join(self.directory,
+                                               'metrics_*.json')):
+                snapshot = read_snapshot(path)
+                if snapshot is None:
+                    continue
+                if path == exited:
+                    snapshots.append(snapshot)
+                elif snapshot['pid'] == pid or \
+                        not process_alive(snapshot['pid']):
+                    folded.append(path)
+                    snapshots.append(snapshot)
+            if not folded:
+                return
+            counters, histograms, _ = combine(snapshots)
+            self.write(exited, {
+                'pid': None, 'in_flight': 0,
+                'counters': [[name, labels, value] for (name, labels), value
+                             in counters.items()],
+                'histograms': [[name, labels, histogram]
+                               for (name, labels), histogram
+                               in histograms.items()]})
+            for path in folded:
+                os.remove(path)
+
+    def snapshots(self):
+        '''
+        This process's live values plus those every other process wrote
+        '''
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            if path == self.path(os.getpid()):
+                continue
+            snapshot = read_snapshot(path)
+            if snapshot is None:
+                continue
+            # Counts from exited workers still add up, but their
+            # requests are no longer in flight
+            if snapshot['pid'] is not None and \
+                    not process_alive(snapshot['pid']):
+                snapshot['in_flight'] = 0
+            snapshots.append(snapshot)
+        return snapshots
+
+    def collect(self):
+        '''
+        Adds up every process's values
+        '''
+        return combine(self.snapshots())
+
+    def render(self):
+        '''
+        Every process's values in the Prometheus text exposition format
+        '''
+        counters, histograms, in_flight = self.collect()
+        samples = {name: [] for name in METRICS}
+
+        for (name, labels), value in sorted(counters.items()):
+            samples[name].append(sample(name, labels, value))
+        for (name, labels), histogram in sorted(histograms.items()):
+            for bound, count in zip(histogram['buckets'],
+                                    histogram['counts']):
+                samples[name].append(sample(
+                    name + '_bucket', labels + (('le', repr(bound)),), count))
+            samples[name].append(sample(
+                name + '_bucket', labels + (('le', '+Inf'),),
+                histogram['count']))
+            samples[name].append(sample(name + '_sum', labels,
+                                        histogram['sum']))
+            samples[name].append(sample(name + '_count', labels,
+                                        histogram['count']))
+        samples['bucketlist_http_requests_in_flight'].append(
+            sample('bucketlist_http_requests_in_flight', (), in_flight))
+
+        hits = counters.get(('bucketlist_response_cache_hits_total', ()), 0)
+        misses = counters.get(
+            ('bucketlist_response_cache_misses_total', ()), 0)
+        if self.cache is not None:
+            samples['bucketlist_response_cache_hit_ratio'].append(sample(
+                'bucketlist_response_cache_hit_ratio', (),
+                float(hits) / (hits + misses) if hits + misses else 0.0))
+
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            if samples[name]:
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                lines.extend(samples[name])
+        return '\n'.join(lines) + '\n'
+
+
+def combine(snapshots):
+    '''
+    Adds up snapshots into counters and histograms keyed by name and
+    labels, and the requests in flight
+    '''
+    counters, histograms, in_flight = {}, {}, 0
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            total = histograms.setdefault(key, {
+                'buckets': histogram['buckets'],
+                'counts': [0] * len(histogram['buckets']),
+                'sum': 0.0,
+                'count': 0
+            })
+            total['counts'] = [a + b for a, b in zip(
+                total['counts'], histogram['counts'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+        in_flight += snapshot['in_flight']
+    return counters, histograms, in_flight
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        # Removed by another worker's fold, or not a snapshot
+        return None
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join(
+            '{}="{}"'.format(label, str(text).replace('\\', '\\\\')
+                             .replace('"', '\\"').replace('\n', '\\n'))
+            for label, text in labels) + '}'
+    return '{} {}'.format(name, float(value))
+
+
+def time_checkouts(metrics, pool):
+    '''
+    Wraps pool.connect() so the wait for each connection is observed.
+    SQLAlchemy has no event that fires before a checkout starts.
+    '''
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            metrics.observe('bucketlist_db_pool_checkout_wait_seconds',
+                            time.perf_counter() - started, CHECKOUT_BUCKETS)
+
+    pool.connect = timed_connect
+    pool.checkouts_timed = True
+
+
+def start_request():
+    metrics = current_app.extensions['metrics']
+    # Engines are created lazily, and again if the database URI changes,
+    # so the pool is wrapped the first time a request finds it unwrapped
+    pool = db.get_engine().pool
+    if not getattr(pool, 'checkouts_timed', False):
+        time_checkouts(metrics, pool)
+    metrics.track(1)
+    g.metrics_tracked = True
+    g.metrics_started = time.perf_counter()
+
+
+def record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    metrics = current_app.extensions['metrics']
+    labels = (('endpoint', request.endpoint or 'none'),
+              ('blueprint', request.blueprint or ''))
+    metrics.observe('bucketlist_http_request_duration_seconds',
+                    time.perf_counter() - started, REQUEST_BUCKETS, labels)
+    metrics.inc('bucketlist_http_requests_total', labels + (
+        ('method', request.method), ('status', str(response.status_code))))
+    return response
+
+
+def finish_request(exception=None):
+    if not g.pop('metrics_tracked', False):
+        return
+    metrics = current_app.extensions['metrics']
+    metrics.track(-1)
+    metrics.flush()
+
+
+def metrics_view():
+    # The production config is read from the environment alone
+    token = current_app.config.get('METRICS_TOKEN',
+                                   os.getenv('METRICS_TOKEN'))
+    if token and not hmac.compare_digest(
+            request.headers.get('Authorization', '').encode(),
+            'Bearer {}'.format(token).encode()):
+        return current_app.response_class(
+            'Unauthorized\n', status=401, mimetype='text/plain',
+            headers={'WWW-Authenticate': 'Bearer realm="metrics"'})
+    metrics = current_app.extensions['metrics']
+    return current_app.response_class(
+        metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    '''
+    Records request metrics on app and serves them at /metrics
+    '''
+    app.extensions['metrics'] = Metrics.from_config(
+        app.config, app.extensions.get('response_cache'))
+    app.before_request(start_request)
+    app.after_request(record_request)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+
+from alembic import op
+
+
+@contextmanager
+def concurrently():
+    '''
+    On Postgres, runs the block outside the migration transaction so
+    indexes can be built with CREATE INDEX CONCURRENTLY, which does not
+    lock out writes. Yields whether the block may build them that way.
+
+    Alembic 1.2 and later provide autocommit_block() for this. Older
+    releases have no such block, so the migration transaction is
+    committed instead and the rest of the migration runs outside it.
+    '''
+    context = op.get_context()
+    if context.dialect.name != 'postgresql':
+        yield False
+    elif hasattr(context, 'autocommit_block'):
+        with context.autocommit_block():
+            yield True
+    else:
+        op.execute('COMMIT')
+        yield True
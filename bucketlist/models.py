@@ -1,13 +1,32 @@
 import os
+import uuid
 
 from flask_login import UserMixin
 from flask import current_app as app
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
+from sqlalchemy import DDL, and_, bindparam, event, func, or_, select, \
+    true
 import jwt
 
 
 from bucketlist import db, login_manager
+from bucketlist.passwords import HashingPoolFull, check_password, \
+    hash_password, needs_rehash
+from bucketlist.tokens import token_claims
+
+
+class Identity(object):
+    '''
+    The authenticated user for the current request, built from token claims
+    so handlers do not need to look the user up again.
+    '''
+
+    def __init__(self, id, email):
+        self.id = id
+        self.email = email
+
+    def __repr__(self):
+        return 'Identity: {}'.format(self.email)
 
 
 class User(UserMixin, db.Model):
@@ -17,7 +36,7 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(25), index=True, unique=True)
     first_name = db.Column(db.String(25), index=True)
     last_name = db.Column(db.String(25), index=True)
-    password_hash = db.Column(db.String(100))
+    password_hash = db.Column(db.String(255))
     is_admin = db.Column(db.Boolean, default=False)
     bucketlists = db.relationship('Bucketlist', backref='user', lazy='dynamic')
 
@@ -28,37 +47,48 @@ class User(UserMixin, db.Model):
         self.last_name = last_name
         self.password = password
 
+    def encode_token(self, email, kind, seconds):
+        now = datetime.utcnow()
+        payload = {
+            'iat': now,
+            'nbf': now,
+            'exp': now + timedelta(seconds=seconds),
+            'jti': uuid.uuid4().hex,
+            'type': kind,
+            'id': self.id,
+            'email': email
+        }
+        return jwt.encode(
+            payload,
+            app.config.get('SECRET_KEY'),
+            algorithm='HS256'
+        ).decode()
+
     def encode_auth_token(self, email):
         """
-        Generates auth token
+        Generates a short lived access token
         """
         try:
-            payload = {
-                'iat': datetime.utcnow(),
-                'nbf': datetime.utcnow(),
-                'exp': datetime.utcnow() + timedelta(days=1),
-                'email': email
-            }
-            token = jwt.encode(
-                payload,
-                app.config.get('SECRET_KEY'),
-                algorithm='HS256'
-            )
-            decoded_token = token.decode()
-            return "JWT " + decoded_token
+            return "JWT " + self.encode_token(
+                email, 'access', app.config.get('ACCESS_TOKEN_SECONDS', 900))
         except Exception as e:
             return e
 
+    def encode_refresh_token(self, email):
+        """
+        Generates a refresh token, exchanged once for new tokens
+        """
+        return self.encode_token(
+            email, 'refresh',
+            app.config.get('REFRESH_TOKEN_SECONDS', 30 * 24 * 3600))
+
     @staticmethod
     def decode_auth_token(auth_token):
         """
         Decodes auth token
         """
         try:
-            auth_token = auth_token.replace("JWT ", '', 1)
-            payload = jwt.decode(auth_token, app.config.get('SECRET_KEY'),
-                                 algorithms=['HS256'])
-            return payload['email']
+            return token_claims(auth_token)['email']
         except jwt.ExpiredSignatureError:
             return 'Token has expired. Please log in to continue.'
         except jwt.InvalidTokenError:
@@ -70,10 +100,22 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        '''
+        Checks password, rehashing it when the stored hash was made with
+        outdated parameters. The caller commits the new hash.
+        '''
+        if not check_password(self.password_hash, password):
+            return False
+        if needs_rehash(self.password_hash):
+            try:
+                self.password = password
+            except HashingPoolFull:
+                # Rehashing can wait for the next login
+                pass
+        return True
 
     def authenticate(email, password):
         user = User.query.filter_by(email).first()
@@ -81,8 +123,31 @@ class User(UserMixin, db.Model):
             return user
 
     def identity(payload):
+        '''
+        Builds the request identity from token claims. The database is only
+        consulted when IDENTITY_REVALIDATE_SECONDS has elapsed for the user,
+        or for tokens issued before the id claim existed. Users have no
+        status column, so revalidating refuses tokens of deleted users and
+        of users whose email changed, nothing else.
+        '''
+        user_id = payload.get('id')
         email = payload['email']
-        return email
+        if user_id is None:
+            user = User.query.filter_by(email=email).first()
+            return Identity(user.id, user.email) if user else None
+
+        interval = app.config.get('IDENTITY_REVALIDATE_SECONDS')
+        if interval is None:
+            return Identity(user_id, email)
+
+        revalidated = app.extensions.get('revalidated_identities')
+        if revalidated is None or revalidated.get(user_id) is None:
+            user = User.query.get(user_id)
+            if not user or user.email != email:
+                return None
+            if revalidated is not None and interval:
+                revalidated.set(user_id, True, ttl=interval)
+        return Identity(user_id, email)
 
     def __repr__(self):
         return "{0}: {1} {2}".format(self.username, self.first_name,
@@ -100,8 +165,62 @@ class Bucketlist(db.Model):
     date_created = db.Column(db.DateTime)
     date_modified = db.Column(db.DateTime)
     users_email = db.Column(db.String(255), db.ForeignKey('user.email'))
+    # Kept in step with the items table by adjust_counts() so listings
+    # can show progress without reading any items
+    item_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
+    done_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
     items = db.relationship('Items', backref='bucketlist',
-                            lazy='dynamic')
+                            order_by='Items.id', passive_deletes=True)
+
+    __table_args__ = (
+        db.Index('ix_bucketlist_users_email_id', 'users_email', 'id'),
+        db.Index('uq_bucketlist_users_email_title', 'users_email', 'title',
+                 unique=True),
+        db.Index('ix_bucketlist_users_email_date_created_id',
+                 'users_email', 'date_created', 'id'),
+        db.Index('ix_bucketlist_users_email_date_modified_id',
+                 'users_email', 'date_modified', 'id'),
+    )
+
+    @classmethod
+    def adjust_counts(cls, deltas, now=None):
+        '''
+        Applies {bucketlist id: (items, done)} count changes in one
+        UPDATE, inside the caller's transaction. The bucketlists are
+        marked modified since the counts are part of what they return.
+        '''
+        deltas = [{'b_id': id, 'b_items': items, 'b_done': done,
+                   'b_modified': now or datetime.now()}
+                  for id, (items, done) in deltas.items() if items or done]
+        if not deltas:
+            return
+        table = cls.__table__
+        db.session.execute(table.update().where(
+            table.c.id == bindparam('b_id')).values(
+            item_count=table.c.item_count + bindparam('b_items'),
+            done_count=table.c.done_count + bindparam('b_done'),
+            date_modified=bindparam('b_modified')), deltas)
+
+    @classmethod
+    def recount(cls):
+        '''
+        Recomputes every bucketlist's counts from its items in one
+        statement, fixing any that drifted. Returns how many changed.
+        '''
+        table, items = cls.__table__, Items.__table__
+        item_count = select([func.count(items.c.id)]).where(
+            items.c.bucketlist_id == table.c.id).as_scalar()
+        done_count = select([func.count(items.c.id)]).where(and_(
+            items.c.bucketlist_id == table.c.id,
+            items.c.done == true())).as_scalar()
+        result = db.session.execute(table.update().where(or_(
+            table.c.item_count != item_count,
+            table.c.done_count != done_count)).values(
+            item_count=item_count, done_count=done_count))
+        db.session.commit()
+        return result.rowcount
 
     def __repr__(self):
         return 'Bucketlist: {}'.format(self.title)
@@ -114,7 +233,92 @@ class Items(db.Model):
     date_created = db.Column(db.DateTime)
     date_modified = db.Column(db.DateTime)
     done = db.Column(db.Boolean, default=False)
-    bucketlist_id = db.Column(db.Integer, db.ForeignKey('bucketlist.id'))
+    bucketlist_id = db.Column(db.Integer,
+                              db.ForeignKey('bucketlist.id',
+                                            ondelete='CASCADE'),
+                              index=True)
+
+    __table_args__ = (
+        db.Index('uq_items_bucketlist_id_name', 'bucketlist_id', 'name',
+                 unique=True),
+        db.Index('ix_items_bucketlist_id_date_modified_id',
+                 'bucketlist_id', 'date_modified', 'id'),
+        db.Index('ix_items_bucketlist_id_done_id',
+                 'bucketlist_id', 'done', 'id'),
+    )
 
     def __repr__(self):
         return 'Item: {}'.format(self.name)
+
+
+# Postgres compares names by the database collation, which the other
+# indexes on name follow, so item name prefix matches use LIKE against
+# an index in code point order instead
+event.listen(Items.__table__, 'after_create', DDL(
+    'CREATE INDEX ix_items_bucketlist_id_name_pattern ON items '
+    '(bucketlist_id, name text_pattern_ops)').execute_if(
+    dialect='postgresql'))
+
+
+class Tombstone(db.Model):
+    '''
+    Records a deleted bucketlist or item so clients syncing changes can
+    drop it. Items removed along with their bucketlist get no tombstone
+    of their own.
+    '''
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    users_email = db.Column(db.String(255))
+    kind = db.Column(db.String(10))
+    object_id = db.Column(db.Integer)
+    bucketlist_id = db.Column(db.Integer)
+    date_deleted = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_tombstone_users_email_date_deleted_id',
+                 'users_email', 'date_deleted', 'id'),
+    )
+
+    def __repr__(self):
+        return 'Tombstone: {} {}'.format(self.kind, self.object_id)
+
+
+def jwt_leeway():
+    '''
+    How long past its expiry Flask-JWT still accepts a token
+    '''
+    leeway = app.config.get('JWT_LEEWAY', timedelta(seconds=10))
+    if not isinstance(leeway, timedelta):
+        leeway = timedelta(seconds=leeway)
+    return leeway
+
+
+class RevokedToken(db.Model):
+    '''
+    A token that must no longer be accepted: a refresh token that has
+    been exchanged, or any token of a user who logged out. kind is the
+    token's type claim, 'access' or 'refresh'. Rows are only needed until
+    the token expires.
+    '''
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    jti = db.Column(db.String(32), unique=True, nullable=False)
+    kind = db.Column(db.String(10))
+    expires_at = db.Column(db.DateTime, index=True, nullable=False)
+    date_revoked = db.Column(db.DateTime)
+
+    @classmethod
+    def prune(cls):
+        '''
+        Deletes the rows of tokens that decoding already refuses, being
+        past their expiry by more than JWT_LEEWAY, in a transaction of its
+        own. Returns how many were deleted.
+        '''
+        table = cls.__table__
+        with db.engine.begin() as connection:
+            return connection.execute(table.delete().where(
+                table.c.expires_at < datetime.utcnow() - jwt_leeway()
+            )).rowcount
+
+    def __repr__(self):
+        return 'RevokedToken: {}'.format(self.jti)
@@ -0,0 +1,169 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class InvalidCursor(ValueError):
+    '''
+    Raised when a client supplied cursor cannot be decoded
+    '''
+
+
+def dump_cursor(payload):
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def load_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+
+def encode_cursor(date_created, id, direction='next'):
+    '''
+    Builds an opaque cursor pointing at a (date_created, id) position
+    '''
+    return dump_cursor({
+        'd': date_created.strftime(DATE_FORMAT),
+        'i': id,
+        'r': direction
+    })
+
+
+def decode_cursor(cursor):
+    '''
+    Returns the (date_created, id, direction) held by a cursor
+    '''
+    try:
+        payload = load_cursor(cursor)
+        date_created = datetime.strptime(payload['d'], DATE_FORMAT)
+        direction = payload.get('r', 'next')
+        if direction not in ('next', 'prev'):
+            raise InvalidCursor(cursor)
+        return date_created, int(payload['i']), direction
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def encode_sync_cursor(positions):
+    '''
+    Builds an opaque cursor from a {name: (date, id) or None} mapping of
+    how far a client has synced each kind of row
+    '''
+    return dump_cursor({
+        name: [date.strftime(DATE_FORMAT), id] if date else None
+        for name, (date, id) in positions.items()
+    })
+
+
+def decode_sync_cursor(cursor):
+    '''
+    Returns the {name: (date, id)} mapping held by a sync cursor
+    '''
+    try:
+        positions = {}
+        for name, position in load_cursor(cursor).items():
+            positions[name] = (None, None)
+            if position is not None:
+                date, id = position
+                positions[name] = (datetime.strptime(date, DATE_FORMAT),
+                                   int(id))
+        return positions
+    except (binascii.Error, ValueError, KeyError, TypeError, AttributeError):
+        raise InvalidCursor(cursor)
+
+
+def encode_key_cursor(key, id):
+    '''
+    Builds an opaque cursor pointing at a (key, id) position, where key
+    is the JSON serializable value of the sort column
+    '''
+    return dump_cursor({'k': key, 'i': id})
+
+
+def decode_key_cursor(cursor):
+    '''
+    Returns the (key, id) held by a key cursor
+    '''
+    try:
+        payload = load_cursor(cursor)
+        return payload['k'], int(payload['i'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def seek(query, key_col, id_col, key, id, reverse=False):
+    '''
+    Filters query to rows after (key, id), or before it when reverse.
+    The leading range on key_col lets an index seek straight to the
+    position; the OR only breaks ties within that key.
+    '''
+    if reverse:
+        return query.filter(and_(
+            key_col <= key, or_(key_col < key, id_col < id)))
+    return query.filter(and_(
+        key_col >= key, or_(key_col > key, id_col > id)))
+
+
+class KeysetPage(object):
+    '''
+    One page of rows fetched by seeking past a cursor.
+
+    Rows are ordered on (date_created, id) so the database can walk an
+    index instead of counting and skipping OFFSET rows.
+    '''
+
+    def __init__(self, items, next_cursor, prev_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def keyset_paginate(query, model, cursor=None, limit=20):
+    '''
+    Returns a KeysetPage for query ordered on (date_created, id).
+
+    One extra row is fetched to find out whether a further page exists,
+    so no COUNT query is issued.
+    '''
+    date_col, id_col = model.date_created, model.id
+    direction = 'next'
+
+    if cursor:
+        date_created, id, direction = decode_cursor(cursor)
+        query = seek(query, date_col, id_col, date_created, id,
+                     reverse=direction == 'prev')
+
+    if direction == 'next':
+        query = query.order_by(date_col.asc(), id_col.asc())
+    else:
+        query = query.order_by(date_col.desc(), id_col.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'prev':
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if direction == 'next':
+            if has_more:
+                next_cursor = encode_cursor(last.date_created, last.id)
+            if cursor:
+                prev_cursor = encode_cursor(
+                    first.date_created, first.id, 'prev')
+        else:
+            next_cursor = encode_cursor(last.date_created, last.id)
+            if has_more:
+                prev_cursor = encode_cursor(
+                    first.date_created, first.id, 'prev')
+
+    return KeysetPage(rows, next_cursor, prev_cursor)
@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, jsonify, make_response
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, \
+    check_password_hash, generate_password_hash
+
+
+class HashingPoolFull(RuntimeError):
+    '''
+    Raised when more passwords are waiting to be hashed than the pool
+    accepts. Answered with a 503 so the client retries later.
+    '''
+
+
+class HashingPool(object):
+    '''
+    Runs password hashing on a few threads, with at most max_queue more
+    hashes waiting. PBKDF2 runs in hashlib without holding the GIL, so
+    while the pool is busy, the worker's other threads keep serving
+    requests. A burst of logins beyond the queue is refused at once
+    instead of holding every worker. The request's own thread waits for
+    its hash, so this needs threaded workers, as the Procfile runs.
+    '''
+
+    def __init__(self, workers=2, max_queue=8):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('PASSWORD_HASH_WORKERS', 2),
+                   config.get('PASSWORD_HASH_QUEUE', 8))
+
+    @property
+    def executor(self):
+        # Threads are started on first use, so they are never created in
+        # a gunicorn master process and lost when it forks
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix='password-hash')
+            return self._executor
+
+    def run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingPoolFull('Too many passwords waiting to be hashed')
+        try:
+            future = self.executor.submit(function, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        return future.result()
+
+
+def hash_method(config):
+    '''
+    The configured werkzeug hash method, with PBKDF2 iterations spelled
+    out the way they are stored in hashes
+    '''
+    method = config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        method += ':{}'.format(DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+def needs_rehash(password_hash):
+    '''
+    Whether password_hash was made with other parameters than the ones
+    configured now
+    '''
+    method = password_hash.split('$', 1)[0]
+    return method != hash_method(current_app.config)
+
+
+def hash_password(password):
+    method = hash_method(current_app.config)
+    pool = current_app.extensions.get('hashing_pool')
+    if pool is None:
+        return generate_password_hash(password, method)
+    return pool.run(generate_password_hash, password, method)
+
+
+def check_password(password_hash, password):
+    pool = current_app.extensions.get('hashing_pool')
+    if pool is None:
+        return check_password_hash(password_hash, password)
+    return pool.run(check_password_hash, password_hash, password)
+
+
+def pool_full(error):
+    response = {
+        'status': 'Failed',
+        'message': 'Too many sign ins right now. Please try again shortly.'
+    }
+    response = make_response(jsonify(response), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+def init_app(app):
+    '''
+    Hashes passwords for app on a bounded pool, or inline when
+    PASSWORD_HASH_WORKERS is 0
+    '''
+    pool = None
+    if app.config.get('PASSWORD_HASH_WORKERS', 2):
+        pool = HashingPool.from_config(app.config)
+    app.extensions['hashing_pool'] = pool
+    app.register_error_handler(HashingPoolFull, pool_full)
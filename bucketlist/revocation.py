@@ -0,0 +1,188 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+
+import jwt
+from flask import current_app
+from flask_jwt import _default_jwt_decode_handler
+from sqlalchemy import or_
+
+from bucketlist import db
+from bucketlist.models import RevokedToken, jwt_leeway
+
+
+class BloomFilter(object):
+    '''
+    Set membership in a fixed number of bits. Lookups can report false
+    positives, at a rate set by the size and the number of entries, but
+    never false negatives.
+    '''
+
+    def __init__(self, bits=1 << 20, hashes=7):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def positions(self, value):
+        # Up to eight positions from one digest
+        digest = hashlib.sha256(value.encode()).digest()
+        for index in struct.unpack('>8I', digest)[:self.hashes]:
+            yield index % self.bits
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.array[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(value))
+
+
+class RevocationList(object):
+    '''
+    Ids of revoked, unexpired access tokens, kept in a Bloom filter rebuilt
+    from the revoked_token table every sync_interval seconds. Refresh
+    tokens are checked against the table directly, so exchanged ones,
+    kept for the whole refresh lifetime, never fill the filter. Almost every
+    token is cleared without touching the database. Only ids the filter
+    matches are looked up, so a false positive costs a query rather than
+    a logout. Revocations made by this process apply at once, and those
+    made by other workers apply after their next sync.
+
+    The first check in a process loads the filter. After that a
+    background thread rebuilds it, so requests never wait for a sync.
+    A sync_interval of None leaves it to whoever calls sync().
+    '''
+
+    def __init__(self, bits=1 << 20, hashes=7, sync_interval=30):
+        self.bits = bits
+        self.hashes = hashes
+        self.sync_interval = sync_interval
+        self.filter = BloomFilter(bits, hashes)
+        self.synced = None
+        self.syncer_pid = None
+        self._added = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('REVOCATION_BLOOM_BITS', 1 << 20),
+                   config.get('REVOCATION_BLOOM_HASHES', 7),
+                   config.get('REVOCATION_SYNC_SECONDS', 30))
+
+    def sync(self):
+        with self._lock:
+            self._added = []
+        # Access tokens expire within ACCESS_TOKEN_SECONDS of being
+        # issued, which bounds the rows read even for untyped ones
+        now, leeway = datetime.utcnow(), jwt_leeway()
+        latest = now + leeway + timedelta(
+            seconds=current_app.config.get('ACCESS_TOKEN_SECONDS', 900))
+        revoked = BloomFilter(self.bits, self.hashes)
+        for jti, in db.session.query(RevokedToken.jti).filter(
+                RevokedToken.expires_at > now - leeway,
+                RevokedToken.expires_at <= latest,
+                or_(RevokedToken.kind.is_(None),
+                    RevokedToken.kind == 'access')):
+            revoked.add(jti)
+        with self._lock:
+            # Tokens revoked here while the rows were read may not have
+            # been committed in time to be among them
+            for jti in self._added:
+                revoked.add(jti)
+            self._added = None
+            self.filter = revoked
+            self.synced = time.monotonic()
+
+    def add(self, jti):
+        with self._lock:
+            self.filter.add(jti)
+            if self._added is not None:
+                self._added.append(jti)
+
+    def start(self, app):
+        '''
+        Starts the thread rebuilding the filter for app every
+        sync_interval seconds, once per process, since a forked worker
+        does not inherit its parent's threads
+        '''
+        with self._lock:
+            if not self.sync_interval or self.syncer_pid == os.getpid():
+                return
+            self.syncer_pid = os.getpid()
+        threading.Thread(target=self.run, args=(app,), daemon=True,
+                         name='revocation-sync').start()
+
+    def run(self, app):
+        while not self._stopped.wait(self.sync_interval):
+            try:
+                with app.app_context():
+                    self.sync()
+            except Exception:
+                app.logger.exception('Revocation list sync failed')
+
+    def stop(self):
+        self._stopped.set()
+
+    def load(self):
+        '''
+        Fills the filter for the first time and keeps it current from then
+        on
+        '''
+        self.sync()
+        self.start(current_app._get_current_object())
+
+    def is_revoked(self, jti):
+        if jti is None:
+            return False
+        if self.synced is None:
+            self.load()
+        elif self.sync_interval and self.syncer_pid != os.getpid():
+            self.start(current_app._get_current_object())
+        if jti not in self.filter:
+            return False
+        return RevokedToken.query.filter_by(jti=jti).first() is not None
+
+
+def revoke(claims):
+    '''
+    Adds the token described by claims to the revoked tokens, for the
+    caller to commit
+    '''
+    kind = claims.get('type', 'access')
+    db.session.add(RevokedToken(
+        jti=claims['jti'],
+        kind=kind,
+        expires_at=datetime.utcfromtimestamp(claims['exp']),
+        date_revoked=datetime.utcnow()))
+    revocations = current_app.extensions.get('revocations')
+    if revocations is not None and kind == 'access':
+        revocations.add(claims['jti'])
+
+
+def verify_refresh_token(token):
+    '''
+    Decodes a refresh token. Refreshing is rare and a refresh token must
+    never be used twice, so the database is checked directly.
+    '''
+    claims = _default_jwt_decode_handler(token)
+    if claims.get('type') != 'refresh':
+        raise jwt.InvalidTokenError('Not a refresh token')
+    if RevokedToken.query.filter_by(jti=claims['jti']).first():
+        raise jwt.InvalidTokenError('Token has been revoked')
+    return claims
+
+
+def init_app(app):
+    '''
+    Checks access tokens on app against the revoked tokens
+    '''
+    revocations = RevocationList.from_config(app.config)
+    app.extensions['revocations'] = revocations
+    # Loaded before the first request is timed, then refreshed in the
+    # background
+    app.before_first_request(revocations.load)
@@ -0,0 +1,162 @@
+import json
+
+from flask import current_app, request
+from sqlalchemy import Boolean, Integer, String
+
+from bucketlist.models import User, Bucketlist, Items
+
+
+class ValidationError(ValueError):
+    '''
+    Raised for a payload that does not match its schema. message is None
+    when a required field is missing or empty, so each endpoint can keep
+    its own wording for that case.
+    '''
+
+    def __init__(self, message=None, status=None):
+        super(ValidationError, self).__init__(message)
+        self.message = message
+        self.status = status
+
+
+class BodyTooLarge(ValidationError):
+    '''
+    Raised for a request body over MAX_JSON_BODY_BYTES, before it is read
+    '''
+
+
+class Field(object):
+    '''
+    One payload field: the type it must have, the longest a string may be
+    and an optional check(value) returning an error message or None
+    '''
+
+    NAMES = {str: 'a string', bool: 'true or false', int: 'an integer'}
+
+    def __init__(self, kind, required=True, max_length=None, check=None):
+        self.kind = kind
+        self.required = required
+        self.max_length = max_length
+        self.check = check
+
+    @classmethod
+    def of(cls, column, **options):
+        '''
+        A field matching a model column's type and length
+        '''
+        column_type = column.type
+        if isinstance(column_type, String):
+            options.setdefault('max_length', column_type.length)
+            return cls(str, **options)
+        if isinstance(column_type, Boolean):
+            return cls(bool, **options)
+        if isinstance(column_type, Integer):
+            return cls(int, **options)
+        raise TypeError('No field for {!r}'.format(column_type))
+
+
+class Schema(object):
+    '''
+    Fields a JSON object payload may carry. Each field is compiled once
+    into a tuple of its checks, so validating is a single pass over them.
+    Keys outside the schema are ignored and left out of the payload.
+    Custom checks run once every field is present and well typed.
+    '''
+
+    def __init__(self, **fields):
+        self.fields = [(name, field.kind, field.required, field.max_length)
+                       for name, field in fields.items()]
+        self.checks = [(name, field.check) for name, field in fields.items()
+                       if field.check is not None]
+
+    def validate(self, data):
+        '''
+        Returns the payload's schema fields, or raises ValidationError
+        '''
+        if not isinstance(data, dict) or not data:
+            raise ValidationError()
+        payload = {}
+        for name, kind, required, max_length in self.fields:
+            value = data.get(name)
+            if value is None or value == '':
+                if required:
+                    raise ValidationError()
+                continue
+            # bool is a subclass of int, but never a valid integer here
+            if not isinstance(value, kind) or \
+                    (kind is int and isinstance(value, bool)):
+                raise ValidationError('{} must be {}.'.format(
+                    name, Field.NAMES[kind]))
+            if max_length is not None and len(value) > max_length:
+                raise ValidationError('{} must be at most {} characters.'
+                                      .format(name, max_length))
+            payload[name] = value
+        for name, check in self.checks:
+            message = check(payload[name]) if name in payload else None
+            if message:
+                raise ValidationError(message, 'Fail')
+        return payload
+
+    def is_valid(self, data):
+        try:
+            self.validate(data)
+        except ValidationError:
+            return False
+        return True
+
+
+def email_address(value):
+    if '@' not in value or '.com' not in value:
+        return 'Invalid email address'
+
+
+# Longest password accepted, so hashing cost stays bounded
+MAX_PASSWORD_LENGTH = 128
+
+USER = Schema(
+    email=Field.of(User.email, check=email_address),
+    username=Field.of(User.username, required=False),
+    first_name=Field.of(User.first_name),
+    last_name=Field.of(User.last_name),
+    password=Field(str, max_length=MAX_PASSWORD_LENGTH)
+)
+
+LOGIN = Schema(
+    email=Field.of(User.email),
+    password=Field(str, max_length=MAX_PASSWORD_LENGTH)
+)
+
+BUCKETLIST = Schema(
+    title=Field.of(Bucketlist.title)
+)
+
+ITEM = Schema(
+    name=Field.of(Items.name),
+    done=Field.of(Items.done, required=False)
+)
+
+
+def read_json():
+    '''
+    Parses the request's JSON body, refusing bodies over
+    MAX_JSON_BODY_BYTES before reading them. Returns None when the body
+    is not JSON.
+    '''
+    limit = current_app.config.get('MAX_JSON_BODY_BYTES', 64 * 1024)
+    length = request.content_length
+    if length is not None and length > limit:
+        raise BodyTooLarge('Request body is too large.')
+    if not request.is_json:
+        return None
+    if length is None:
+        # A chunked body has no declared length, so read one byte past
+        # the limit to tell if it is over
+        body = request.stream.read(limit + 1)
+        if len(body) > limit:
+            raise BodyTooLarge('Request body is too large.')
+    else:
+        body = request.get_data(cache=True)
+    try:
+        return json.loads(body.decode('utf-8'))
+    except ValueError:
+        raise ValidationError('Request body is not valid JSON.')
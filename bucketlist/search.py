@@ -0,0 +1,174 @@
+import re
+
+from sqlalchemy import DDL, event, func, text
+
+from bucketlist import db
+from bucketlist.models import Bucketlist, Items
+
+
+# Search runs on the 'simple' configuration: titles and names are short,
+# often not English, and stemming them does more harm than good
+TS_CONFIG = 'simple'
+
+# On SQLite, external content FTS5 tables kept in step with their source
+# table by triggers, so bulk inserts and cascades are indexed as well
+SQLITE_DDL = {
+    'bucketlist': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS bucketlist_fts USING fts5("
+        "title, content='bucketlist', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS bucketlist_fts_insert "
+        "AFTER INSERT ON bucketlist BEGIN "
+        "INSERT INTO bucketlist_fts(rowid, title) "
+        "VALUES (new.id, new.title); END",
+        "CREATE TRIGGER IF NOT EXISTS bucketlist_fts_delete "
+        "AFTER DELETE ON bucketlist BEGIN "
+        "INSERT INTO bucketlist_fts(bucketlist_fts, rowid, title) "
+        "VALUES ('delete', old.id, old.title); END",
+        "CREATE TRIGGER IF NOT EXISTS bucketlist_fts_update "
+        "AFTER UPDATE OF title ON bucketlist BEGIN "
+        "INSERT INTO bucketlist_fts(bucketlist_fts, rowid, title) "
+        "VALUES ('delete', old.id, old.title); "
+        "INSERT INTO bucketlist_fts(rowid, title) "
+        "VALUES (new.id, new.title); END",
+    ],
+    'items': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5("
+        "name, content='items', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS items_fts_insert "
+        "AFTER INSERT ON items BEGIN "
+        "INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name); END",
+        "CREATE TRIGGER IF NOT EXISTS items_fts_delete "
+        "AFTER DELETE ON items BEGIN "
+        "INSERT INTO items_fts(items_fts, rowid, name) "
+        "VALUES ('delete', old.id, old.name); END",
+        "CREATE TRIGGER IF NOT EXISTS items_fts_update "
+        "AFTER UPDATE OF name ON items BEGIN "
+        "INSERT INTO items_fts(items_fts, rowid, name) "
+        "VALUES ('delete', old.id, old.name); "
+        "INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name); END",
+    ],
+}
+
+# On Postgres, GIN expression indexes over the same to_tsvector() calls
+# the queries below make, so no extra column has to be maintained
+POSTGRES_DDL = {
+    'bucketlist': [
+        "CREATE INDEX IF NOT EXISTS ix_bucketlist_title_fts ON bucketlist "
+        "USING gin (to_tsvector('simple', coalesce(title, '')))",
+    ],
+    'items': [
+        "CREATE INDEX IF NOT EXISTS ix_items_name_fts ON items "
+        "USING gin (to_tsvector('simple', coalesce(name, '')))",
+    ],
+}
+
+
+def install_search_ddl():
+    '''
+    Creates the search tables and indexes whenever create_all() creates
+    the tables they cover; migrations do the same for real databases
+    '''
+    for table in (Bucketlist.__table__, Items.__table__):
+        for statement in SQLITE_DDL[table.name]:
+            event.listen(table, 'after_create',
+                         DDL(statement).execute_if(dialect='sqlite'))
+        for statement in POSTGRES_DDL[table.name]:
+            event.listen(table, 'after_create',
+                         DDL(statement).execute_if(dialect='postgresql'))
+        # Virtual tables outlive the table they index, so drop_all()
+        # has to remove them for a later create_all() to rebuild them
+        event.listen(table, 'before_drop', DDL(
+            'DROP TABLE IF EXISTS {}_fts'.format(table.name)).execute_if(
+            dialect='sqlite'))
+
+
+install_search_ddl()
+
+
+def search_terms(query):
+    '''
+    Splits a user query into lower case word terms, dropping operators
+    and punctuation the full-text syntax would otherwise interpret
+    '''
+    return re.findall(r'\w+', query.lower())
+
+
+def tsvector(column):
+    return func.to_tsvector(TS_CONFIG, func.coalesce(column, ''))
+
+
+def search_postgres(email, terms, limit):
+    # Every term must match, the last one as a prefix so results follow
+    # the user while they type
+    query = func.to_tsquery(TS_CONFIG, ' & '.join(
+        terms[:-1] + [terms[-1] + ':*']))
+
+    title_rank = func.ts_rank(tsvector(Bucketlist.title), query)
+    bucketlists = db.session.query(
+        Bucketlist.id, Bucketlist.title, title_rank).filter(
+        Bucketlist.users_email == email,
+        tsvector(Bucketlist.title).op('@@')(query)).order_by(
+        title_rank.desc(), Bucketlist.id).limit(limit).all()
+
+    name_rank = func.ts_rank(tsvector(Items.name), query)
+    items = db.session.query(
+        Items.id, Items.name, Items.bucketlist_id, Items.done,
+        name_rank).join(Items.bucketlist).filter(
+        Bucketlist.users_email == email,
+        tsvector(Items.name).op('@@')(query)).order_by(
+        name_rank.desc(), Items.id).limit(limit).all()
+    return bucketlists, items
+
+
+def search_sqlite(email, terms, limit):
+    # Quoted terms are matched literally; the trailing * makes the last
+    # one a prefix. FTS5's rank column is bm25(), lower for better
+    # matches, and ORDER BY rank is the order FTS5 can serve fastest.
+    match = ' '.join('"{}"'.format(term) for term in terms) + '*'
+    params = {'match': match, 'email': email, 'limit': limit}
+
+    bucketlists = db.session.execute(text(
+        "SELECT bucketlist.id, bucketlist.title, -bucketlist_fts.rank "
+        "FROM bucketlist_fts "
+        "JOIN bucketlist ON bucketlist.id = bucketlist_fts.rowid "
+        "WHERE bucketlist_fts MATCH :match "
+        "AND bucketlist.users_email = :email "
+        "ORDER BY bucketlist_fts.rank LIMIT :limit"),
+        params).fetchall()
+
+    items = db.session.execute(text(
+        "SELECT items.id, items.name, items.bucketlist_id, items.done, "
+        "-items_fts.rank "
+        "FROM items_fts "
+        "JOIN items ON items.id = items_fts.rowid "
+        "JOIN bucketlist ON bucketlist.id = items.bucketlist_id "
+        "WHERE items_fts MATCH :match "
+        "AND bucketlist.users_email = :email "
+        "ORDER BY items_fts.rank LIMIT :limit"),
+        params).fetchall()
+    return bucketlists, items
+
+
+def search(email, query, limit=20):
+    '''
+    Returns the best (bucketlist hits, item hits) for a user's query, each
+    a list of dicts carrying a rank where higher is the better match
+    '''
+    terms = search_terms(query)
+    if not terms:
+        return [], []
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        bucketlists, items = search_postgres(email, terms, limit)
+    elif dialect == 'sqlite':
+        bucketlists, items = search_sqlite(email, terms, limit)
+    else:
+        raise NotImplementedError(
+            'Search is not supported on {}'.format(dialect))
+
+    return ([{'id': id, 'title': title, 'rank': float(rank)}
+             for id, title, rank in bucketlists],
+            [{'id': id, 'name': name, 'bucketlist_id': bucketlist_id,
+              'done': bool(done), 'rank': float(rank)}
+             for id, name, bucketlist_id, done, rank in items])
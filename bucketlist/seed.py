@@ -0,0 +1,169 @@
+import datetime
+import math
+import random
+
+from sqlalchemy import func, text
+
+from bucketlist import db
+from bucketlist.importer import insert_rows
+from bucketlist.models import User, Bucketlist, Items
+from bucketlist.passwords import hash_password
+
+
+WORDS = [
+    'visit', 'travel', 'climb', 'learn', 'read', 'write', 'cook', 'swim',
+    'run', 'build', 'paint', 'sing', 'dance', 'ride', 'sail', 'fly', 'see',
+    'lagos', 'accra', 'nairobi', 'kigali', 'cairo', 'paris', 'tokyo', 'lima',
+    'mountain', 'ocean', 'desert', 'river', 'forest', 'island', 'volcano',
+    'guitar', 'piano', 'marathon', 'novel', 'garden', 'bridge', 'castle',
+    'french', 'spanish', 'swahili', 'pottery', 'chess', 'surfing', 'wine',
+]
+
+
+class Seeder(object):
+    '''
+    Generates users with bucketlists and items shaped like real accounts:
+    lists per user and items per list are log-normal, so most accounts
+    are small and a few are very large, and activity is spread over the
+    last few years with older items more likely to be done.
+
+    Rows are written with insert_rows() (COPY on Postgres, executemany
+    elsewhere) in batches, with ids assigned up front so items never wait
+    on a lookup of their bucketlist's id. Every user shares one password
+    hash, computed once.
+    '''
+
+    def __init__(self, bucketlists=5, items=10, years=3, password='password',
+                 batch_size=10000, seed=None, now=None):
+        self.bucketlists = bucketlists
+        self.items = items
+        self.years = years
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.now = now or datetime.datetime.now()
+        self.password_hash = hash_password(password)
+        self.counts = {'users': 0, 'bucketlists': 0, 'items': 0}
+
+    def skewed(self, mean, sigma=1.0):
+        '''
+        A log-normal count with the given mean, capped at 50 times it
+        '''
+        mu = math.log(mean) - sigma ** 2 / 2 if mean > 0 else 0
+        value = int(self.rng.lognormvariate(mu, sigma)) if mean > 0 else 0
+        return min(value, int(mean * 50))
+
+    def moment(self, start):
+        '''
+        A random time between start and now
+        '''
+        seconds = max((self.now - start).total_seconds(), 0)
+        return start + datetime.timedelta(seconds=self.rng.random() * seconds)
+
+    def label(self, words, suffix, length):
+        # A number keeps labels unique within their scope
+        phrase = ' '.join(self.rng.choice(WORDS) for _ in range(words))
+        suffix = ' {}'.format(suffix)
+        return phrase[:length - len(suffix)] + suffix
+
+    def run(self, users, progress=None):
+        '''
+        Generates that many users with their bucketlists and items,
+        calling progress(counts) after each batch. Returns the counts of
+        rows written.
+        '''
+        progress = progress or (lambda counts: None)
+        user_id = next_id(User)
+        bucketlist_id = next_id(Bucketlist)
+        item_id = next_id(Items)
+        start = self.now - datetime.timedelta(days=365 * self.years)
+        title_length = Bucketlist.title.type.length
+
+        user_rows, bucketlist_rows, item_rows = [], [], []
+        for number in range(users):
+            email = 'user{}@seed.example.com'.format(user_id)
+            user_rows.append({
+                'id': user_id,
+                'email': email,
+                'username': 'seed{}'.format(user_id),
+                'first_name': 'Seed',
+                'last_name': 'User',
+                'password_hash': self.password_hash,
+                'is_admin': False
+            })
+            user_id += 1
+            joined = self.moment(start)
+
+            for index in range(self.skewed(self.bucketlists)):
+                created = self.moment(joined)
+                modified = created
+                item_count = done_count = 0
+                for position in range(self.skewed(self.items, 1.2)):
+                    item_created = self.moment(created)
+                    # Older items have had longer to get done
+                    age = (self.now - item_created).total_seconds() / \
+                        max((self.now - start).total_seconds(), 1)
+                    done = self.rng.random() < 0.1 + 0.6 * age
+                    item_modified = self.moment(item_created) if done \
+                        else item_created
+                    item_rows.append({
+                        'id': item_id,
+                        'name': self.label(3, position, 255),
+                        'bucketlist_id': bucketlist_id,
+                        'date_created': item_created,
+                        'date_modified': item_modified,
+                        'done': done
+                    })
+                    item_id += 1
+                    item_count += 1
+                    done_count += done
+                    modified = max(modified, item_modified)
+                bucketlist_rows.append({
+                    'id': bucketlist_id,
+                    'title': self.label(2, index, title_length),
+                    'date_created': created,
+                    'date_modified': modified,
+                    'users_email': email,
+                    'item_count': item_count,
+                    'done_count': done_count
+                })
+                bucketlist_id += 1
+
+            if len(item_rows) >= self.batch_size or \
+                    len(bucketlist_rows) >= self.batch_size or \
+                    number == users - 1:
+                self.write(user_rows, bucketlist_rows, item_rows)
+                user_rows, bucketlist_rows, item_rows = [], [], []
+                progress(self.counts)
+
+        reset_sequences()
+        return self.counts
+
+    def write(self, users, bucketlists, items):
+        # Parents first, each batch in one transaction
+        for model, rows, name in ((User, users, 'users'),
+                                  (Bucketlist, bucketlists, 'bucketlists'),
+                                  (Items, items, 'items')):
+            for offset in range(0, len(rows), self.batch_size):
+                insert_rows(model.__table__,
+                            rows[offset:offset + self.batch_size])
+            self.counts[name] += len(rows)
+        db.session.commit()
+
+
+def next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def reset_sequences():
+    '''
+    Moves Postgres id sequences past the ids assigned while seeding
+    '''
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    preparer = db.session.get_bind().dialect.identifier_preparer
+    for model in (User, Bucketlist, Items):
+        table = preparer.format_table(model.__table__)
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+            "(SELECT coalesce(max(id), 1) FROM {0}))".format(table)))
+    db.session.commit()
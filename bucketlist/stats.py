@@ -0,0 +1,65 @@
+import datetime
+
+from sqlalchemy import case, func, select
+
+from bucketlist import db
+from bucketlist.models import Bucketlist, Items
+
+
+def week_of(column):
+    '''
+    SQL expression for the Monday starting the week column falls in
+    '''
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return func.to_char(func.date_trunc('week', column), 'YYYY-MM-DD')
+    if dialect == 'sqlite':
+        return func.date(column, 'weekday 0', '-6 days')
+    raise NotImplementedError('Stats are not supported on {}'.format(dialect))
+
+
+def user_stats(email, weeks=12, now=None):
+    '''
+    Summarizes a user's bucketlists and items with a single GROUP BY.
+
+    Items are grouped on the week they were completed in, or NULL when
+    they are not done or were completed before the window; summing the
+    groups gives the totals. Items record no completion time, so a done
+    item counts from when it was last modified.
+    '''
+    now = now or datetime.datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    since = today - datetime.timedelta(days=today.weekday(),
+                                       weeks=weeks - 1)
+
+    week = case([(Items.done & (Items.date_modified >= since),
+                  week_of(Items.date_modified))]).label('week')
+    bucketlists = select([func.count(Bucketlist.id)]).where(
+        Bucketlist.users_email == email).correlate(None).as_scalar()
+    rows = db.session.query(
+        week, func.count(Items.id),
+        func.sum(case([(Items.done, 1)], else_=0)),
+        bucketlists).select_from(Bucketlist).outerjoin(
+        Bucketlist.items).filter(
+        Bucketlist.users_email == email).group_by(week).all()
+
+    completed = {}
+    stats = {'bucketlists': 0, 'items': 0, 'done': 0}
+    for week_start, items, done, total in rows:
+        stats['bucketlists'] = total
+        stats['items'] += items
+        stats['done'] += done or 0
+        if week_start is not None:
+            completed[week_start] = done
+
+    stats['done_ratio'] = float(stats['done']) / stats['items'] \
+        if stats['items'] else 0.0
+    stats['completed_per_week'] = []
+    for number in range(weeks):
+        week_start = (since + datetime.timedelta(weeks=number)).strftime(
+            '%Y-%m-%d')
+        stats['completed_per_week'].append({
+            'week': week_start,
+            'done': completed.get(week_start, 0)
+        })
+    return stats
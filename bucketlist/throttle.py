@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+from bucketlist.cache import LocalSharedClient
+
+
+class ThrottleBackend(object):
+    '''
+    Storage for ThrottlePolicy token buckets. take() spends one token from
+    the bucket at key, which holds up to capacity tokens and gains rate
+    tokens a second, and returns 0 when a token was spent or else the
+    seconds until one will be available.
+    '''
+
+    def take(self, key, capacity, rate):
+        raise NotImplementedError
+
+
+def refill(state, capacity, rate, now):
+    '''
+    Spends a token from a (tokens, updated) bucket state, returning the
+    new state and the seconds to wait, 0 when the token was spent
+    '''
+    tokens, updated = state or (capacity, now)
+    tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0.0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class MemoryThrottleBackend(ThrottleBackend):
+    '''
+    Buckets for this process only, at most max_keys of them. The least
+    recently used bucket is dropped first, so an attacker cycling through
+    addresses cannot grow it without bound.
+    '''
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        with self._lock:
+            state, wait = refill(self._buckets.get(key), capacity, rate,
+                                 time.monotonic())
+            self._buckets[key] = state
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SharedThrottleBackend(ThrottleBackend):
+    '''
+    Buckets in a shared store client exposing redis style get/set(ex=)
+    calls, so every worker draws on the same buckets. A read and the
+    following write are not atomic, so attempts racing on one bucket may
+    get a few more tokens than it holds.
+    '''
+
+    def __init__(self, client):
+        self.client = client
+
+    def take(self, key, capacity, rate):
+        value = self.client.get(key)
+        if isinstance(value, bytes):
+            value = value.decode()
+        state = tuple(float(part) for part in value.split()) \
+            if value else None
+        (tokens, updated), wait = refill(state, capacity, rate, time.time())
+        # A bucket left alone until it is full again can be forgotten
+        self.client.set(key, '{} {}'.format(tokens, updated),
+                        ex=int((capacity - tokens) / rate) + 1)
+        return wait
+
+
+class ThrottlePolicy(object):
+    '''
+    Limits login attempts per email and per client address with token
+    buckets. Each limit is (attempts, seconds): a burst of that many
+    attempts is allowed, then one more every seconds / attempts.
+    '''
+
+    def __init__(self, backend, email_limit=(5, 60), address_limit=(30, 60)):
+        self.backend = backend
+        self.email_limit = email_limit
+        self.address_limit = address_limit
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        kind = config.get('LOGIN_THROTTLE', 'memory')
+        if not kind:
+            return None
+        if kind == 'memory':
+            backend = MemoryThrottleBackend(
+                config.get('LOGIN_THROTTLE_MAX_KEYS', 100000))
+        elif kind == 'shared':
+            backend = SharedThrottleBackend(
+                config.get('LOGIN_THROTTLE_CLIENT') or LocalSharedClient())
+        else:
+            raise ValueError('Unknown LOGIN_THROTTLE: {}'.format(kind))
+        return cls(backend, config.get('LOGIN_THROTTLE_EMAIL', (5, 60)),
+                   config.get('LOGIN_THROTTLE_ADDRESS', (30, 60)))
+
+    def take(self, kind, value, limit):
+        attempts, seconds = limit
+        return self.backend.take('login:{}:{}'.format(kind, value),
+                                 attempts, float(attempts) / seconds)
+
+    def check(self, email, address):
+        '''
+        Spends an attempt for email and address, returning the seconds the
+        client must wait, or 0 when the attempt may go ahead
+        '''
+        wait = self.take('address', address, self.address_limit)
+        if not wait and email:
+            wait = self.take('email', str(email).strip().lower(),
+                             self.email_limit)
+        if wait:
+            with self._lock:
+                self.rejected += 1
+        return wait
+
+
+def init_app(app):
+    '''
+    Throttles login attempts on app unless LOGIN_THROTTLE is None
+    '''
+    app.extensions['login_throttle'] = ThrottlePolicy.from_config(app.config)
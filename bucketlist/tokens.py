@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+
+import jwt
+from flask import current_app, g
+from flask_jwt import _default_jwt_decode_handler
+
+from bucketlist.cache import LRUCacheBackend
+
+
+class VerifiedTokenCache(object):
+    '''
+    Claims of tokens whose signature and claims have already been checked,
+    keyed by a digest of the token. An entry expires with the token's exp
+    claim, so a cached token stops being accepted when decoding it again
+    would start failing. A token that differs in any byte has another
+    digest and is verified from scratch.
+    '''
+
+    def __init__(self, max_entries=4096):
+        self.backend = LRUCacheBackend(max_entries=max_entries, ttl=None)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        max_entries = config.get('TOKEN_CACHE_MAX_ENTRIES', 4096)
+        return cls(max_entries) if max_entries else None
+
+    @staticmethod
+    def key(token):
+        if isinstance(token, str):
+            token = token.encode()
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        claims = self.backend.get(self.key(token))
+        with self._lock:
+            if claims is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return claims
+
+    def set(self, token, claims):
+        # Tokens without an expiry, or already past it, are not kept
+        ttl = claims.get('exp', 0) - time.time()
+        if ttl > 0:
+            self.backend.set(self.key(token), claims, ttl=ttl)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self.backend),
+                'evictions': self.backend.evictions}
+
+
+def verify_token(token):
+    '''
+    Decodes an access token, checking its signature only the first time
+    it is seen by this process, and refuses it once revoked. The claims
+    are kept on g for the rest of the request.
+    '''
+    cache = current_app.extensions.get('token_cache')
+    claims = cache.get(token) if cache is not None else None
+    if claims is None:
+        claims = _default_jwt_decode_handler(token)
+        if cache is not None:
+            cache.set(token, claims)
+    # Tokens issued before refresh tokens existed carry no type
+    if claims.get('type', 'access') != 'access':
+        raise jwt.InvalidTokenError('Not an access token')
+    revocations = current_app.extensions.get('revocations')
+    if revocations is not None and revocations.is_revoked(claims.get('jti')):
+        raise jwt.InvalidTokenError('Token has been revoked')
+    g.verified_token = (token, claims)
+    return claims
+
+
+def token_claims(token):
+    '''
+    Claims of a "JWT " prefixed or bare token, reusing the ones already
+    verified for this request when it is the same token
+    '''
+    token = token.replace('JWT ', '', 1)
+    verified, claims = g.get('verified_token', (None, None))
+    if verified == token:
+        return claims
+    return verify_token(token)
+
+
+def init_app(app, extension):
+    '''
+    Makes the Flask-JWT extension verify tokens through the app's cache
+    '''
+    app.extensions['token_cache'] = VerifiedTokenCache.from_config(
+        app.config)
+    # Ids of users checked against the database in the last
+    # IDENTITY_REVALIDATE_SECONDS, each forgotten when that has elapsed
+    app.extensions['revalidated_identities'] = LRUCacheBackend(
+        max_entries=app.config.get('IDENTITY_REVALIDATE_MAX_ENTRIES', 4096),
+        ttl=None)
+    extension.jwt_decode_handler(verify_token)
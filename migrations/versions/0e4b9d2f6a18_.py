@@ -0,0 +1,36 @@
+"""index item name prefixes on postgres
+
+Revision ID: 0e4b9d2f6a18
+Revises: c5e1a7d9f304
+Create Date: 2026-10-19 11:24:06.517342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from bucketlist.migration_ops import concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '0e4b9d2f6a18'
+down_revision = 'c5e1a7d9f304'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite orders names by code point already, so its prefix ranges
+    # use the existing (bucketlist_id, name) index
+    with concurrently() as postgresql_concurrently:
+        if postgresql_concurrently:
+            op.execute(
+                'CREATE INDEX CONCURRENTLY '
+                'ix_items_bucketlist_id_name_pattern ON items '
+                '(bucketlist_id, name text_pattern_ops)')
+
+
+def downgrade():
+    with concurrently() as postgresql_concurrently:
+        if postgresql_concurrently:
+            op.execute('DROP INDEX CONCURRENTLY '
+                       'ix_items_bucketlist_id_name_pattern')
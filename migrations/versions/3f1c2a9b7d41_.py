@@ -0,0 +1,26 @@
+"""keyset pagination index on bucketlist
+
+Revision ID: 3f1c2a9b7d41
+Revises: 58cd3c2d57d2
+Create Date: 2026-10-18 13:02:11.417520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d41'
+down_revision = '58cd3c2d57d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_bucketlist_users_email_date_created_id', 'bucketlist',
+                    ['users_email', 'date_created', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_bucketlist_users_email_date_created_id',
+                  table_name='bucketlist')
@@ -0,0 +1,34 @@
+"""room for longer password hashes
+
+Revision ID: 6d4e2b8f1a37
+Revises: b3f8c1d6e274
+Create Date: 2026-10-18 21:14:52.087316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d4e2b8f1a37'
+down_revision = 'b3f8c1d6e274'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite does not enforce VARCHAR lengths, and altering the column
+    # there would rebuild the user table
+    if op.get_context().dialect.name == 'sqlite':
+        return
+    op.alter_column('user', 'password_hash',
+                    existing_type=sa.String(length=100),
+                    type_=sa.String(length=255))
+
+
+def downgrade():
+    if op.get_context().dialect.name == 'sqlite':
+        return
+    op.alter_column('user', 'password_hash',
+                    existing_type=sa.String(length=255),
+                    type_=sa.String(length=100))
@@ -0,0 +1,42 @@
+"""index foreign keys and lookup columns
+
+Revision ID: 9b2e4d7c1a05
+Revises: 3f1c2a9b7d41
+Create Date: 2026-10-18 13:20:44.902113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from bucketlist.migration_ops import concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e4d7c1a05'
+down_revision = '3f1c2a9b7d41'
+branch_labels = None
+depends_on = None
+
+
+# (users_email, id) also serves lookups on users_email alone, so that
+# foreign key does not get an index of its own.
+INDEXES = [
+    ('ix_bucketlist_users_email_id', 'bucketlist', ['users_email', 'id']),
+    ('ix_bucketlist_title', 'bucketlist', ['title']),
+    ('ix_items_bucketlist_id', 'items', ['bucketlist_id']),
+    ('ix_items_name', 'items', ['name']),
+]
+
+
+def upgrade():
+    with concurrently() as postgresql_concurrently:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=postgresql_concurrently)
+
+
+def downgrade():
+    with concurrently() as postgresql_concurrently:
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=postgresql_concurrently)
@@ -0,0 +1,82 @@
+"""full-text search over titles and item names
+
+Revision ID: a7d3e9f04c12
+Revises: f2c6d8e1b357
+Create Date: 2026-10-18 17:02:41.310577
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from bucketlist.migration_ops import concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9f04c12'
+down_revision = 'f2c6d8e1b357'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_TABLES = [
+    ('bucketlist', 'title'),
+    ('items', 'name'),
+]
+
+POSTGRES_INDEXES = [
+    ('ix_bucketlist_title_fts', 'bucketlist', 'title'),
+    ('ix_items_name_fts', 'items', 'name'),
+]
+
+
+def upgrade_sqlite():
+    for table, column in SQLITE_TABLES:
+        fts = '{}_fts'.format(table)
+        values = dict(table=table, column=column, fts=fts)
+        op.execute(
+            "CREATE VIRTUAL TABLE {fts} USING fts5("
+            "{column}, content='{table}', content_rowid='id')".format(
+                **values))
+        op.execute(
+            "CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN "
+            "INSERT INTO {fts}(rowid, {column}) "
+            "VALUES (new.id, new.{column}); END".format(**values))
+        op.execute(
+            "CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, {column}) "
+            "VALUES ('delete', old.id, old.{column}); END".format(**values))
+        op.execute(
+            "CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} "
+            "ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, {column}) "
+            "VALUES ('delete', old.id, old.{column}); "
+            "INSERT INTO {fts}(rowid, {column}) "
+            "VALUES (new.id, new.{column}); END".format(**values))
+        op.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(
+            **values))
+
+
+def upgrade():
+    dialect = op.get_context().dialect.name
+    if dialect == 'sqlite':
+        upgrade_sqlite()
+    elif dialect == 'postgresql':
+        with concurrently():
+            for name, table, column in POSTGRES_INDEXES:
+                op.execute(
+                    "CREATE INDEX CONCURRENTLY {} ON {} USING gin "
+                    "(to_tsvector('simple', coalesce({}, '')))".format(
+                        name, table, column))
+
+
+def downgrade():
+    dialect = op.get_context().dialect.name
+    if dialect == 'sqlite':
+        for table, _ in SQLITE_TABLES:
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute('DROP TRIGGER {}_fts_{}'.format(table, trigger))
+            op.execute('DROP TABLE {}_fts'.format(table))
+    elif dialect == 'postgresql':
+        with concurrently():
+            for name, _, _ in POSTGRES_INDEXES:
+                op.execute('DROP INDEX CONCURRENTLY {}'.format(name))
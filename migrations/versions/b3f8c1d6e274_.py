@@ -0,0 +1,36 @@
+"""denormalized item counts on bucketlists
+
+Revision ID: b3f8c1d6e274
+Revises: a7d3e9f04c12
+Create Date: 2026-10-18 18:21:07.442190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f8c1d6e274'
+down_revision = 'a7d3e9f04c12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('bucketlist', sa.Column(
+        'item_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('bucketlist', sa.Column(
+        'done_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute(
+        'UPDATE bucketlist SET '
+        'item_count = (SELECT count(items.id) FROM items '
+        'WHERE items.bucketlist_id = bucketlist.id), '
+        'done_count = (SELECT count(items.id) FROM items '
+        'WHERE items.bucketlist_id = bucketlist.id AND items.done)')
+
+
+def downgrade():
+    # A plain DROP COLUMN: on SQLite (3.35+) a batch table rebuild would
+    # lose the search triggers and cascade away every item
+    op.drop_column('bucketlist', 'done_count')
+    op.drop_column('bucketlist', 'item_count')
@@ -0,0 +1,49 @@
+"""scope bucketlist title and item name uniqueness
+
+Revision ID: c47a1e5f9d32
+Revises: 9b2e4d7c1a05
+Create Date: 2026-10-18 13:41:07.115392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from bucketlist.migration_ops import concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a1e5f9d32'
+down_revision = '9b2e4d7c1a05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing duplicate titles per user or names per bucketlist must be
+    # cleaned up before this runs, or building the unique indexes fails.
+    with concurrently() as postgresql_concurrently:
+        op.create_index('uq_bucketlist_users_email_title', 'bucketlist',
+                        ['users_email', 'title'], unique=True,
+                        postgresql_concurrently=postgresql_concurrently)
+        op.create_index('uq_items_bucketlist_id_name', 'items',
+                        ['bucketlist_id', 'name'], unique=True,
+                        postgresql_concurrently=postgresql_concurrently)
+        # Titles and names are no longer looked up on their own
+        op.drop_index('ix_bucketlist_title', table_name='bucketlist',
+                      postgresql_concurrently=postgresql_concurrently)
+        op.drop_index('ix_items_name', table_name='items',
+                      postgresql_concurrently=postgresql_concurrently)
+
+
+def downgrade():
+    with concurrently() as postgresql_concurrently:
+        op.create_index('ix_items_name', 'items', ['name'], unique=False,
+                        postgresql_concurrently=postgresql_concurrently)
+        op.create_index('ix_bucketlist_title', 'bucketlist', ['title'],
+                        unique=False,
+                        postgresql_concurrently=postgresql_concurrently)
+        op.drop_index('uq_items_bucketlist_id_name', table_name='items',
+                      postgresql_concurrently=postgresql_concurrently)
+        op.drop_index('uq_bucketlist_users_email_title',
+                      table_name='bucketlist',
+                      postgresql_concurrently=postgresql_concurrently)
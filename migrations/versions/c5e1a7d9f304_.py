@@ -0,0 +1,28 @@
+"""revoked token kinds
+
+Revision ID: c5e1a7d9f304
+Revises: 8a1f5c3e9b62
+Create Date: 2026-10-19 09:12:40.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1a7d9f304'
+down_revision = '8a1f5c3e9b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows written before this have no kind. Revocation lists tell
+    # access tokens among them apart by their expiry.
+    op.add_column('revoked_token',
+                  sa.Column('kind', sa.String(length=10), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('revoked_token') as batch_op:
+        batch_op.drop_column('kind')
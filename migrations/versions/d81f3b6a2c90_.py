@@ -0,0 +1,47 @@
+"""cascade item deletes from bucketlist
+
+Revision ID: d81f3b6a2c90
+Revises: c47a1e5f9d32
+Create Date: 2026-10-18 14:02:53.640218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81f3b6a2c90'
+down_revision = 'c47a1e5f9d32'
+branch_labels = None
+depends_on = None
+
+
+# Postgres' default name for the constraint created in 58cd3c2d57d2
+FK_NAME = 'items_bucketlist_id_fkey'
+# SQLite constraints are unnamed, so batch mode names them by convention
+SQLITE_FK_NAME = 'fk_items_bucketlist_id_bucketlist'
+NAMING_CONVENTION = {
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'
+}
+
+
+def replace_foreign_key(ondelete):
+    if op.get_context().dialect.name == 'sqlite':
+        with op.batch_alter_table(
+                'items', naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(SQLITE_FK_NAME, type_='foreignkey')
+            batch_op.create_foreign_key(
+                SQLITE_FK_NAME, 'bucketlist', ['bucketlist_id'], ['id'],
+                ondelete=ondelete)
+    else:
+        op.drop_constraint(FK_NAME, 'items', type_='foreignkey')
+        op.create_foreign_key(FK_NAME, 'items', 'bucketlist',
+                              ['bucketlist_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    replace_foreign_key('CASCADE')
+
+
+def downgrade():
+    replace_foreign_key(None)
@@ -0,0 +1,54 @@
+"""tombstones and indexes for incremental sync
+
+Revision ID: e5a09c4b7f18
+Revises: d81f3b6a2c90
+Create Date: 2026-10-18 14:48:31.207664
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from bucketlist.migration_ops import concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a09c4b7f18'
+down_revision = 'd81f3b6a2c90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('users_email', sa.String(length=255), nullable=True),
+    sa.Column('kind', sa.String(length=10), nullable=True),
+    sa.Column('object_id', sa.Integer(), nullable=True),
+    sa.Column('bucketlist_id', sa.Integer(), nullable=True),
+    sa.Column('date_deleted', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstone_users_email_date_deleted_id', 'tombstone',
+                    ['users_email', 'date_deleted', 'id'], unique=False)
+    with concurrently() as postgresql_concurrently:
+        op.create_index('ix_bucketlist_users_email_date_modified_id',
+                        'bucketlist', ['users_email', 'date_modified', 'id'],
+                        unique=False,
+                        postgresql_concurrently=postgresql_concurrently)
+        op.create_index('ix_items_bucketlist_id_date_modified_id', 'items',
+                        ['bucketlist_id', 'date_modified', 'id'],
+                        unique=False,
+                        postgresql_concurrently=postgresql_concurrently)
+
+
+def downgrade():
+    with concurrently() as postgresql_concurrently:
+        op.drop_index('ix_items_bucketlist_id_date_modified_id',
+                      table_name='items',
+                      postgresql_concurrently=postgresql_concurrently)
+        op.drop_index('ix_bucketlist_users_email_date_modified_id',
+                      table_name='bucketlist',
+                      postgresql_concurrently=postgresql_concurrently)
+    op.drop_index('ix_tombstone_users_email_date_deleted_id',
+                  table_name='tombstone')
+    op.drop_table('tombstone')
@@ -0,0 +1,31 @@
+"""index item listing filters
+
+Revision ID: f2c6d8e1b357
+Revises: e5a09c4b7f18
+Create Date: 2026-10-18 15:36:12.884019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from bucketlist.migration_ops import concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6d8e1b357'
+down_revision = 'e5a09c4b7f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with concurrently() as postgresql_concurrently:
+        op.create_index('ix_items_bucketlist_id_done_id', 'items',
+                        ['bucketlist_id', 'done', 'id'], unique=False,
+                        postgresql_concurrently=postgresql_concurrently)
+
+
+def downgrade():
+    with concurrently() as postgresql_concurrently:
+        op.drop_index('ix_items_bucketlist_id_done_id', table_name='items',
+                      postgresql_concurrently=postgresql_concurrently)
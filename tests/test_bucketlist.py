@@ -1,13 +1,64 @@
 import datetime
+import io
 import json
+import logging
+import os
+import tempfile
+import threading
+import time
 import unittest
-
-from bucketlist import create_app, db
-from bucketlist.models import User
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import jwt
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date
+
+from bucketlist import create_app, db, trust_proxies
+from bucketlist.cache import ResponseCache, LRUCacheBackend,\
+    SharedCacheBackend, LocalSharedClient
+from bucketlist.config import Config
+from bucketlist.instrumentation import QueryBudgetExceeded, query_logger
+from bucketlist.metrics import Metrics
+from bucketlist.models import User, Bucketlist, Items, RevokedToken
+from bucketlist.passwords import HashingPool
+from bucketlist.revocation import RevocationList
+from bucketlist.throttle import ThrottlePolicy, SharedThrottleBackend
+from bucketlist.tokens import VerifiedTokenCache
+
+
+@contextmanager
+def count_queries(app):
+    '''
+    Collects every statement app sends to the database inside the block
+    '''
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
 
 
 class BaseTestCase(unittest.TestCase):
 
+    def request_headers(self, token=None,
+                        content_type='application/json'):
+        headers = {'Content-Type': content_type}
+        if token is not None:
+            headers['Authorization'] = token
+        return headers
+
+    @property
+    def headers(self):
+        return self.request_headers(self.test_token)
+
     def setUp(self):
         create_app('testing').app_context().push()
         db.drop_all()
@@ -642,3 +693,1772 @@ class BucketListAPIEdgeTestCase(BaseTestCase):
                                            'Authorization': ''
                                        })
             self.assertEqual(response.status_code, 401)
+
+
+class BucketListCursorPaginationTestCase(BaseTestCase):
+
+    def create_bucketlist(self, title):
+        return self.client.post("/v1/bucketlist/",
+                                data=json.dumps({'title': title}),
+                                headers=self.headers)
+
+    def get_bucketlists(self, url):
+        response = self.client.get(url, headers=self.headers)
+        return response, json.loads(response.data.decode())
+
+    def test_cursor_pages_forward_and_back(self):
+        """
+        Test if a user can walk their bucketlists with a cursor
+        """
+        with self.client:
+            for title in ['2017', '2018', '2019']:
+                self.assertEqual(
+                    self.create_bucketlist(title).status_code, 201)
+
+            response, data = self.get_bucketlists(
+                "/v1/bucketlist/?cursor=&limit=2")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([b['title'] for b in data['bucketlists']],
+                             ['2017', '2018'])
+            self.assertIsNone(data['prev_url'])
+            self.assertTrue(data['next_url'])
+
+            response, data = self.get_bucketlists(data['next_url'])
+            self.assertEqual([b['title'] for b in data['bucketlists']],
+                             ['2019'])
+            self.assertIsNone(data['next_url'])
+
+            response, data = self.get_bucketlists(data['prev_url'])
+            self.assertEqual([b['title'] for b in data['bucketlists']],
+                             ['2017', '2018'])
+
+    def test_invalid_cursor(self):
+        """
+        Test if a malformed cursor is rejected
+        """
+        with self.client:
+            response, data = self.get_bucketlists(
+                "/v1/bucketlist/?cursor=not-a-cursor")
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(data["message"] == "Invalid cursor")
+
+
+class TokenIdentityTestCase(BaseTestCase):
+
+    def get_bucketlists(self):
+        return self.client.get("/v1/bucketlist/", headers=self.headers)
+
+    def test_token_carries_identity(self):
+        """
+        Test if the user id and email are embedded in the token
+        """
+        with self.client:
+            token = self.test_token.replace("JWT ", '', 1)
+            payload = jwt.decode(token, verify=False)
+            self.assertEqual(payload['id'], self.test_user.id)
+            self.assertEqual(payload['email'], 'test@bucket.com')
+
+    def test_revalidation_rejects_deleted_user(self):
+        """
+        Test if a deleted user's token is refused once revalidation is on
+        """
+        with self.client:
+            self.client.application.config[
+                'IDENTITY_REVALIDATE_SECONDS'] = 0
+            self.assertEqual(self.get_bucketlists().status_code, 404)
+
+            db.session.delete(self.test_user)
+            db.session.commit()
+            self.assertEqual(self.get_bucketlists().status_code, 401)
+
+    def test_revalidation_remembered_per_app(self):
+        """
+        Test if users revalidated within the interval are not looked up
+        again, and at most IDENTITY_REVALIDATE_MAX_ENTRIES are remembered
+        """
+        app = self.client.application
+        app.config['IDENTITY_REVALIDATE_SECONDS'] = 60
+        app.extensions['revalidated_identities'] = LRUCacheBackend(
+            max_entries=1, ttl=None)
+        with self.client:
+            self.assertEqual(self.get_bucketlists().status_code, 404)
+            with count_queries(app) as statements:
+                self.assertEqual(self.get_bucketlists().status_code, 404)
+            self.assertFalse([statement for statement in statements
+                              if 'FROM user' in statement])
+
+            self.client.get("/v1/bucketlist/", headers={
+                'Authorization': self.test_token_a})
+            revalidated = app.extensions['revalidated_identities']
+            self.assertEqual(len(revalidated), 1)
+            self.assertIsNone(revalidated.get(self.test_user.id))
+
+
+class BucketListQueryCountTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(BucketListQueryCountTestCase, self).setUp()
+        for title in ['2017', '2018', '2019']:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': title}),
+                             headers=self.headers)
+        for id in [1, 2, 3]:
+            for number in range(3):
+                self.client.post(
+                    "/v1/bucketlist/{}/items/".format(id),
+                    data=json.dumps(
+                        {'name': 'item {} {}'.format(id, number)}),
+                    headers=self.headers)
+
+    def test_detail_loads_items_in_one_query(self):
+        """
+        Test if a bucketlist and its items are fetched with one query
+        """
+        with self.client:
+            with count_queries(self.client.application) as statements:
+                response = self.client.get("/v1/bucketlist/1",
+                                           headers=self.headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data['items']), 3)
+            # Bucketlist and items joined, with no ETag aggregate for a
+            # plain GET
+            self.assertEqual(len(statements), 1)
+            self.assertIn('JOIN items', statements[0])
+
+    def test_list_include_items_avoids_n_plus_one(self):
+        """
+        Test if ?include=items batch loads items for the whole page
+        """
+        with self.client:
+            with count_queries(self.client.application) as statements:
+                response = self.client.get(
+                    "/v1/bucketlist/?cursor=&limit=3&include=items",
+                    headers=self.headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [len(b['items']) for b in data['bucketlists']], [3, 3, 3])
+            # The page, then every item of the page
+            self.assertEqual(len(statements), 2)
+
+            with count_queries(self.client.application) as statements:
+                response = self.client.get(
+                    "/v1/bucketlist/?page=1&limit=3&include=items",
+                    headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(statements), 3)
+
+
+class QueryPlanTestCase(BaseTestCase):
+
+    def explain(self, query):
+        """
+        Returns the query plan lines for a SQLAlchemy query
+        """
+        engine = db.get_engine()
+        sql = str(query.statement.compile(
+            dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+        if engine.dialect.name == 'sqlite':
+            rows = db.session.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in rows]
+        db.session.execute('SET LOCAL enable_seqscan = off')
+        return [row[0] for row in db.session.execute('EXPLAIN ' + sql)]
+
+    def assertUsesIndex(self, query):
+        plan = self.explain(query)
+        self.assertTrue(plan)
+        for line in plan:
+            self.assertNotRegex(line, r'^SCAN \w+$|Seq Scan', msg=plan)
+        self.assertRegex(' '.join(plan), r'INDEX|PRIMARY KEY|Index', msg=plan)
+
+    def test_list_query_uses_index(self):
+        """
+        Test if listing a user's bucketlists uses an index
+        """
+        self.assertUsesIndex(
+            Bucketlist.query.filter_by(users_email='test@bucket.com'))
+
+    def test_detail_query_uses_index(self):
+        """
+        Test if fetching a single bucketlist uses the primary key
+        """
+        self.assertUsesIndex(Bucketlist.query.filter_by(id=1))
+
+    def test_title_lookup_uses_index(self):
+        """
+        Test if looking up a user's bucketlist by title uses an index
+        """
+        self.assertUsesIndex(Bucketlist.query.filter_by(
+            users_email='test@bucket.com', title='2017'))
+
+    def test_item_queries_use_index(self):
+        """
+        Test if item lookups by bucketlist, and by name within a
+        bucketlist, use indexes
+        """
+        self.assertUsesIndex(Items.query.filter_by(bucketlist_id=1))
+        self.assertUsesIndex(Items.query.filter_by(
+            bucketlist_id=1, name='Visit Kampala'))
+        self.assertUsesIndex(Items.query.filter_by(
+            bucketlist_id=1, done=True).filter(Items.id > 10).order_by(
+            Items.id))
+
+
+class ScopedUniquenessTestCase(BaseTestCase):
+
+    def create_bucketlist(self, title, token):
+        return self.client.post("/v1/bucketlist/",
+                                data=json.dumps({'title': title}),
+                                headers=self.request_headers(token))
+
+    def test_titles_are_unique_per_user(self):
+        """
+        Test if two users can own bucketlists with the same title
+        """
+        with self.client:
+            response = self.create_bucketlist('2017', self.test_token)
+            self.assertEqual(response.status_code, 201)
+            response = self.create_bucketlist('2017', self.test_token_a)
+            self.assertEqual(response.status_code, 201)
+            response = self.create_bucketlist('2017', self.test_token)
+            self.assertEqual(response.status_code, 409)
+
+    def test_duplicate_create_costs_no_lookup(self):
+        """
+        Test if a create runs no pre-check query before inserting
+        """
+        with self.client:
+            self.create_bucketlist('2017', self.test_token)
+            with count_queries(self.client.application) as statements:
+                response = self.create_bucketlist('2018', self.test_token)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(
+                [s.split()[0] for s in statements], ['INSERT'])
+
+
+class BucketListDeleteTestCase(BaseTestCase):
+
+    def test_delete_cascades_to_items(self):
+        """
+        Test if deleting a bucketlist is one DELETE and removes its items
+        """
+        with self.client:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': '2017'}),
+                             headers=self.headers)
+            self.client.post("/v1/bucketlist/1/items/",
+                             data=json.dumps({'name': 'Visit Kampala'}),
+                             headers=self.headers)
+
+            with count_queries(self.client.application) as statements:
+                response = self.client.delete("/v1/bucketlist/1",
+                                              headers=self.headers)
+            self.assertEqual(response.status_code, 204)
+            # The DELETE itself, then the tombstone for syncing clients
+            self.assertEqual(
+                [s.split()[0] for s in statements], ['DELETE', 'INSERT'])
+            self.assertEqual(Bucketlist.query.count(), 0)
+            self.assertEqual(Items.query.count(), 0)
+
+    def test_delete_other_users_bucketlist(self):
+        """
+        Test if a user can delete another user's bucketlist
+        """
+        with self.client:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': '2017'}),
+                             headers=self.headers)
+            self.client.delete("/v1/bucketlist/1",
+                               headers={'Authorization': self.test_token_a})
+            self.assertEqual(Bucketlist.query.count(), 1)
+
+
+class ResponseCacheTestCase(BaseTestCase):
+
+    def get_bucketlist(self):
+        return self.client.get("/v1/bucketlist/1", headers=self.headers)
+
+    def test_reads_are_cached_until_a_write(self):
+        """
+        Test if repeated reads hit the cache and writes invalidate it
+        """
+        with self.client:
+            cache = self.client.application.extensions['response_cache']
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': '2017'}),
+                             headers=self.headers)
+
+            self.assertEqual(self.get_bucketlist().headers['X-Cache'], 'MISS')
+            with count_queries(self.client.application) as statements:
+                response = self.get_bucketlist()
+            self.assertEqual(response.headers['X-Cache'], 'HIT')
+            self.assertEqual(statements, [])
+
+            self.client.post("/v1/bucketlist/1/items/",
+                             data=json.dumps({'name': 'Visit Kampala'}),
+                             headers=self.headers)
+            response = self.get_bucketlist()
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.headers['X-Cache'], 'MISS')
+            self.assertEqual(len(data['items']), 1)
+            self.assertEqual(cache.stats()['hits'], 1)
+            self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_lru_backend_bounds_size_and_expires(self):
+        """
+        Test if the in-process backend evicts old entries and honours ttl
+        """
+        backend = LRUCacheBackend(max_entries=2, ttl=30)
+        backend.set('a', '1')
+        backend.set('b', '2')
+        backend.get('a')
+        backend.set('c', '3')
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), '1')
+        self.assertEqual(len(backend), 2)
+
+        backend.set('d', '4', ttl=-1)
+        self.assertIsNone(backend.get('d'))
+
+    def test_shared_backend_with_local_client(self):
+        """
+        Test if the shared backend works against the local stand-in
+        """
+        cache = ResponseCache(SharedCacheBackend(LocalSharedClient()))
+        key = cache.key(1, 'home.bucketlist_api', '/v1/bucketlist/1',
+                        MultiDict())
+        cache.set(key, '{}', 200)
+        self.assertEqual(cache.get(key), ['{}', 200, {}])
+        cache.invalidate(1)
+        key = cache.key(1, 'home.bucketlist_api', '/v1/bucketlist/1',
+                        MultiDict())
+        self.assertIsNone(cache.get(key))
+
+    def test_lru_backend_refused_with_several_workers(self):
+        """
+        Test if the per process cache is off by default and refused when
+        other workers could not see its invalidations
+        """
+        self.assertIsNone(ResponseCache.from_config(
+            {'RESPONSE_CACHE': Config.RESPONSE_CACHE}))
+        self.assertIsNotNone(ResponseCache.from_config(
+            {'RESPONSE_CACHE': 'lru', 'WEB_CONCURRENCY': 1}))
+        with self.assertRaises(ValueError):
+            ResponseCache.from_config(
+                {'RESPONSE_CACHE': 'lru', 'WEB_CONCURRENCY': 3})
+        self.assertIsNotNone(ResponseCache.from_config(
+            {'RESPONSE_CACHE': 'shared', 'WEB_CONCURRENCY': 3}))
+
+
+class ConditionalGetTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ConditionalGetTestCase, self).setUp()
+        # Validate against the database rather than cached headers
+        self.client.application.extensions['response_cache'] = None
+        self.client.post("/v1/bucketlist/",
+                         data=json.dumps({'title': '2017'}),
+                         headers=self.headers)
+        self.client.post("/v1/bucketlist/1/items/",
+                         data=json.dumps({'name': 'Visit Kampala'}),
+                         headers=self.headers)
+
+    def get(self, url, **headers):
+        headers.update(self.headers)
+        return self.client.get(url, headers=headers)
+
+    def test_unchanged_bucketlist_is_not_modified(self):
+        """
+        Test if a matching If-None-Match gets a 304 without loading rows
+        """
+        with self.client:
+            body_etag = self.get("/v1/bucketlist/1").headers['ETag']
+            self.assertTrue(body_etag.startswith('W/'))
+            response = self.get("/v1/bucketlist/1", **{
+                'If-None-Match': body_etag})
+            self.assertEqual(response.status_code, 304)
+
+            # Revalidating gets the aggregate validators
+            response = self.get("/v1/bucketlist/1", **{
+                'If-None-Match': 'W/"stale"'})
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            last_modified = response.headers['Last-Modified']
+
+            with count_queries(self.client.application) as statements:
+                response = self.get("/v1/bucketlist/1", **{
+                    'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(len(statements), 1)
+
+            response = self.get("/v1/bucketlist/1", **{
+                'If-Modified-Since': last_modified})
+            self.assertEqual(response.status_code, 304)
+
+    def test_item_change_updates_etag(self):
+        """
+        Test if adding an item changes the bucketlist and item list ETags
+        """
+        with self.client:
+            detail = self.get("/v1/bucketlist/1").headers['ETag']
+            items = self.get("/v1/bucketlist/1/items/").headers['ETag']
+            self.client.post("/v1/bucketlist/1/items/",
+                             data=json.dumps({'name': 'Visit Lagos'}),
+                             headers=self.headers)
+
+            response = self.get("/v1/bucketlist/1", **{
+                'If-None-Match': detail})
+            self.assertEqual(response.status_code, 200)
+            response = self.get("/v1/bucketlist/1/items/", **{
+                'If-None-Match': items})
+            self.assertEqual(response.status_code, 200)
+
+    def test_delete_is_modified_since(self):
+        """
+        Test if deleting a bucketlist or item moves Last-Modified on, though
+        the rows left are no newer
+        """
+        with self.client:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': '2018'}),
+                             headers=self.headers)
+            self.client.post("/v1/bucketlist/1/items/",
+                             data=json.dumps({'name': 'Visit Lagos'}),
+                             headers=self.headers)
+            past = datetime.datetime.now() - datetime.timedelta(minutes=5)
+            Bucketlist.query.update({'date_modified': past})
+            Items.query.update({'date_modified': past})
+            db.session.commit()
+            since = http_date(past + datetime.timedelta(minutes=1))
+
+            for url in ("/v1/bucketlist/", "/v1/bucketlist/1/items/"):
+                response = self.get(url, **{'If-Modified-Since': since})
+                self.assertEqual(response.status_code, 304)
+
+            self.client.delete("/v1/bucketlist/2", headers=self.headers)
+            self.client.delete("/v1/bucketlist/1/items/2/",
+                               headers=self.headers)
+            for url in ("/v1/bucketlist/", "/v1/bucketlist/1/items/"):
+                response = self.get(url, **{'If-Modified-Since': since})
+                self.assertEqual(response.status_code, 200)
+
+    def test_plain_get_skips_validator_queries(self):
+        """
+        Test if a GET without conditional headers runs no aggregate, and
+        the item aggregate only counts the user's own bucketlists
+        """
+        with self.client:
+            with count_queries(self.client.application) as statements:
+                response = self.get("/v1/bucketlist/1/items/")
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([statement for statement in statements
+                              if 'max(' in statement])
+
+            with count_queries(self.client.application) as statements:
+                self.client.get("/v1/bucketlist/1/items/", headers={
+                    'Authorization': self.test_token_a,
+                    'If-None-Match': '*'})
+            aggregates = [statement for statement in statements
+                          if 'max(' in statement]
+            self.assertIn('users_email', aggregates[0])
+
+    def test_cached_response_is_not_modified_without_queries(self):
+        """
+        Test if a cached response answers If-None-Match on its own
+        """
+        with self.client:
+            self.client.application.extensions['response_cache'] = \
+                ResponseCache(LRUCacheBackend())
+            etag = self.get("/v1/bucketlist/1").headers['ETag']
+            with count_queries(self.client.application) as statements:
+                response = self.get("/v1/bucketlist/1", **{
+                    'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(statements, [])
+
+
+class SyncTestCase(BaseTestCase):
+
+    def sync(self, since=None, limit=None):
+        url = "/v1/sync?since={}".format(since or '')
+        if limit:
+            url += "&limit={}".format(limit)
+        response = self.client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data.decode())
+
+    def test_sync_returns_only_changes(self):
+        """
+        Test if a sync after a cursor returns just what changed since
+        """
+        with self.client:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': '2017'}),
+                             headers=self.headers)
+            self.client.post("/v1/bucketlist/1/items/",
+                             data=json.dumps({'name': 'Visit Kampala'}),
+                             headers=self.headers)
+            data = self.sync()
+            self.assertEqual(len(data['bucketlists']), 1)
+            self.assertEqual(len(data['items']), 1)
+
+            data = self.sync(data['cursor'])
+            self.assertEqual(data['bucketlists'], [])
+            self.assertEqual(data['items'], [])
+
+            self.client.put("/v1/bucketlist/1/items/1/",
+                            data=json.dumps({'name': 'Visit Lagos'}),
+                            headers=self.headers)
+            for title in ['2018', '2019']:
+                self.client.post("/v1/bucketlist/",
+                                 data=json.dumps({'title': title}),
+                                 headers=self.headers)
+            self.client.delete("/v1/bucketlist/3", headers=self.headers)
+            data = self.sync(data['cursor'])
+            self.assertEqual([i['name'] for i in data['items']],
+                             ['Visit Lagos'])
+            self.assertEqual([b['title'] for b in data['bucketlists']],
+                             ['2018'])
+            self.assertEqual(data['deleted'], [{
+                'kind': 'bucketlist', 'id': 3, 'bucketlist_id': None,
+                'date_deleted': data['deleted'][0]['date_deleted']}])
+
+    def test_sync_pages_through_equal_timestamps(self):
+        """
+        Test if rows sharing a timestamp are paged without loss
+        """
+        with self.client:
+            now = datetime.datetime.now()
+            for title in ['2017', '2018', '2019']:
+                db.session.add(Bucketlist(title=title, date_created=now,
+                                          date_modified=now,
+                                          users_email='test@bucket.com'))
+            db.session.commit()
+
+            data = self.sync(limit=2)
+            self.assertTrue(data['has_more'])
+            titles = [b['title'] for b in data['bucketlists']]
+            data = self.sync(data['cursor'], limit=2)
+            self.assertFalse(data['has_more'])
+            titles += [b['title'] for b in data['bucketlists']]
+            self.assertEqual(titles, ['2017', '2018', '2019'])
+
+
+class BucketListItemsBatchTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(BucketListItemsBatchTestCase, self).setUp()
+        self.client.post("/v1/bucketlist/",
+                         data=json.dumps({'title': '2017'}),
+                         headers=self.headers)
+
+    def batch(self, operations):
+        response = self.client.post("/v1/bucketlist/1/items/batch",
+                                    data=json.dumps(operations),
+                                    headers=self.headers)
+        return response, json.loads(response.data.decode())
+
+    def test_batch_applies_operations(self):
+        """
+        Test if a batch creates, updates, toggles and deletes items
+        """
+        with self.client:
+            response, data = self.batch([
+                {'op': 'create', 'name': 'Visit Kampala'},
+                {'op': 'create', 'name': 'Visit Lagos'},
+                {'op': 'create', 'name': 'Visit Accra'},
+            ])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([r['status'] for r in data['results']],
+                             [201, 201, 201])
+            ids = [r['id'] for r in data['results']]
+
+            response, data = self.batch([
+                {'op': 'update', 'id': ids[0], 'name': 'Visit Kigali'},
+                {'op': 'toggle', 'id': ids[1]},
+                {'op': 'delete', 'id': ids[2]},
+                {'op': 'create', 'name': 'Visit Lagos'},
+                {'op': 'create', 'name': ''},
+                {'op': 'delete', 'id': 100},
+                {'op': 'fly'},
+            ])
+            self.assertEqual([r['status'] for r in data['results']],
+                             [200, 200, 204, 409, 400, 404, 400])
+            items = {item.id: item for item in Items.query.all()}
+            self.assertEqual(items[ids[0]].name, 'Visit Kigali')
+            self.assertTrue(items[ids[1]].done)
+            self.assertNotIn(ids[2], items)
+
+    def test_batch_uses_one_transaction(self):
+        """
+        Test if a batch of creates is written with a single bulk insert
+        """
+        with self.client:
+            operations = [{'op': 'create', 'name': 'item {}'.format(n)}
+                          for n in range(50)]
+            with count_queries(self.client.application) as statements:
+                response, data = self.batch(operations)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(Items.query.count(), 50)
+            inserts = [s for s in statements if s.startswith('INSERT')]
+            self.assertEqual(len(inserts), 1)
+
+    def test_batch_on_other_users_bucketlist(self):
+        """
+        Test if a user can batch edit another user's bucketlist
+        """
+        with self.client:
+            response = self.client.post(
+                "/v1/bucketlist/1/items/batch",
+                data=json.dumps([{'op': 'create', 'name': 'Visit Lagos'}]),
+                headers=self.request_headers(self.test_token_a))
+            self.assertEqual(response.status_code, 404)
+
+
+class BucketListItemsPageTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(BucketListItemsPageTestCase, self).setUp()
+        self.client.post("/v1/bucketlist/",
+                         data=json.dumps({'title': '2017'}),
+                         headers=self.headers)
+        self.client.post("/v1/bucketlist/1/items/batch",
+                         data=json.dumps([
+                             {'op': 'create', 'name': 'Visit Lagos'},
+                             {'op': 'create', 'name': 'Visit Accra',
+                              'done': True},
+                             {'op': 'create', 'name': 'Climb Kilimanjaro'},
+                             {'op': 'create', 'name': 'Visit Kigali',
+                              'done': True},
+                         ]),
+                         headers=self.headers)
+
+    def get_items(self, url):
+        response = self.client.get(url, headers=self.headers)
+        data = json.loads(response.data.decode())
+        return response, data
+
+    def test_items_are_paginated(self):
+        """
+        Test if item listing follows next_url until exhausted
+        """
+        with self.client:
+            response, data = self.get_items("/v1/bucketlist/1/items/?limit=3")
+            self.assertEqual(response.status_code, 200)
+            names = [item['name'] for item in data['items']]
+            self.assertEqual(len(names), 3)
+            response, data = self.get_items(data['next_url'])
+            names += [item['name'] for item in data['items']]
+            self.assertIsNone(data['next_url'])
+            self.assertEqual(names, ['Visit Lagos', 'Visit Accra',
+                                     'Climb Kilimanjaro', 'Visit Kigali'])
+
+    def test_items_filter_and_sort(self):
+        """
+        Test if items can be filtered on done and prefix and sorted by name
+        """
+        with self.client:
+            response, data = self.get_items(
+                "/v1/bucketlist/1/items/?done=true&prefix=Visit"
+                "&sort=-name&limit=1")
+            names = [item['name'] for item in data['items']]
+            response, data = self.get_items(data['next_url'])
+            names += [item['name'] for item in data['items']]
+            self.assertEqual(names, ['Visit Kigali', 'Visit Accra'])
+            self.assertIsNone(data['next_url'])
+
+            response, data = self.get_items(
+                "/v1/bucketlist/1/items/?done=false&sort=name")
+            self.assertEqual([item['name'] for item in data['items']],
+                             ['Climb Kilimanjaro', 'Visit Lagos'])
+
+    def test_items_prefix_ending_in_last_code_point(self):
+        """
+        Test if a prefix ending in the last code point, which has no
+        successor to end the range at, still matches
+        """
+        last = chr(0x10FFFF)
+        with self.client:
+            for name in ['Visit ' + last, 'Visit ' + last + ' again',
+                         'Visit ~', 'Visit%', last + last]:
+                self.client.post("/v1/bucketlist/1/items/",
+                                 data=json.dumps({'name': name}),
+                                 headers=self.headers)
+            for prefix, names in ((last, [last + last]),
+                                  ('Visit ' + last,
+                                   ['Visit ' + last,
+                                    'Visit ' + last + ' again']),
+                                  ('Visit%', ['Visit%'])):
+                response, data = self.get_items(
+                    "/v1/bucketlist/1/items/?sort=name&prefix=" +
+                    quote(prefix))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([item['name'] for item in data['items']],
+                                 names)
+
+
+class ExportTestCase(BaseTestCase):
+
+    def test_export_streams_ndjson(self):
+        """
+        Test if a user's bucketlists and items are exported as NDJSON
+        """
+        with self.client:
+            for title in ['2017', '2018']:
+                self.client.post("/v1/bucketlist/",
+                                 data=json.dumps({'title': title}),
+                                 headers=self.headers)
+            self.client.post("/v1/bucketlist/1/items/batch",
+                             data=json.dumps([
+                                 {'op': 'create', 'name': 'Visit Lagos'},
+                                 {'op': 'create', 'name': 'Visit Accra'}]),
+                             headers=self.headers)
+
+            response = self.client.get("/v1/export", headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            records = [json.loads(line) for line in
+                       response.data.decode().splitlines()]
+            self.assertEqual(
+                [(r['type'], r.get('title') or r.get('name'))
+                 for r in records],
+                [('bucketlist', '2017'), ('item', 'Visit Lagos'),
+                 ('item', 'Visit Accra'), ('bucketlist', '2018')])
+
+
+class ImportTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.application.config['IMPORT_BATCH_SIZE'] = 2
+
+    def import_lines(self, lines, token):
+        response = self.client.post(
+            "/v1/import", data='\n'.join(lines) + '\n',
+            headers=self.request_headers(token, 'application/x-ndjson'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        return [json.loads(line) for line in
+                response.data.decode().splitlines()]
+
+    def test_import_round_trips_an_export(self):
+        """
+        Test if an export imports into another account in batches
+        """
+        with self.client:
+            for title in ['2017', '2018', '2019']:
+                self.client.post("/v1/bucketlist/",
+                                 data=json.dumps({'title': title}),
+                                 headers=self.headers)
+            self.client.post("/v1/bucketlist/1/items/batch",
+                             data=json.dumps([
+                                 {'op': 'create', 'name': 'Visit Lagos'},
+                                 {'op': 'create', 'name': 'Visit Accra'}]),
+                             headers=self.headers)
+            self.client.post("/v1/bucketlist/1/items/batch",
+                             data=json.dumps([{'op': 'toggle', 'id': 1}]),
+                             headers=self.headers)
+            export = self.client.get("/v1/export", headers=self.headers)
+            lines = export.data.decode().splitlines()
+
+            events = self.import_lines(lines, self.test_token_a)
+            self.assertEqual(events[-1], {
+                'type': 'summary', 'lines': 5, 'bucketlists': 3,
+                'items': 2, 'errors': 0})
+            self.assertGreater(len([e for e in events
+                                    if e['type'] == 'progress']), 1)
+
+            bucketlists = Bucketlist.query.filter_by(
+                users_email='test_a@bucket.com').order_by(
+                Bucketlist.title).all()
+            self.assertEqual([b.title for b in bucketlists],
+                             ['2017', '2018', '2019'])
+            self.assertEqual(
+                [(i.name, i.done) for i in bucketlists[0].items],
+                [('Visit Lagos', True), ('Visit Accra', False)])
+
+    def test_import_nested_items(self):
+        """
+        Test if bucketlists with nested items are imported
+        """
+        with self.client:
+            events = self.import_lines([json.dumps({
+                'title': 'Travel',
+                'items': [{'name': 'Visit Lagos', 'done': True},
+                          {'name': 'Visit Accra'}]})], self.test_token)
+            self.assertEqual(events[-1]['items'], 2)
+            bucketlist = Bucketlist.query.filter_by(title='Travel').one()
+            self.assertEqual(
+                [(i.name, i.done) for i in bucketlist.items],
+                [('Visit Lagos', True), ('Visit Accra', False)])
+
+    def test_import_reports_line_errors(self):
+        """
+        Test if bad lines are reported without stopping the import
+        """
+        with self.client:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': 'Taken'}),
+                             headers=self.headers)
+            events = self.import_lines([
+                '{not json',
+                json.dumps({'title': ''}),
+                json.dumps({'title': 'Taken'}),
+                json.dumps({'type': 'item', 'bucketlist_id': 99,
+                            'name': 'Orphan'}),
+                json.dumps({'title': 'Fresh'})], self.test_token)
+
+            errors = {e['line']: e['message'] for e in events
+                      if e['type'] == 'error'}
+            self.assertEqual(sorted(errors), [1, 2, 3, 4])
+            self.assertEqual(errors[2], 'Required fields are empty.')
+            self.assertEqual(errors[3], 'Bucketlist already exists.')
+            self.assertEqual(errors[4], 'Unknown bucketlist.')
+            self.assertEqual(events[-1]['bucketlists'], 1)
+            self.assertEqual(events[-1]['errors'], 4)
+
+    def test_import_isolates_bad_lines(self):
+        """
+        Test if an undecodable line and the items of a rejected bucketlist
+        each report one error without stopping the import
+        """
+        with self.client:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': 'Taken'}),
+                             headers=self.headers)
+            before = datetime.datetime.now()
+            body = b'\n'.join([
+                json.dumps({'title': 'Taken', 'items': [
+                    {'name': 'Dune'}, {'name': 'Emma'}]}).encode(),
+                b'{"title": "\xff\xfe"}',
+                json.dumps({'title': 'Fresh', 'items': [
+                    {'name': 'Ulysses'}]}).encode()]) + b'\n'
+            response = self.client.post(
+                "/v1/import", data=body,
+                headers=self.request_headers(self.test_token,
+                                             'application/x-ndjson'))
+            events = [json.loads(line) for line in
+                      response.data.decode().splitlines()]
+
+            errors = [(e['line'], e['message']) for e in events
+                      if e['type'] == 'error']
+            self.assertEqual([line for line, _ in errors], [1, 2])
+            self.assertEqual(errors[0][1], 'Bucketlist already exists.')
+            self.assertEqual(events[-1]['errors'], 2)
+            self.assertEqual(events[-1]['items'], 1)
+            fresh = Bucketlist.query.filter_by(title='Fresh').one()
+            self.assertGreaterEqual(fresh.date_modified, before)
+
+    def test_import_streams_progress_per_batch(self):
+        """
+        Test if progress is streamed as each batch commits, before the
+        whole body has been read
+        """
+        with self.client:
+            data = ''.join(json.dumps({'title': 'List {}'.format(number)})
+                           + '\n' for number in range(5)).encode()
+            body = io.BytesIO(data)
+            response = self.client.post(
+                "/v1/import", input_stream=body, content_length=len(data),
+                headers=self.request_headers(self.test_token,
+                                             'application/x-ndjson'))
+            self.assertTrue(response.is_streamed)
+            first = json.loads(next(response.response))
+            self.assertEqual((first['type'], first['bucketlists']),
+                             ('progress', 2))
+            self.assertLess(body.tell(), len(data))
+            events = [first] + [json.loads(line)
+                                for line in response.response]
+            response.close()
+            self.assertEqual(
+                [event['bucketlists'] for event in events
+                 if event['type'] == 'progress'], [2, 4, 5])
+            self.assertEqual(events[-1]['type'], 'summary')
+
+    def test_import_refuses_unhashable_ids(self):
+        """
+        Test if ids that are neither integers nor strings are reported as
+        bad lines
+        """
+        with self.client:
+            events = self.import_lines([
+                json.dumps({'title': 'Lists', 'id': [1]}),
+                json.dumps({'type': 'item', 'bucketlist_id': {'id': 1},
+                            'name': 'Objects'}),
+                json.dumps({'title': 'Kept', 'id': 'b1'}),
+                json.dumps({'type': 'item', 'bucketlist_id': 'b1',
+                            'name': 'Strings'})], self.test_token)
+
+            errors = [(e['line'], e['message']) for e in events
+                      if e['type'] == 'error']
+            self.assertEqual(errors, [
+                (1, 'id must be an integer or a string.'),
+                (2, 'bucketlist_id must be an integer or a string.')])
+            self.assertEqual(events[-1]['items'], 1)
+
+
+class SearchTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for title in ['Travel Africa', 'Travel Asia', 'Reading']:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': title}),
+                             headers=self.headers)
+        self.client.post("/v1/bucketlist/1/items/batch",
+                         data=json.dumps([
+                             {'op': 'create', 'name': 'Visit Lagos'},
+                             {'op': 'create', 'name': 'Travel to Accra'}]),
+                         headers=self.headers)
+
+    def search(self, q, token=None):
+        response = self.client.get(
+            "/v1/search", query_string={'q': q},
+            headers={'Authorization': token or self.test_token})
+        return response, json.loads(response.data.decode())
+
+    def test_search_ranks_bucketlists_and_items(self):
+        """
+        Test if search returns ranked bucketlist and item hits
+        """
+        with self.client:
+            response, data = self.search('travel')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(sorted(b['title'] for b in data['bucketlists']),
+                             ['Travel Africa', 'Travel Asia'])
+            self.assertEqual([i['name'] for i in data['items']],
+                             ['Travel to Accra'])
+            ranks = [b['rank'] for b in data['bucketlists']]
+            self.assertEqual(ranks, sorted(ranks, reverse=True))
+
+            response, data = self.search('travel afr')
+            self.assertEqual([b['title'] for b in data['bucketlists']],
+                             ['Travel Africa'])
+
+    def test_search_follows_writes(self):
+        """
+        Test if renamed and deleted rows are reflected in search
+        """
+        with self.client:
+            self.client.put("/v1/bucketlist/3",
+                            data=json.dumps({'title': 'Travel Europe'}),
+                            headers=self.headers)
+            self.client.delete("/v1/bucketlist/2", headers=self.headers)
+            response, data = self.search('travel')
+            self.assertEqual(sorted(b['title'] for b in data['bucketlists']),
+                             ['Travel Africa', 'Travel Europe'])
+
+            self.client.delete("/v1/bucketlist/1", headers=self.headers)
+            response, data = self.search('accra')
+            self.assertEqual(data['items'], [])
+
+    def test_search_is_scoped_to_user(self):
+        """
+        Test if search only returns the user's own rows
+        """
+        with self.client:
+            response, data = self.search('travel', self.test_token_a)
+            self.assertEqual(data['bucketlists'], [])
+            self.assertEqual(data['items'], [])
+
+    def test_search_requires_query(self):
+        """
+        Test if an empty search query is rejected
+        """
+        with self.client:
+            response, data = self.search('  ')
+            self.assertEqual(response.status_code, 400)
+            response, data = self.search('"*')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['bucketlists'], [])
+
+
+class ItemCountsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.post("/v1/bucketlist/",
+                         data=json.dumps({'title': 'Travel'}),
+                         headers=self.headers)
+
+    def counts(self):
+        response = self.client.get("/v1/bucketlist/1", headers=self.headers)
+        data = json.loads(response.data.decode())
+        return data['item_count'], data['done_count']
+
+    def test_counts_follow_item_writes(self):
+        """
+        Test if item_count and done_count follow creates, toggles and
+        deletes
+        """
+        with self.client:
+            self.assertEqual(self.counts(), (0, 0))
+            self.client.post("/v1/bucketlist/1/items/",
+                             data=json.dumps({'name': 'Visit Lagos'}),
+                             headers=self.headers)
+            self.client.post("/v1/bucketlist/1/items/",
+                             data=json.dumps({'name': 'Visit Lagos'}),
+                             headers=self.headers)
+            self.assertEqual(self.counts(), (1, 0))
+
+            self.client.post("/v1/bucketlist/1/items/batch",
+                             data=json.dumps([
+                                 {'op': 'create', 'name': 'Visit Accra',
+                                  'done': True},
+                                 {'op': 'create', 'name': 'Visit Cairo'},
+                                 {'op': 'toggle', 'id': 1}]),
+                             headers=self.headers)
+            self.assertEqual(self.counts(), (3, 2))
+
+            self.client.post("/v1/bucketlist/1/items/batch",
+                             data=json.dumps([
+                                 {'op': 'toggle', 'id': 1},
+                                 {'op': 'delete', 'id': 2},
+                                 {'op': 'update', 'id': 3, 'name': 'Cairo',
+                                  'done': True}]),
+                             headers=self.headers)
+            self.assertEqual(self.counts(), (2, 1))
+
+            self.client.delete("/v1/bucketlist/1/items/3/",
+                               headers=self.headers)
+            self.assertEqual(self.counts(), (1, 0))
+
+            response = self.client.get("/v1/bucketlist/?limit=5",
+                                       headers=self.headers)
+            bucketlist = json.loads(response.data.decode())['bucketlists'][0]
+            self.assertEqual(
+                (bucketlist['item_count'], bucketlist['done_count']), (1, 0))
+
+    def test_counts_follow_imports(self):
+        """
+        Test if imported items are counted
+        """
+        with self.client:
+            response = self.client.post(
+                "/v1/import", data=json.dumps({
+                    'title': 'Reading',
+                    'items': [{'name': 'Dune', 'done': True},
+                              {'name': 'Emma'}]}) + '\n',
+                headers=self.request_headers(self.test_token,
+                                             'application/x-ndjson'))
+            events = [json.loads(line) for line in
+                      response.data.decode().splitlines()]
+            self.assertEqual(events[-1]['items'], 2)
+            bucketlist = Bucketlist.query.filter_by(title='Reading').one()
+            self.assertEqual(
+                (bucketlist.item_count, bucketlist.done_count), (2, 1))
+
+    def test_repair_counts_command(self):
+        """
+        Test if the repair-counts command recomputes drifted counts
+        """
+        with self.client:
+            self.client.post("/v1/bucketlist/1/items/",
+                             data=json.dumps({'name': 'Visit Lagos'}),
+                             headers=self.headers)
+            Bucketlist.query.filter_by(id=1).update(
+                {'item_count': 7, 'done_count': 3})
+            db.session.commit()
+
+            runner = self.client.application.test_cli_runner()
+            result = runner.invoke(args=['repair-counts'])
+            self.assertIn('Repaired 1 bucketlists', result.output)
+            self.assertEqual(self.counts(), (1, 0))
+
+
+class StatsTestCase(BaseTestCase):
+
+    def stats(self, query=''):
+        response = self.client.get("/v1/stats" + query, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response, json.loads(response.data.decode())
+
+    def test_stats_summarize_bucketlists_and_items(self):
+        """
+        Test if stats count bucketlists, items and weekly completions
+        """
+        with self.client:
+            for title in ['Travel', 'Reading', 'Empty']:
+                self.client.post("/v1/bucketlist/",
+                                 data=json.dumps({'title': title}),
+                                 headers=self.headers)
+            self.client.post("/v1/bucketlist/1/items/batch",
+                             data=json.dumps([
+                                 {'op': 'create', 'name': 'Lagos',
+                                  'done': True},
+                                 {'op': 'create', 'name': 'Accra'},
+                                 {'op': 'create', 'name': 'Cairo'}]),
+                             headers=self.headers)
+            self.client.post("/v1/bucketlist/2/items/batch",
+                             data=json.dumps([
+                                 {'op': 'create', 'name': 'Dune',
+                                  'done': True}]),
+                             headers=self.headers)
+            last_year = datetime.datetime.now() - datetime.timedelta(
+                days=365)
+            Items.query.filter_by(name='Dune').update(
+                {'date_modified': last_year})
+            db.session.commit()
+
+            response, data = self.stats('?weeks=4')
+            self.assertEqual(data['bucketlists'], 3)
+            self.assertEqual(data['items'], 4)
+            self.assertEqual(data['done'], 2)
+            self.assertEqual(data['done_ratio'], 0.5)
+            weeks = data['completed_per_week']
+            self.assertEqual(len(weeks), 4)
+            self.assertEqual([week['done'] for week in weeks], [0, 0, 0, 1])
+            monday = datetime.date.today() - datetime.timedelta(
+                days=datetime.date.today().weekday())
+            self.assertEqual(weeks[-1]['week'], monday.isoformat())
+
+    def test_stats_use_one_query_and_cache(self):
+        """
+        Test if stats are one aggregate query, cached until a write
+        """
+        with self.client:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': 'Travel'}),
+                             headers=self.headers)
+            app = self.client.application
+            with count_queries(app) as statements:
+                response, data = self.stats()
+            self.assertEqual(len(statements), 1)
+            self.assertIn('GROUP BY', statements[0])
+
+            with count_queries(app) as statements:
+                response, data = self.stats()
+            self.assertEqual(statements, [])
+            self.assertEqual(response.headers['X-Cache'], 'HIT')
+
+            self.client.post("/v1/bucketlist/1/items/",
+                             data=json.dumps({'name': 'Visit Lagos'}),
+                             headers=self.headers)
+            response, data = self.stats()
+            self.assertEqual(response.headers['X-Cache'], 'MISS')
+            self.assertEqual(data['items'], 1)
+
+    def test_stats_without_bucketlists(self):
+        """
+        Test if a user without bucketlists gets zeroed stats
+        """
+        with self.client:
+            response, data = self.stats()
+            self.assertEqual(data['bucketlists'], 0)
+            self.assertEqual(data['done_ratio'], 0.0)
+            self.assertEqual(len(data['completed_per_week']), 12)
+
+
+class QueryInstrumentationTestCase(BaseTestCase):
+
+    def test_server_timing_reports_queries(self):
+        """
+        Test if responses carry the request's query count and DB time
+        """
+        with self.client:
+            response = self.client.post("/v1/bucketlist/",
+                                        data=json.dumps({'title': '2017'}),
+                                        headers=self.headers)
+            timings = response.headers.getlist('Server-Timing')
+            self.assertEqual(len(timings), 2)
+            self.assertRegex(timings[0], r'^db;dur=[\d.]+;desc="1 query"$')
+            self.assertRegex(timings[1], r'^db-slowest;dur=[\d.]+$')
+
+    def test_requests_are_logged(self):
+        """
+        Test if each request logs a structured line about its queries
+        """
+        app = self.client.application
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        app.logger.addHandler(handler)
+        self.addCleanup(app.logger.removeHandler, handler)
+        # Outside debug mode the app logger has no level of its own
+        self.addCleanup(app.logger.setLevel, app.logger.level)
+        app.logger.setLevel(logging.NOTSET)
+        with self.client:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': '2017'}),
+                             headers=self.headers)
+            # Reaches the app logger's handlers at the default levels
+            record = json.loads(records[0].getMessage())
+            self.assertEqual(record['endpoint'], 'home.bucketlist_api')
+            self.assertEqual(record['status'], 201)
+            self.assertEqual(record['queries'], 1)
+            self.assertTrue(record['slowest'].startswith('INSERT'))
+
+    def test_query_budget(self):
+        """
+        Test if going over the query budget warns, or fails when strict
+        """
+        app = self.client.application
+        app.config['QUERY_BUDGET'] = 0
+        with self.client:
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get("/v1/stats", headers=self.headers)
+
+            app.config['QUERY_BUDGET_ACTION'] = 'warn'
+            with self.assertLogs(query_logger(app), 'WARNING') as logs:
+                response = self.client.post(
+                    "/v1/bucketlist/", data=json.dumps({'title': '2017'}),
+                    headers=self.headers)
+            self.assertEqual(response.status_code, 201)
+            self.assertIn('Query budget exceeded', logs.output[0])
+
+
+class MetricsTestCase(BaseTestCase):
+
+    def scrape(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/plain')
+        return response.data.decode().splitlines()
+
+    def test_metrics_cover_requests_pool_and_cache(self):
+        """
+        Test if /metrics reports requests, latency, the pool and the cache
+        """
+        with self.client:
+            self.client.post("/v1/bucketlist/",
+                             data=json.dumps({'title': '2017'}),
+                             headers=self.headers)
+            self.client.get("/v1/stats", headers=self.headers)
+            self.client.get("/v1/stats", headers=self.headers)
+            lines = self.scrape()
+
+            self.assertIn(
+                'bucketlist_http_requests_total{blueprint="home",'
+                'endpoint="home.bucketlist_api",method="POST",status="201"}'
+                ' 1.0', lines)
+            self.assertIn(
+                'bucketlist_http_request_duration_seconds_count{'
+                'blueprint="home",endpoint="home.stats_api"} 2.0', lines)
+            self.assertIn(
+                'bucketlist_http_request_duration_seconds_bucket{'
+                'blueprint="home",endpoint="home.stats_api",le="+Inf"} 2.0',
+                lines)
+            self.assertIn('bucketlist_http_requests_in_flight 1.0', lines)
+            self.assertTrue(any(
+                line.startswith('bucketlist_db_pool_checkout_wait_seconds_'
+                                'count ') for line in lines))
+            self.assertIn('bucketlist_response_cache_hit_ratio 0.5', lines)
+            self.assertIn('# TYPE bucketlist_http_request_duration_seconds '
+                          'histogram', lines)
+
+    def test_metrics_add_up_worker_files(self):
+        """
+        Test if values written by other worker processes are added up, and
+        those of exited workers folded into one file
+        """
+        directory = tempfile.mkdtemp()
+        app = self.client.application
+        metrics = Metrics(directory, cache=None)
+        self.addCleanup(metrics.stop)
+        app.extensions['metrics'] = metrics
+        labels = [['blueprint', ''], ['endpoint', 'metrics'],
+                  ['method', 'GET'], ['status', '200']]
+        # A worker that is still running, one that has exited and one that
+        # exited leaving its pid to this process
+        for pid, in_flight in ((os.getppid(), 2), (2 ** 22 + 1, 5),
+                               (os.getpid(), 4)):
+            with open(metrics.path(pid), 'w') as stream:
+                json.dump({'pid': pid, 'in_flight': in_flight,
+                           'counters': [['bucketlist_http_requests_total',
+                                         labels, 3]],
+                           'histograms': []}, stream)
+        with self.client:
+            self.client.get("/metrics")
+            lines = self.scrape()
+            self.assertIn(
+                'bucketlist_http_requests_total{blueprint="",'
+                'endpoint="metrics",method="GET",status="200"} 10.0', lines)
+            self.assertIn('bucketlist_http_requests_in_flight 3.0', lines)
+            self.assertFalse(os.path.exists(metrics.path(2 ** 22 + 1)))
+            self.assertTrue(os.path.exists(metrics.path('exited')))
+
+            metrics.flush(force=True)
+            with open(metrics.path(os.getpid())) as stream:
+                self.assertEqual(json.load(stream)['pid'], os.getpid())
+
+    def test_busy_and_idle_workers_flush_on_interval(self):
+        """
+        Test if a worker rewrites its file at most once per interval,
+        whether or not requests are in flight
+        """
+        metrics = Metrics(tempfile.mkdtemp(), flush_interval=60)
+        self.addCleanup(metrics.stop)
+        metrics.flush()
+        metrics.inc('bucketlist_http_requests_total')
+        metrics.flush()
+        with open(metrics.path(os.getpid())) as stream:
+            self.assertEqual(json.load(stream)['counters'], [])
+        metrics.flush(force=True)
+        with open(metrics.path(os.getpid())) as stream:
+            self.assertEqual(len(json.load(stream)['counters']), 1)
+
+    def test_idle_worker_flushes_last_values(self):
+        """
+        Test if values recorded after a worker's last flush are written
+        without another request
+        """
+        metrics = Metrics(tempfile.mkdtemp(), flush_interval=0.05)
+        self.addCleanup(metrics.stop)
+        metrics.flush()
+        metrics.inc('bucketlist_http_requests_total')
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with open(metrics.path(os.getpid())) as stream:
+                if json.load(stream)['counters']:
+                    break
+            time.sleep(0.01)
+        else:
+            self.fail('Values of an idle worker were never written')
+
+    def test_metrics_token_required(self):
+        """
+        Test if /metrics refuses scrapes without the configured token
+        """
+        self.client.application.config['METRICS_TOKEN'] = 's3cret'
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+            "/metrics", headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+            "/metrics", headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 200)
+
+
+class SeedCommandTestCase(BaseTestCase):
+
+    def test_seed_generates_consistent_data(self):
+        """
+        Test if the seed command bulk generates users, bucketlists and
+        items with consistent counts
+        """
+        runner = self.client.application.test_cli_runner()
+        result = runner.invoke(args=['seed', '--users', '50',
+                                     '--bucketlists', '4', '--items', '6',
+                                     '--seed', '1'])
+        self.assertIsNone(result.exception)
+        self.assertIn('Seeded', result.output)
+
+        self.assertEqual(User.query.count(), 52)
+        self.assertGreater(Bucketlist.query.count(), 50)
+        self.assertEqual(Items.query.count(), db.session.query(
+            db.func.sum(Bucketlist.item_count)).scalar())
+        self.assertEqual(Bucketlist.recount(), 0)
+        oldest = db.session.query(db.func.min(Items.date_created)).scalar()
+        self.assertLess(oldest, datetime.datetime.now() -
+                        datetime.timedelta(days=30))
+
+        seeded = User.query.filter(User.email.like('%@seed.example.com'))
+        user = seeded.first()
+        self.assertTrue(user.verify_password('password'))
+        response = self.client.post(
+            "/v1/bucketlist/", data=json.dumps({'title': 'After seeding'}),
+            headers=self.request_headers(
+                user.encode_auth_token(user.email)))
+        self.assertEqual(response.status_code, 201)
+
+
+class VerifiedTokenCacheTestCase(BaseTestCase):
+
+    def get_bucketlists(self, token):
+        return self.client.get("/v1/bucketlist/",
+                               headers=self.request_headers(token))
+
+    def test_token_verified_once(self):
+        """
+        Test if repeated requests with one token reuse its verified claims
+        while a tampered copy is still refused
+        """
+        cache = self.client.application.extensions['token_cache']
+        self.assertEqual(self.get_bucketlists(self.test_token).status_code,
+                         404)
+        self.assertEqual(self.get_bucketlists(self.test_token).status_code,
+                         404)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        header, payload, signature = self.test_token.split('.')
+        forged = '.'.join([header, payload, signature[::-1]])
+        self.assertEqual(self.get_bucketlists(forged).status_code, 401)
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_cached_token_expires(self):
+        """
+        Test if a cached token is dropped when it expires and the cache
+        stays within its bound
+        """
+        cache = VerifiedTokenCache(max_entries=2)
+        claims = {'exp': time.time() + 0.05, 'email': 'test@bucket.com'}
+        cache.set('token', claims)
+        self.assertEqual(cache.get('token'), claims)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('token'))
+
+        claims['exp'] += 60
+        for token in ('a', 'b', 'c'):
+            cache.set(token, claims)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['entries'], 2)
+
+
+class PasswordHashingTestCase(BaseTestCase):
+
+    def login(self):
+        return self.client.post("/v1/auth/login/",
+                                data=json.dumps({
+                                    'email': 'test@bucket.com',
+                                    'password': 'password'
+                                }),
+                                content_type='application/json')
+
+    def test_login_rehashes_outdated_hash(self):
+        """
+        Test if logging in replaces a hash made with outdated parameters
+        """
+        self.client.application.config[
+            'PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        self.assertEqual(self.login().status_code, 200)
+        user = User.query.filter_by(email='test@bucket.com').first()
+        db.session.refresh(user)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_full_hashing_pool_refuses_login(self):
+        """
+        Test if logins are refused with a 503 while the hashing pool and
+        its queue are full
+        """
+        pool = HashingPool(workers=1, max_queue=0)
+        self.client.application.extensions['hashing_pool'] = pool
+        started, release = threading.Event(), threading.Event()
+
+        def busy():
+            started.set()
+            release.wait(5)
+
+        waiting = threading.Thread(target=pool.run, args=(busy,))
+        waiting.start()
+        started.wait(5)
+        try:
+            response = self.login()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            self.assertEqual(pool.rejected, 1)
+        finally:
+            release.set()
+            waiting.join()
+        self.assertEqual(self.login().status_code, 200)
+
+
+class LoginThrottleTestCase(BaseTestCase):
+
+    def login(self, email, password='wrong'):
+        return self.client.post("/v1/auth/login/",
+                                data=json.dumps({
+                                    'email': email,
+                                    'password': password
+                                }),
+                                content_type='application/json')
+
+    def test_repeated_logins_throttled_per_email(self):
+        """
+        Test if attempts past the per email limit are refused with
+        Retry-After before the user is looked up
+        """
+        for _ in range(5):
+            self.assertEqual(self.login('test@bucket.com').status_code, 400)
+        with count_queries(self.client.application) as statements:
+            response = self.login('Test@Bucket.com ', 'password')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(int(response.headers['Retry-After']), range(1, 13))
+        self.assertEqual(statements, [])
+
+        response = self.login('test_a@bucket.com', 'password')
+        self.assertEqual(response.status_code, 200)
+
+    def test_forwarded_addresses_throttled_apart(self):
+        """
+        Test if clients behind a trusted proxy are throttled by the address
+        it forwards, not the proxy's own address
+        """
+        app = self.client.application
+        app.wsgi_app = trust_proxies(app.wsgi_app, 1)
+        app.extensions['login_throttle'] = ThrottlePolicy(
+            SharedThrottleBackend(LocalSharedClient()),
+            address_limit=(1, 60))
+
+        def login(*forwarded_for):
+            headers = self.request_headers()
+            headers['X-Forwarded-For'] = ', '.join(forwarded_for)
+            return self.client.post(
+                "/v1/auth/login/",
+                data=json.dumps({'email': 'nobody@bucket.com',
+                                 'password': 'wrong'}),
+                headers=headers)
+
+        self.assertEqual(login('10.0.0.1').status_code, 400)
+        self.assertEqual(login('10.0.0.1').status_code, 429)
+        self.assertEqual(login('10.0.0.2').status_code, 400)
+        # Only the address the trusted proxy appended counts
+        self.assertEqual(login('10.0.0.3', '10.0.0.1').status_code, 429)
+
+    def test_shared_backend_limits_addresses(self):
+        """
+        Test if buckets kept in a shared store limit each address and
+        refill over time
+        """
+        policy = ThrottlePolicy(SharedThrottleBackend(LocalSharedClient()),
+                                address_limit=(2, 0.2))
+        self.assertEqual(policy.check(None, '10.0.0.1'), 0)
+        self.assertEqual(policy.check(None, '10.0.0.1'), 0)
+        self.assertGreater(policy.check(None, '10.0.0.1'), 0)
+        self.assertEqual(policy.check(None, '10.0.0.2'), 0)
+        time.sleep(0.15)
+        self.assertEqual(policy.check(None, '10.0.0.1'), 0)
+        self.assertEqual(policy.rejected, 1)
+
+
+class RefreshTokenTestCase(BaseTestCase):
+
+    def post(self, url, payload=None, token=None):
+        return self.client.post(url, data=json.dumps(payload or {}),
+                                headers=self.request_headers(token))
+
+    def get_bucketlists(self, token):
+        return self.client.get("/v1/bucketlist/",
+                               headers={'Authorization': token})
+
+    def login(self):
+        response = self.post("/v1/auth/login/", {
+            'email': 'test@bucket.com', 'password': 'password'})
+        return json.loads(response.data.decode())
+
+    def test_refresh_tokens_rotate(self):
+        """
+        Test if a refresh token is exchanged for new tokens only once and
+        cannot be used in place of an access token
+        """
+        tokens = self.login()
+        self.assertEqual(tokens['expires_in'], 900)
+        claims = jwt.decode(tokens['auth_token'][4:], verify=False)
+        self.assertEqual(claims['exp'] - claims['iat'], 900)
+
+        response = self.post("/v1/auth/refresh/",
+                             {'refresh_token': tokens['refresh_token']})
+        self.assertEqual(response.status_code, 200)
+        renewed = json.loads(response.data.decode())
+        self.assertNotEqual(renewed['refresh_token'],
+                            tokens['refresh_token'])
+        self.assertEqual(self.get_bucketlists(
+            renewed['auth_token']).status_code, 404)
+
+        response = self.post("/v1/auth/refresh/",
+                             {'refresh_token': tokens['refresh_token']})
+        self.assertEqual(response.status_code, 401)
+        response = self.post("/v1/auth/refresh/",
+                             {'refresh_token': tokens['auth_token'][4:]})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.get_bucketlists(
+            'JWT ' + renewed['refresh_token']).status_code, 401)
+
+    def test_logout_revokes_tokens(self):
+        """
+        Test if logging out revokes the access and refresh tokens, while
+        other tokens are checked without querying revoked tokens
+        """
+        tokens = self.login()
+        with count_queries(self.client.application) as statements:
+            self.assertEqual(self.get_bucketlists(
+                tokens['auth_token']).status_code, 404)
+        self.assertFalse([statement for statement in statements
+                          if 'revoked_token' in statement])
+
+        response = self.post("/v1/auth/logout/",
+                             {'refresh_token': tokens['refresh_token']},
+                             token=tokens['auth_token'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_bucketlists(
+            tokens['auth_token']).status_code, 401)
+        response = self.post("/v1/auth/refresh/",
+                             {'refresh_token': tokens['refresh_token']})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.get_bucketlists(self.test_token).status_code,
+                         404)
+
+    def test_other_workers_see_revocations_after_sync(self):
+        """
+        Test if a revocation list loads tokens revoked elsewhere when it
+        syncs
+        """
+        revocations = RevocationList(bits=1024, hashes=3)
+        revocations.sync()
+        claims = jwt.decode(self.test_token[4:], verify=False)
+        self.assertFalse(revocations.is_revoked(claims['jti']))
+        db.session.add(RevokedToken(
+            jti=claims['jti'],
+            expires_at=datetime.datetime.utcfromtimestamp(claims['exp'])))
+        db.session.commit()
+        self.assertFalse(revocations.is_revoked(claims['jti']))
+        revocations.sync()
+        self.assertTrue(revocations.is_revoked(claims['jti']))
+
+    def test_replayed_refresh_token_refused(self):
+        """
+        Test if a refresh token is refused once rotated, while the one
+        that replaced it still works
+        """
+        tokens = self.login()
+        response = self.post("/v1/auth/refresh/",
+                             {'refresh_token': tokens['refresh_token']})
+        self.assertEqual(response.status_code, 200)
+        renewed = json.loads(response.data.decode())
+
+        response = self.post("/v1/auth/refresh/",
+                             {'refresh_token': tokens['refresh_token']})
+        self.assertEqual(response.status_code, 401)
+        response = self.post("/v1/auth/refresh/",
+                             {'refresh_token': renewed['refresh_token']})
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh_rotations_stay_out_of_filter(self):
+        """
+        Test if exchanged refresh tokens are recorded by kind and only
+        revoked access tokens are loaded into the filter
+        """
+        tokens = self.login()
+        self.post("/v1/auth/refresh/",
+                  {'refresh_token': tokens['refresh_token']})
+        self.post("/v1/auth/logout/", token=tokens['auth_token'])
+        self.assertEqual(
+            sorted(token.kind for token in RevokedToken.query.all()),
+            ['access', 'refresh'])
+
+        revocations = RevocationList(bits=1024, hashes=3)
+        revocations.sync()
+        for token in RevokedToken.query.all():
+            self.assertEqual(token.jti in revocations.filter,
+                             token.kind == 'access')
+
+    def test_expired_revocations_pruned(self):
+        """
+        Test if rows of expired tokens are deleted by the prune-tokens
+        command and never by a sync
+        """
+        now = datetime.datetime.utcnow()
+        for jti, expires_at in (('old', now - datetime.timedelta(hours=1)),
+                                ('live', now + datetime.timedelta(hours=1))):
+            db.session.add(RevokedToken(jti=jti, expires_at=expires_at))
+        db.session.commit()
+
+        runner = self.client.application.test_cli_runner()
+        result = runner.invoke(args=['prune-tokens'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Pruned 1 revoked tokens', result.output)
+        self.assertEqual(
+            [token.jti for token in RevokedToken.query.all()], ['live'])
+
+        db.session.add(RevokedToken(
+            jti='older', expires_at=now - datetime.timedelta(days=1)))
+        db.session.commit()
+        RevocationList().sync()
+        self.assertEqual(RevokedToken.query.count(), 2)
+
+    def test_filter_rebuilt_in_background(self):
+        """
+        Test if a loaded revocation list picks up tokens revoked elsewhere
+        without a request syncing it
+        """
+        revocations = RevocationList(bits=1024, hashes=3,
+                                     sync_interval=0.05)
+        revocations.load()
+        self.addCleanup(revocations.stop)
+        claims = jwt.decode(self.test_token[4:], verify=False)
+        db.session.add(RevokedToken(
+            jti=claims['jti'], kind='access',
+            expires_at=datetime.datetime.utcfromtimestamp(claims['exp'])))
+        db.session.commit()
+        for _ in range(100):
+            if claims['jti'] in revocations.filter:
+                break
+            time.sleep(0.02)
+        self.assertTrue(revocations.is_revoked(claims['jti']))
+
+
+class PayloadValidationTestCase(BaseTestCase):
+
+    def post(self, url, payload):
+        return self.client.post(url, data=json.dumps(payload),
+                                headers=self.headers)
+
+    def test_fields_match_columns(self):
+        """
+        Test if payloads are refused when a field has the wrong type or is
+        longer than its column
+        """
+        with self.client:
+            response = self.post("/v1/bucketlist/", {'title': 'x' * 26})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data.decode())['message'],
+                             'title must be at most 25 characters.')
+            response = self.post("/v1/bucketlist/", {'title': 2017})
+            self.assertEqual(json.loads(response.data.decode())['message'],
+                             'title must be a string.')
+            self.assertEqual(Bucketlist.query.count(), 0)
+
+            response = self.post("/v1/bucketlist/", {'title': 'x' * 25})
+            self.assertEqual(response.status_code, 201)
+            bucketlist = Bucketlist.query.first()
+            response = self.post(
+                "/v1/bucketlist/{}/items/".format(bucketlist.id),
+                {'name': 'Climb', 'done': 'yes'})
+            self.assertEqual(response.status_code, 400)
+            response = self.post("/v1/auth/register/", {
+                'email': 'new@bucket.com', 'username': 'u' * 26,
+                'first_name': 'new', 'last_name': 'user',
+                'password': 'password'})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data.decode())['message'],
+                             'username must be at most 25 characters.')
+
+    def test_oversized_body_refused_before_parsing(self):
+        """
+        Test if a body over MAX_JSON_BODY_BYTES is refused with 413
+        """
+        self.client.application.config['MAX_JSON_BODY_BYTES'] = 64
+        with self.client:
+            response = self.client.post(
+                "/v1/bucketlist/", data='{"title": "' + 'x' * 100,
+                headers=self.headers)
+            self.assertEqual(response.status_code, 413)
+            response = self.post("/v1/bucketlist/", {'title': 'Short'})
+            self.assertEqual(response.status_code, 201)
+
+    def test_login_and_batch_bodies_validated(self):
+        """
+        Test if login and items batch bodies are size checked and a
+        missing login body is refused rather than failing
+        """
+        with self.client:
+            response = self.client.post("/v1/auth/login/")
+            self.assertEqual(response.status_code, 400)
+            response = self.post("/v1/auth/login/", {
+                'email': 'test@bucket.com', 'password': 'p' * 129})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data.decode())['message'],
+                             'password must be at most 128 characters.')
+
+            self.post("/v1/bucketlist/", {'title': 'Reading'})
+            self.client.application.config['MAX_JSON_BODY_BYTES'] = 64
+            response = self.post("/v1/bucketlist/1/items/batch", [
+                {'op': 'create', 'name': 'Book {}'.format(number)}
+                for number in range(10)])
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(Items.query.count(), 0)